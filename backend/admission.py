@@ -0,0 +1,106 @@
+"""
+Admission control: token-bucket rate limits and a circuit breaker for the LLM provider.
+
+Both keep their state in process memory, so with several workers each one enforces the
+limits on its own share of the traffic. The global limits (roadmap queue depth, LLM calls in
+flight across every worker and node) live with the job queue in the shared database.
+"""
+import math
+import time
+import threading
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """One token bucket per key: `burst` requests at once, refilled at `rate` per second.
+
+    A rate of 0 or less disables the limiter. The least recently used buckets are dropped
+    beyond `max_keys`; a dropped bucket comes back full, which only ever errs towards allowing.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, cost: float = 1.0, now: float = None) -> float:
+        """Take `cost` tokens from `key`'s bucket: 0 when admitted, else seconds until it would be."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failures; after `reset_timeout`
+    one probe call is let through (half-open), and its outcome closes or re-opens the circuit.
+    """
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if self._probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_after(self) -> int:
+        """Seconds until the next probe is allowed (0 unless open)."""
+        if self.state != self.OPEN:
+            return 0
+        return max(1, math.ceil(self.reset_timeout - (time.monotonic() - self.opened_at)))
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; in half-open state only one probe at a time does."""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self):
+        """A call ended without an outcome (cancelled); let the next probe through."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok: bool):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
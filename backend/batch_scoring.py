@@ -0,0 +1,295 @@
+"""
+Vectorized bulk scoring for batch assessments.
+
+Answers are loaded into a (sessions x questions) points matrix and scored with NumPy,
+producing exactly what `compute_scores` produces one session at a time: same float64
+pillar means, same round-half-even, same maturity thresholds. Rows that can't be scored
+yield `{"row", "session_id", "error"}` in their place, so one bad row never ends a batch.
+
+`CsvReader` and `SessionsReader` take a request body piece by piece and hand back whole
+rows, so the API can score an upload chunk by chunk without holding all of it.
+
+    python batch_scoring.py answers.csv > scores.ndjson
+    python batch_scoring.py --bench 1000000
+"""
+import io
+import re
+import csv
+import sys
+import json
+import time
+import numpy as np
+
+from catalogue import canonical_answer
+
+LEVEL_NAMES = np.array(["Traditional", "Initial", "Advanced", "Optimal"])
+LEVEL_THRESHOLDS = np.array([30, 55, 80])  # lower bounds of Initial, Advanced, Optimal
+DEFAULT_POINTS = 10  # anything not in the score map, including a missing answer
+
+
+class ScoringModel:
+    """Question layout and lookup tables shared by every chunk of a batch."""
+
+    def __init__(self, questions: list, score_map: dict):
+        self.question_ids = [q["id"] for q in questions]
+        self.pillars = list(dict.fromkeys(q["pillar"] for q in questions))
+        self.score_map = dict(score_map)
+        self.default_points = self.score_map.get("unknown", DEFAULT_POINTS)
+        # (questions x pillars) 0/1 membership matrix: points @ membership = per-pillar sums
+        self.membership = np.zeros((len(questions), len(self.pillars)), dtype=np.int64)
+        for i, q in enumerate(questions):
+            self.membership[i, self.pillars.index(q["pillar"])] = 1
+        self.counts = self.membership.sum(axis=0)
+
+    def points(self, raw) -> int:
+        return self.score_map.get(canonical_answer(raw), DEFAULT_POINTS)
+
+    def encode(self, answer_dicts: list) -> np.ndarray:
+        """API-shaped answers dicts -> int16 points matrix."""
+        out = np.empty((len(answer_dicts), len(self.question_ids)), dtype=np.int16)
+        for j, qid in enumerate(self.question_ids):
+            out[:, j] = [self.points((a.get(qid) or {}).get("answer", "unknown")) for a in answer_dicts]
+        return out
+
+    def encode_rows(self, rows: list, columns: dict) -> np.ndarray:
+        """CSV rows (lists of answer strings) -> int16 points matrix; `columns` maps question id -> column index."""
+        out = np.full((len(rows), len(self.question_ids)), self.default_points, dtype=np.int16)
+        for j, qid in enumerate(self.question_ids):
+            col = columns.get(qid)
+            if col is not None:
+                out[:, j] = [self.points(r[col] if col < len(r) and r[col] != "" else None) for r in rows]
+        return out
+
+    def score(self, points: np.ndarray):
+        """Points matrix -> (pillar means, rounded pillar scores, level indices, overall scores)."""
+        sums = points.astype(np.int64) @ self.membership
+        means = sums / self.counts  # float64, same as sum(scores) / len(scores)
+        rounded = np.rint(means).astype(np.int64)  # round-half-even, same as round()
+        levels = np.searchsorted(LEVEL_THRESHOLDS, means, side="right")
+        overall = np.rint(rounded.sum(axis=1) / len(self.pillars)).astype(np.int64)
+        return means, rounded, levels, overall
+
+    def records(self, session_ids: list, points: np.ndarray):
+        """Yield one `{"session_id", "overall_score", "pillar_scores"}` dict per row."""
+        _, rounded, levels, overall = self.score(points)
+        names = LEVEL_NAMES[levels]
+        rounded = rounded.tolist()
+        names = names.tolist()
+        overall = overall.tolist()
+        for i, sid in enumerate(session_ids):
+            yield {
+                "session_id": sid,
+                "overall_score": overall[i],
+                "pillar_scores": {p: {"score": rounded[i][k], "level": names[i][k]} for k, p in enumerate(self.pillars)},
+            }
+
+
+def _merge(model, chunk, encode):
+    """Score the valid `(row, session_id, data, error)` entries of `chunk`; errors keep their place."""
+    valid = [c for c in chunk if c[3] is None]
+    records = model.records([c[1] for c in valid], encode([c[2] for c in valid])) if valid else iter(())
+    for row, sid, _, error in chunk:
+        yield next(records) if error is None else {"row": row, "session_id": sid, "error": error}
+
+
+def _session_error(s):
+    if not isinstance(s, dict):
+        return "expected an object"
+    if not isinstance(s.get("session_id"), str) or not s["session_id"]:
+        return "session_id must be a non-empty string"
+    answers = s.get("answers")
+    if answers is not None and (not isinstance(answers, dict) or
+                                not all(a is None or isinstance(a, dict) for a in answers.values())):
+        return 'answers must map question ids to {"answer": ...} objects'
+    return None
+
+
+def score_sessions(model: ScoringModel, sessions, chunk_size: int = 10000, start: int = 1):
+    """Score an iterable of `{"session_id", "answers"}` dicts in fixed-size chunks; rows count from `start`."""
+    chunk = []
+    for row, s in enumerate(sessions, start):
+        error = _session_error(s)
+        sid = s.get("session_id") if isinstance(s, dict) else None
+        chunk.append((row, sid, None if error else s.get("answers") or {}, error))
+        if len(chunk) >= chunk_size:
+            yield from _merge(model, chunk, model.encode)
+            chunk = []
+    if chunk:
+        yield from _merge(model, chunk, model.encode)
+
+
+def score_csv_lines(model: ScoringModel, lines, chunk_size: int = 10000, start: int = 1):
+    """Score CSV text lines with a `session_id` column plus one column per question id.
+
+    Data rows count from `start`; a row with no session_id or more fields than the header is an error.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [h.strip() for h in header]
+    if "session_id" not in header:
+        raise ValueError("CSV header must include a session_id column")
+    sid_col = header.index("session_id")
+    columns = {name: i for i, name in enumerate(header)}
+
+    def encode(rows):
+        return model.encode_rows(rows, columns)
+
+    chunk = []
+    for row, r in enumerate(reader, start):
+        if not r:
+            continue
+        sid = r[sid_col] if sid_col < len(r) else ""
+        error = None
+        if not sid:
+            error = "session_id is empty"
+        elif len(r) > len(header):
+            error = f"{len(r)} fields but the header has {len(header)}"
+        chunk.append((row, sid or None, r, error))
+        if len(chunk) >= chunk_size:
+            yield from _merge(model, chunk, encode)
+            chunk = []
+    if chunk:
+        yield from _merge(model, chunk, encode)
+
+
+class CsvReader:
+    """Incremental text/csv body: `feed` decoded text, get back the complete records.
+
+    A newline inside a quoted field does not end the record: the reader keeps the quote parity
+    of the unfinished record across feeds, so a record may span lines and chunks.
+    """
+
+    def __init__(self):
+        self.header = None
+        self._tail = ""
+        self._quoted = False
+
+    def feed(self, text: str) -> list:
+        *complete, last = text.split("\n")
+        records, record = [], self._tail
+        for piece in complete:
+            record += piece
+            self._quoted ^= piece.count('"') % 2 == 1
+            if self._quoted:
+                record += "\n"
+            else:
+                records.append(record)
+                record = ""
+        self._quoted ^= last.count('"') % 2 == 1
+        self._tail = record + last
+        if self.header is None and records:
+            self.header = records.pop(0)
+            if "session_id" not in [h.strip() for h in next(csv.reader([self.header]), [])]:
+                raise ValueError("CSV header must include a session_id column")
+        return records
+
+    def close(self) -> list:
+        """The last record, if the body did not end with a newline."""
+        records = self.feed("\n") if self._tail else []
+        if self._tail:  # the body ended inside a quoted field; csv reads the rest as that field
+            records.append(self._tail)
+            self._tail, self._quoted = "", False
+        if self.header is None:
+            raise ValueError("CSV header must include a session_id column")
+        return records
+
+    def score(self, model: ScoringModel, lines: list, start: int):
+        return score_csv_lines(model, [self.header, *lines], start=start)
+
+
+class SessionsReader:
+    """Incremental `{"sessions": [...]}` body: `feed` decoded text, get back each complete entry."""
+
+    HEAD = re.compile(r'\s*\{\s*"sessions"\s*:\s*\[')
+    SPACE = re.compile(r"\s*")
+    EXPECTED = 'Expected text/csv or a JSON body of the form {"sessions": [...]}'
+    MAX_ENTRY = 1 << 20
+
+    def __init__(self):
+        self._buf = ""
+        self._state = "head"  # head -> first -> (entry <-> next) -> tail -> done
+        self._decode = json.JSONDecoder().raw_decode
+
+    def feed(self, text: str) -> list:
+        buf, pos, out = self._buf + text, 0, []
+        while True:
+            if self._state == "head":
+                m = self.HEAD.match(buf)
+                if m is None:
+                    if len(buf) > 256:
+                        raise ValueError(self.EXPECTED)
+                    break
+                pos, self._state = m.end(), "first"
+            pos = self.SPACE.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            ch = buf[pos]
+            if (self._state == "first" and ch == "]") or (self._state == "next" and ch in ",]"):
+                pos, self._state = pos + 1, "entry" if ch == "," else "tail"
+            elif self._state in ("first", "entry"):
+                try:
+                    entry, end = self._decode(buf, pos)
+                except ValueError:
+                    entry, end = None, None
+                # Incomplete (or a number that may go on in the next piece): wait for more.
+                if end is None or end == len(buf) and isinstance(entry, (int, float)):
+                    if len(buf) - pos > self.MAX_ENTRY:
+                        raise ValueError("a sessions entry is not valid JSON or larger than 1 MiB")
+                    break
+                out.append(entry)
+                pos, self._state = end, "next"
+            elif self._state == "tail" and ch == "}":
+                pos, self._state = pos + 1, "done"
+            else:
+                raise ValueError(f"unexpected {ch!r} in the sessions array" if self._state != "done" else "unexpected data after the body")
+        self._buf = buf[pos:]
+        return out
+
+    def close(self) -> list:
+        if self._state == "head":
+            raise ValueError(self.EXPECTED)
+        if self._state != "done":
+            raise ValueError("the sessions array is cut off or not valid JSON")
+        return []
+
+    def score(self, model: ScoringModel, entries: list, start: int):
+        return score_sessions(model, entries, start=start)
+
+
+def ndjson(records):
+    for r in records:
+        yield json.dumps(r, separators=(",", ":")) + "\n"
+
+
+def bench(model: ScoringModel, n: int, seed: int = 0) -> dict:
+    """Time vectorized scoring of `n` random sessions (excluding input parsing)."""
+    rng = np.random.default_rng(seed)
+    values = np.array(sorted(set(model.score_map.values())), dtype=np.int16)
+    points = values[rng.integers(0, len(values), size=(n, len(model.question_ids)))]
+    started = time.perf_counter()
+    model.score(points)
+    scored = time.perf_counter() - started
+    started = time.perf_counter()
+    for _ in model.records([str(i) for i in range(n)], points):
+        pass
+    materialized = time.perf_counter() - started
+    return {
+        "sessions": n,
+        "score_seconds": round(scored, 4),
+        "records_seconds": round(materialized, 4),
+        "sessions_per_second": round(n / scored) if scored else None,
+    }
+
+
+if __name__ == "__main__":
+    from main import catalogue
+
+    model = ScoringModel(catalogue.current.questions, catalogue.current.score_map)
+    if len(sys.argv) > 2 and sys.argv[1] == "--bench":
+        print(json.dumps(bench(model, int(sys.argv[2]))))
+    else:
+        src = open(sys.argv[1], newline="") if len(sys.argv) > 1 else io.TextIOWrapper(sys.stdin.buffer, newline="")
+        for line in ndjson(score_csv_lines(model, src)):
+            sys.stdout.write(line)
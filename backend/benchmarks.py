@@ -0,0 +1,115 @@
+"""
+Peer benchmarking from incremental histogram rollups.
+
+`benchmark_rollups` keeps, per (region, pillar), how many completed assessments landed
+on each integer score 0..100. submit_answers moves a session's contribution from its
+old scores to its new ones inside the same write transaction, so a benchmark query is
+O(pillars x 101) no matter how many sessions exist.
+"""
+import json
+
+OVERALL = "Overall"
+PERCENTILES = (25, 50, 75, 90)
+HISTOGRAM_BINS = 10
+
+
+class BenchmarkRollups:
+    def __init__(self, db, pillars: list):
+        self.db = db
+        self.pillars = list(pillars) + [OVERALL]
+
+    def lock(self, con):
+        """Keep `rebuild` out until `con`'s transaction ends; take it before touching sessions rows."""
+        self.db.lock(con, "benchmark_rollups", shared=True)
+
+    def apply(self, con, region: str, old_scores=None, new_scores=None):
+        """Move one session from `old_scores` to `new_scores` ({pillar: int score}; None = not counted)."""
+        deltas = {}
+        for scores, step in ((old_scores, -1), (new_scores, 1)):
+            for pillar, score in (scores or {}).items():
+                key = (pillar, int(score))
+                deltas[key] = deltas.get(key, 0) + step
+        # Sorted, so concurrent transactions lock the rollup rows in the same order.
+        rows = sorted(((region or "").upper(), p, s, d) for (p, s), d in deltas.items() if d)
+        if rows:
+            con.executemany("""
+                INSERT INTO benchmark_rollups (region, pillar, score, n) VALUES (?,?,?,?)
+                ON CONFLICT(region, pillar, score) DO UPDATE SET n = benchmark_rollups.n + excluded.n
+            """, rows)
+
+    def rebuild(self, pillar_columns: dict, question_ids: list):
+        """Compaction: recount every completed assessment (all of `question_ids` answered) from the
+        sessions table and the archive index."""
+        with self.db.connection(write=True) as con:
+            self.db.lock(con, "benchmark_rollups")
+            con.execute("DELETE FROM benchmark_rollups")
+            con.execute(f"""
+                UPDATE sessions SET in_benchmark = CAST((
+                    SELECT COUNT(*) FROM answers a WHERE a.session_id = sessions.id AND a.answer IS NOT NULL
+                    AND a.question_id IN ({','.join('?' * len(question_ids))})
+                ) = ? AS INTEGER)
+                WHERE answers_normalized = 1
+            """, (*question_ids, len(question_ids)))
+            cols = ", ".join(pillar_columns.values())
+            for r in con.execute(f"SELECT region, overall_score, {cols} FROM sessions WHERE in_benchmark = 1").fetchall():
+                scores = {p: round(r[c]) for p, c in pillar_columns.items()}
+                scores[OVERALL] = r["overall_score"]
+                self.apply(con, r["region"], None, scores)
+            for r in con.execute("SELECT region, scores FROM archived_sessions WHERE scores IS NOT NULL").fetchall():
+                self.apply(con, r["region"], None, json.loads(r["scores"]))
+            con.execute("DELETE FROM benchmark_rollups WHERE n <= 0")
+
+    def is_empty(self) -> bool:
+        with self.db.connection() as con:
+            return con.execute("SELECT 1 FROM benchmark_rollups LIMIT 1").fetchone() is None
+
+    def histograms(self, region: str) -> dict:
+        """{pillar: [count at score 0, ..., count at score 100]}; region "ALL" sums every region."""
+        hist = {p: [0] * 101 for p in self.pillars}
+        with self.db.connection() as con:
+            if region.upper() == "ALL":
+                rows = con.execute("SELECT pillar, score, SUM(n) AS n FROM benchmark_rollups GROUP BY pillar, score").fetchall()
+            else:
+                rows = con.execute("SELECT pillar, score, n FROM benchmark_rollups WHERE region=?", (region.upper(),)).fetchall()
+        for r in rows:
+            if r["pillar"] in hist and 0 <= r["score"] <= 100 and r["n"] > 0:
+                hist[r["pillar"]][r["score"]] += r["n"]
+        return hist
+
+    @staticmethod
+    def _percentile(counts: list, total: int, pct: int) -> int:
+        # nearest-rank
+        rank = max(1, -(-pct * total // 100))
+        seen = 0
+        for score, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return score
+        return 100
+
+    @staticmethod
+    def percentile_rank(counts: list, total: int, score: int) -> float:
+        """Share of peers scoring below `score`, counting ties as half."""
+        if not total:
+            return None
+        below = sum(counts[:score])
+        return round(100 * (below + 0.5 * counts[score]) / total, 1)
+
+    def summary(self, region: str, session_scores: dict = None) -> dict:
+        out = {}
+        for pillar, counts in self.histograms(region).items():
+            total = sum(counts)
+            stats = {"count": total}
+            if total:
+                stats["mean"] = round(sum(s * n for s, n in enumerate(counts)) / total, 1)
+                stats["percentiles"] = {f"p{p}": self._percentile(counts, total, p) for p in PERCENTILES}
+                width = 100 // HISTOGRAM_BINS
+                bins = [0] * HISTOGRAM_BINS
+                for s, n in enumerate(counts):
+                    bins[min(s // width, HISTOGRAM_BINS - 1)] += n
+                stats["histogram"] = [{"from": i * width, "to": (i + 1) * width if i < HISTOGRAM_BINS - 1 else 100, "count": c} for i, c in enumerate(bins)]
+            if session_scores and pillar in session_scores:
+                stats["your_score"] = session_scores[pillar]
+                stats["your_percentile"] = self.percentile_rank(counts, total, session_scores[pillar])
+            out[pillar] = stats
+        return out
@@ -0,0 +1,194 @@
+"""
+Versioned question / playbook / region-overlay catalogue loaded from a JSON data file.
+
+A `Catalogue` is an immutable, validated snapshot with id and pillar indexes. The
+`CatalogueStore` owns the current snapshot and swaps in a new one with a single
+assignment when the file changes, so in-flight requests keep the snapshot they started
+with. A file that fails validation is rejected and the previous catalogue stays live.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import logging
+
+log = logging.getLogger("ztcompass.catalogue")
+
+REQUIRED_KEYS = ("version", "questions", "score_map", "risk_templates", "region_banners", "playbooks", "region_overlays")
+CONTAINERS = {"questions": list, "score_map": dict, "risk_templates": dict, "region_banners": dict,
+              "playbooks": list, "region_overlays": dict, "region_actions": dict}
+TASK_FIELDS = ("title", "description", "owner", "effort", "definition_of_done")
+
+
+def _task_errors(task, where: str) -> list:
+    if not isinstance(task, dict):
+        return [f"{where} must be an object"]
+    errors = [f"{where}.{f} must be a string" for f in TASK_FIELDS if not isinstance(task.get(f), str)]
+    if task.get("effort") not in ("S", "M", "L"):
+        errors.append(f"{where}.effort must be S, M or L")
+    return errors
+
+
+class CatalogueError(ValueError):
+    pass
+
+
+def validate(data: dict, pillars=None) -> list:
+    """Return a list of problems; empty means the catalogue is usable."""
+    if not isinstance(data, dict):
+        return ["catalogue must be a JSON object"]
+    errors = [f"missing key: {k}" for k in REQUIRED_KEYS if k not in data]
+    if errors:
+        return errors
+    if not isinstance(data["version"], str) or not data["version"].strip():
+        errors.append("version must be a non-empty string")
+    for key, kind in CONTAINERS.items():
+        if not isinstance(data.get(key, kind()), kind):
+            errors.append(f"{key} must be {'a list' if kind is list else 'an object'}")
+    for key in ("questions", "playbooks"):
+        if isinstance(data[key], list):
+            errors += [f"{key}[{i}] must be an object" for i, item in enumerate(data[key]) if not isinstance(item, dict)]
+    if errors:
+        return errors
+
+    seen = set()
+    for i, q in enumerate(data["questions"]):
+        for field in ("id", "pillar", "text"):
+            if not isinstance(q.get(field), str) or not q[field]:
+                errors.append(f"questions[{i}].{field} must be a non-empty string")
+        if q.get("id") in seen:
+            errors.append(f"duplicate question id: {q.get('id')}")
+        seen.add(q.get("id"))
+        if "action" in q:
+            errors += _task_errors(q["action"], f"questions[{i}].action")
+    found = {q.get("pillar") for q in data["questions"]}
+    if pillars is not None and found != set(pillars):
+        errors.append(f"question pillars {sorted(p for p in found if p)} must be exactly {sorted(pillars)}")
+
+    for answer, points in data["score_map"].items():
+        if not isinstance(points, (int, float)) or not 0 <= points <= 100:
+            errors.append(f"score_map[{answer!r}] must be a number between 0 and 100")
+    for pillar in found:
+        pair = data["risk_templates"].get(pillar)
+        if not (isinstance(pair, list) and len(pair) == 2 and all(isinstance(t, str) for t in pair)):
+            errors.append(f"risk_templates[{pillar!r}] must be [risk, win]")
+
+    seen = set()
+    for i, p in enumerate(data["playbooks"]):
+        for field in ("id", "title", "pillar", "icon"):
+            if not isinstance(p.get(field), str):
+                errors.append(f"playbooks[{i}].{field} must be a string")
+        if not isinstance(p.get("steps"), list):
+            errors.append(f"playbooks[{i}].steps must be a list")
+        if p.get("id") in seen:
+            errors.append(f"duplicate playbook id: {p.get('id')}")
+        seen.add(p.get("id"))
+
+    for code, overlay in data["region_overlays"].items():
+        if not isinstance(overlay, dict) or "title" not in overlay or not isinstance(overlay.get("sections"), list):
+            errors.append(f"region_overlays[{code!r}] must have a title and a sections list")
+    for code, banner in data["region_banners"].items():
+        if not isinstance(banner, str):
+            errors.append(f"region_banners[{code!r}] must be a string")
+    for code, task in data.get("region_actions", {}).items():
+        errors += _task_errors(task, f"region_actions[{code!r}]")
+    playbooks = {p.get("id") for p in data["playbooks"]}
+    for q in data["questions"]:
+        ref = (q.get("action") or {}).get("playbook") if isinstance(q.get("action"), dict) else None
+        if ref is not None and ref not in playbooks:
+            errors.append(f"questions[{q.get('id')!r}].action.playbook {ref!r} is not a playbook id")
+    return errors
+
+
+def canonical_answer(raw) -> str:
+    """The one form an answer is scored, coded for the prompt and cached under."""
+    value = "" if raw is None else str(raw).strip().lower()
+    return value or "unknown"
+
+
+class Catalogue:
+    def __init__(self, data: dict, pillars=None):
+        errors = validate(data, pillars)
+        if errors:
+            raise CatalogueError("; ".join(errors))
+        self.version = data["version"]
+        self.questions = data["questions"]
+        self.score_map = data["score_map"]
+        self.risk_templates = {p: tuple(v) for p, v in data["risk_templates"].items()}
+        self.region_banners = data["region_banners"]
+        self.playbooks = data["playbooks"]
+        self.region_overlays = {code.upper(): o for code, o in data["region_overlays"].items()}
+        self.region_actions = {code.upper(): t for code, t in data.get("region_actions", {}).items()}
+        self.pillars = list(dict.fromkeys(q["pillar"] for q in self.questions))
+        self.questions_by_id = {q["id"]: q for q in self.questions}
+        self.questions_by_pillar = {p: [q for q in self.questions if q["pillar"] == p] for p in self.pillars}
+        self.playbooks_by_id = {p["id"]: p for p in self.playbooks}
+        self.playbooks_by_pillar = {p: [pb for pb in self.playbooks if pb["pillar"] == p] for p in self.pillars}
+        self.source = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        self.digest = hashlib.sha256(self.source.encode("utf-8")).hexdigest()
+
+    def points(self, raw) -> int:
+        """Score-map points for one raw answer value; anything unmapped counts as 10."""
+        return self.score_map.get(canonical_answer(raw), 10)
+
+
+class CatalogueStore:
+    def __init__(self, path: str, pillars=None):
+        self.path = path
+        self.pillars = pillars
+        self.current = None
+        self._mtime = None
+        self._listeners = []
+
+    def subscribe(self, fn):
+        """`fn(catalogue)` runs after every successful swap (and immediately if one is loaded)."""
+        self._listeners.append(fn)
+        if self.current is not None:
+            fn(self.current)
+
+    def load(self, data: dict = None) -> bool:
+        """Load from `data` or the file; returns True if a new catalogue was swapped in."""
+        if data is None:
+            mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self._mtime = mtime
+        cat = Catalogue(data, self.pillars)
+        previous = self.current
+        if previous is not None and cat.digest == previous.digest:
+            return False
+        if previous is not None and cat.version == previous.version:
+            raise CatalogueError(f"catalogue content changed but version is still {cat.version!r}; bump the version")
+        # Derived state first: if a listener fails, the others are put back on the live catalogue.
+        try:
+            for fn in self._listeners:
+                fn(cat)
+        except Exception as e:
+            if previous is not None:
+                for fn in self._listeners:
+                    fn(previous)
+            raise CatalogueError(f"catalogue {cat.version!r} could not be applied: {e}") from e
+        self.current = cat
+        return True
+
+    def reload_if_changed(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            return self.load()
+        except Exception as e:
+            self._mtime = mtime  # don't retry the same broken file every tick
+            log.error("catalogue reload rejected, keeping %s: %s", self.current.version if self.current else None, e)
+            return False
+
+    async def watch(self, interval: float = 10.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload_if_changed)
+            except Exception:
+                log.exception("catalogue watch failed; retrying in %ss", interval)
@@ -0,0 +1,123 @@
+"""
+Immutable, pre-encoded registry for static API content (playbooks, region overlays).
+
+Every document is serialized once per load into JSON bytes plus gzip and (when the
+`brotli` package is installed) brotli variants, each with a strong content-hash ETag.
+Requests are answered with a dictionary lookup and a byte write. `load()` builds a new
+registry and swaps it in with one assignment, so readers never see a half-built one.
+Compression runs on first use of a variant, or ahead of time in `warm()`, so loading
+stays cheap on the startup path.
+"""
+import gzip
+import json
+import hashlib
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip-only without it
+    brotli = None
+
+
+def encode_json(payload) -> bytes:
+    # Same encoding as FastAPI's JSONResponse, so pre-encoded bodies match a live render.
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match check with weak comparison: `W/"x"` matches `"x"`, and `*` matches anything."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def accepted_encodings(accept_encoding: str) -> dict:
+    """Accept-Encoding as {coding: q}; a missing or malformed q counts as 1 and 0 respectively."""
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding.strip():
+            weights[coding.strip().lower()] = q
+    return weights
+
+
+class Encoded:
+    __slots__ = ("identity", "etag", "_gzip", "_br")
+
+    def __init__(self, payload):
+        self.identity = encode_json(payload)
+        self.etag = hashlib.sha256(self.identity).hexdigest()[:32]
+        self._gzip = None
+        self._br = None
+
+    @property
+    def gzip(self) -> bytes:
+        if self._gzip is None:
+            self._gzip = gzip.compress(self.identity, compresslevel=9, mtime=0)
+        return self._gzip
+
+    @property
+    def br(self):
+        if self._br is None and brotli:
+            self._br = brotli.compress(self.identity, quality=11)
+        return self._br
+
+    def compress(self):
+        return self.gzip, self.br
+
+    def variant(self, accept_encoding: str):
+        """(body, content-encoding or None, etag) for the best encoding the client accepts."""
+        weights = accepted_encodings(accept_encoding)
+        accepted = {c for c in ("br", "gzip") if weights.get(c, weights.get("*", 0)) > 0}
+        if brotli and "br" in accepted:
+            return self.br, "br", f'"{self.etag}-br"'
+        if "gzip" in accepted:
+            return self.gzip, "gzip", f'"{self.etag}-gz"'
+        return self.identity, None, f'"{self.etag}"'
+
+
+class ContentRegistry:
+    def __init__(self, max_age: int = 300, stale_while_revalidate: int = 86400):
+        self.cache_control = f"public, max-age={max_age}, stale-while-revalidate={stale_while_revalidate}"
+        self._docs = {}
+        self.version = None
+
+    def load(self, playbooks: list, region_overlays: dict, version: str = None):
+        docs = {"playbooks": Encoded([{"id": p["id"], "title": p["title"], "pillar": p["pillar"], "icon": p["icon"]} for p in playbooks])}
+        for p in playbooks:
+            docs[f"playbook:{p['id']}"] = Encoded(p)
+        for code, overlay in region_overlays.items():
+            docs[f"region:{code.upper()}"] = Encoded(overlay)
+        self._docs = docs
+        self.version = version or hashlib.sha256(b"".join(d.identity for d in docs.values())).hexdigest()[:12]
+
+    def warm(self):
+        """Compress every document now rather than on its first request."""
+        for doc in list(self._docs.values()):
+            doc.compress()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._docs
+
+    def respond(self, request: Request, key: str):
+        """Pre-encoded response for `key` (honouring If-None-Match), or None if unknown."""
+        doc = self._docs.get(key)
+        if doc is None:
+            return None
+        body, encoding, etag = doc.variant(request.headers.get("accept-encoding"))
+        headers = {"ETag": etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
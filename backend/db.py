@@ -0,0 +1,181 @@
+import time
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class PoolTimeout(RuntimeError):
+    pass
+
+
+class TimedConnection:
+    """Connection proxy that reports each statement's execution time to `observe(seconds, verb)`."""
+
+    __slots__ = ("_con", "_observe")
+
+    def __init__(self, con: sqlite3.Connection, observe):
+        self._con = con
+        self._observe = observe
+
+    def _timed(self, fn, sql, *args):
+        started = time.perf_counter()
+        try:
+            return fn(sql, *args)
+        finally:
+            self._observe(time.perf_counter() - started, sql.split(None, 1)[0].upper())
+
+    def execute(self, sql, *args):
+        return self._timed(self._con.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._timed(self._con.executemany, sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._con, name)
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections in WAL mode.
+
+    Connections are opened lazily up to `size` and handed out LIFO so hot connections
+    (with warm page and prepared-statement caches) are reused first. Readers never
+    block writers under WAL; writers serialise through `BEGIN IMMEDIATE` and wait on
+    `busy_timeout` instead of failing with "database is locked".
+    """
+
+    backend = "sqlite"
+    # Appended to claim queries; SQLite has no row locks and writers already run one at a time.
+    skip_locked = ""
+
+    def __init__(self, path: str, size: int = 8, timeout: float = 10.0, busy_timeout_ms: int = 5000,
+                 mmap_size: int = 256 * 1024 * 1024, cache_size_kb: int = 16384, statement_cache: int = 256):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.statement_cache = statement_cache
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        # isolation_level=None: we issue BEGIN ourselves so reads stay in autocommit.
+        con = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.statement_cache,
+        )
+        con.row_factory = sqlite3.Row
+        # Must be set on an empty file, before WAL; older files switch over on a full VACUUM.
+        if con.execute("PRAGMA page_count").fetchone()[0] == 0:
+            con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        con.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        con.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        con.execute("PRAGMA temp_store=MEMORY")
+        return con
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self._open()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"No SQLite connection available after {self.timeout}s (pool size {self.size})")
+
+    def _release(self, con: sqlite3.Connection):
+        if con.in_transaction:
+            con.rollback()
+        self._idle.put(con)
+
+    def _discard(self, con: sqlite3.Connection):
+        try:
+            con.close()
+        finally:
+            with self._lock:
+                self._opened -= 1
+
+    @contextmanager
+    def connection(self, write: bool = False):
+        """Yield a pooled connection; `write=True` wraps the block in one IMMEDIATE transaction."""
+        con = self._acquire()
+        try:
+            if write:
+                self._begin_immediate(con)
+            yield con
+            if con.in_transaction:
+                con.execute("COMMIT")
+        except BaseException as e:
+            # A closed or misused handle must not go back into the pool.
+            if self._is_broken(con, e):
+                self._discard(con)
+            else:
+                self._release(con)
+            raise
+        else:
+            self._release(con)
+
+    def _is_broken(self, con, error: BaseException) -> bool:
+        return isinstance(error, sqlite3.ProgrammingError)
+
+    def _begin_immediate(self, con: sqlite3.Connection, attempts: int = 5):
+        # busy_timeout covers most contention; retry the rare SQLITE_BUSY that escapes it.
+        for attempt in range(attempts):
+            try:
+                con.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(0.05 * (2 ** attempt))
+
+    def lock(self, con, key: str, shared: bool = False):
+        """Hold `key` until the write transaction on `con` ends (shared holders don't exclude each other).
+
+        A no-op here, since BEGIN IMMEDIATE already serialises writers; PostgreSQL writers run
+        concurrently and take a transaction-scoped advisory lock on the key instead.
+        """
+
+    def executescript(self, sql: str):
+        with self.connection() as con:
+            con.executescript(sql)
+
+    def close(self):
+        while True:
+            try:
+                con = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(con)
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "size": self.size, "opened": self._opened, "idle": self._idle.qsize()}
+
+
+def open_pool(database_url: str = None, sqlite_path: str = None, **kwargs):
+    """SQLite pool by default; a PostgreSQL pool (shared by every worker and node) for postgres:// URLs."""
+    if database_url and database_url.startswith(("postgres://", "postgresql://")):
+        from db_postgres import PostgresPool
+        return PostgresPool(database_url, **kwargs)
+    if database_url and database_url.startswith("sqlite:///"):
+        sqlite_path = database_url[len("sqlite:///"):]
+    return ConnectionPool(sqlite_path, **kwargs)
@@ -0,0 +1,193 @@
+"""
+PostgreSQL storage backend with the same interface as the SQLite `ConnectionPool`.
+
+Every worker and every node points at one database, so sessions, dashboards, the roadmap
+cache, single-flight leases and roadmap jobs are shared. Callers keep writing the SQLite
+dialect the rest of the backend uses; statements are translated once and cached:
+
+- `?` placeholders become `%s` (and literal `%` is escaped)
+- `INSERT OR REPLACE` / `INSERT OR IGNORE` become `ON CONFLICT` upserts on the primary key
+- DDL types are mapped (REAL, BLOB, AUTOINCREMENT, DATETIME defaults); PRAGMAs are no-ops
+
+Reads run in autocommit and `write=True` blocks are plain READ COMMITTED transactions, so
+writers on different rows run concurrently. Read-modify-write code that SQLite serialises for
+free takes `lock(con, key)`, a transaction-scoped advisory lock on `hashtext(key)` (a session's
+answers, the benchmark rollups, job dedup, migrations), and claim queries append
+`skip_locked` so concurrent workers lease disjoint rows.
+"""
+import re
+import threading
+import psycopg
+from psycopg.pq import TransactionStatus
+
+from db import ConnectionPool
+
+_DDL = [
+    (re.compile(r"\bINTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT\b", re.I), "BIGSERIAL PRIMARY KEY"),
+    (re.compile(r"\bDATETIME\s+DEFAULT\s+CURRENT_TIMESTAMP\b", re.I),
+     "TEXT DEFAULT to_char(timezone('UTC', now()), 'YYYY-MM-DD HH24:MI:SS')"),
+    (re.compile(r"\bREAL\b", re.I), "DOUBLE PRECISION"),
+    (re.compile(r"\bBLOB\b", re.I), "BYTEA"),
+    (re.compile(r"\)\s*WITHOUT\s+ROWID", re.I), ")"),
+]
+_INSERT_OR = re.compile(r"^\s*INSERT\s+OR\s+(REPLACE|IGNORE)\s+INTO\s+(\w+)\s*\(([^)]*)\)(.*)$", re.I | re.S)
+
+
+def _placeholders(sql: str) -> str:
+    """`?` -> `%s` and `%` -> `%%`, leaving quoted literals alone."""
+    out, quote = [], None
+    for ch in sql:
+        if quote:
+            out.append("%%" if ch == "%" else ch)
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+            out.append(ch)
+        elif ch == "?":
+            out.append("%s")
+        elif ch == "%":
+            out.append("%%")
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+def translate(sql: str, primary_key) -> str:
+    """SQLite-dialect statement -> PostgreSQL; `primary_key(table)` returns the table's key columns."""
+    head = sql.lstrip()[:6].upper()
+    if head == "PRAGMA":
+        return "SELECT NULL WHERE FALSE"
+    if head in ("CREATE", "ALTER "):
+        for pattern, replacement in _DDL:
+            sql = pattern.sub(replacement, sql)
+    m = _INSERT_OR.match(sql)
+    if m:
+        mode, table, cols, rest = m.group(1).upper(), m.group(2), m.group(3), m.group(4).rstrip().rstrip(";")
+        columns = [c.strip() for c in cols.split(",")]
+        keys = primary_key(table)
+        updates = [c for c in columns if c not in keys]
+        if mode == "REPLACE" and updates:
+            action = "DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in updates)
+            target = "(" + ", ".join(keys) + ")"
+        else:
+            action, target = "DO NOTHING", ""
+        sql = f"INSERT INTO {table} ({cols}){rest} ON CONFLICT {target} {action}"
+    return _placeholders(sql)
+
+
+class Row(tuple):
+    """Tuple row that can also be indexed by column name, like sqlite3.Row."""
+    __slots__ = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._index)
+
+
+_row_classes = {}
+
+
+def _row_factory(cursor):
+    names = tuple(c.name for c in cursor.description or ())
+    cls = _row_classes.get(names)
+    if cls is None:
+        cls = _row_classes[names] = type("Row", (Row,), {"__slots__": (), "_index": {n: i for i, n in enumerate(names)}})
+    return cls
+
+
+class PgConnection:
+    """The subset of the sqlite3.Connection API the backend uses, over a psycopg connection."""
+
+    def __init__(self, raw: psycopg.Connection, pool: "PostgresPool"):
+        self.raw = raw
+        self.pool = pool
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.raw.info.transaction_status != TransactionStatus.IDLE
+
+    def execute(self, sql: str, params=()):
+        cur = self.raw.cursor(row_factory=_row_factory)
+        cur.execute(self.pool.translate(sql, self.raw), tuple(params or ()))
+        return cur
+
+    def executemany(self, sql: str, seq):
+        cur = self.raw.cursor(row_factory=_row_factory)
+        rows = [tuple(p) for p in seq]
+        if rows:
+            cur.executemany(self.pool.translate(sql, self.raw), rows)
+        return cur
+
+    def executescript(self, script: str):
+        for statement in script.split(";"):
+            if statement.strip():
+                self.execute(statement)
+
+    def rollback(self):
+        if self.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def commit(self):
+        if self.in_transaction:
+            self.raw.execute("COMMIT")
+
+    def close(self):
+        self.raw.close()
+
+
+class PostgresPool(ConnectionPool):
+    backend = "postgres"
+    skip_locked = " FOR UPDATE SKIP LOCKED"
+
+    def __init__(self, dsn: str, size: int = 8, timeout: float = 10.0, connect_timeout: int = 10, **_sqlite_options):
+        super().__init__(dsn, size=size, timeout=timeout)
+        self.dsn = dsn
+        self.connect_timeout = connect_timeout
+        self._statements = {}
+        self._primary_keys = {}
+        self._meta_lock = threading.Lock()
+
+    def _open(self) -> PgConnection:
+        raw = psycopg.connect(self.dsn, autocommit=True, connect_timeout=self.connect_timeout)
+        return PgConnection(raw, self)
+
+    def _begin_immediate(self, con: PgConnection, attempts: int = 5):
+        con.raw.execute("BEGIN")
+
+    def lock(self, con: PgConnection, key: str, shared: bool = False):
+        fn = "pg_advisory_xact_lock_shared" if shared else "pg_advisory_xact_lock"
+        con.execute(f"SELECT {fn}(hashtext(?))", (key,))
+
+    def _is_broken(self, con: PgConnection, error: BaseException) -> bool:
+        return con.raw.closed or con.raw.broken
+
+    def primary_key(self, table: str, raw: psycopg.Connection) -> list:
+        keys = self._primary_keys.get(table)
+        if keys is None:
+            keys = [r[0] for r in raw.execute("""
+                SELECT a.attname FROM pg_index i
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                WHERE i.indrelid = to_regclass(%s) AND i.indisprimary
+                ORDER BY a.attnum
+            """, (table,))]
+            if not keys:
+                raise LookupError(f"table {table} has no primary key to upsert on")
+            with self._meta_lock:
+                self._primary_keys[table] = keys
+        return keys
+
+    def translate(self, sql: str, raw: psycopg.Connection) -> str:
+        translated = self._statements.get(sql)
+        if translated is None:
+            translated = translate(sql, lambda table: self.primary_key(table, raw))
+            with self._meta_lock:
+                if len(self._statements) > 2048:
+                    self._statements.clear()
+                self._statements[sql] = translated
+        return translated
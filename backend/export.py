@@ -0,0 +1,146 @@
+"""
+Streaming export of sessions with answers, pillar scores and stored roadmaps.
+
+Rows are read in keyset-paginated pages of `page_size` over (created_at, id), each page
+in its own short read, so memory stays constant and no read transaction is held open
+for the whole export (which would stop WAL checkpoints on a large table). Archived sessions
+are not included: their gzip NDJSON files in the archive directory are the export for them.
+
+    python export.py --format csv --region CH --from 2026-01-01 > sessions.csv
+"""
+import io
+import csv
+import sys
+import json
+
+
+class SessionExporter:
+    def __init__(self, db, questions: list, pillar_columns: dict, maturity_level, compute_scores):
+        self.db = db
+        self.question_ids = [q["id"] for q in questions]
+        self.pillar_columns = pillar_columns
+        self.maturity_level = maturity_level
+        self.compute_scores = compute_scores
+
+    @staticmethod
+    def _ts(value):
+        # created_at is stored as "YYYY-MM-DD HH:MM:SS"; accept ISO "T" separators from callers.
+        return value.replace("T", " ").rstrip("Z") if value else None
+
+    def _page(self, con, region, created_from, created_to, after, page_size):
+        clauses, params = [], []
+        if region:
+            clauses.append("s.region = ?")
+            params.append(region.upper())
+        if created_from:
+            clauses.append("s.created_at >= ?")
+            params.append(self._ts(created_from))
+        if created_to:
+            clauses.append("s.created_at < ?")
+            params.append(self._ts(created_to))
+        if after:
+            clauses.append("(s.created_at, s.id) > (?, ?)")
+            params.extend(after)
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+        cols = ", ".join(f"s.{c}" for c in self.pillar_columns.values())
+        return con.execute(f"""
+            SELECT s.id, s.region, s.created_at, s.answers, s.answers_normalized, s.overall_score, {cols},
+                   r.roadmap, r.source AS roadmap_source
+            FROM sessions s LEFT JOIN roadmaps r ON r.session_id = s.id
+            {where}
+            ORDER BY s.created_at, s.id
+            LIMIT ?
+        """, (*params, page_size)).fetchall()
+
+    def _answers_for(self, con, ids):
+        answers = {sid: {} for sid in ids}
+        marks = ",".join("?" * len(ids))
+        for r in con.execute(f"SELECT session_id, question_id, answer, note FROM answers WHERE session_id IN ({marks})", ids):
+            a = {}
+            if r["answer"] is not None:
+                a["answer"] = r["answer"]
+            if r["note"] is not None:
+                a["note"] = r["note"]
+            answers[r["session_id"]][r["question_id"]] = a
+        return answers
+
+    def iter_sessions(self, region=None, created_from=None, created_to=None, page_size: int = 1000):
+        after = None
+        while True:
+            with self.db.connection() as con:
+                rows = self._page(con, region, created_from, created_to, after, page_size)
+                if not rows:
+                    return
+                normalized = [r["id"] for r in rows if r["answers_normalized"]]
+                answers = self._answers_for(con, normalized) if normalized else {}
+            for r in rows:
+                if r["answers_normalized"]:
+                    session_answers = answers.get(r["id"], {})
+                    pillar_scores = {p: {"score": round(r[c]), "level": self.maturity_level(r[c])} for p, c in self.pillar_columns.items()}
+                    overall = r["overall_score"]
+                else:
+                    session_answers = json.loads(r["answers"] or "{}")
+                    pillar_scores = self.compute_scores(session_answers)
+                    overall = round(sum(p["score"] for p in pillar_scores.values()) / len(pillar_scores))
+                yield {
+                    "session_id": r["id"],
+                    "region": r["region"],
+                    "created_at": r["created_at"],
+                    "overall_score": overall,
+                    "pillar_scores": pillar_scores,
+                    "answers": session_answers,
+                    "roadmap": json.loads(r["roadmap"]) if r["roadmap"] else None,
+                    "roadmap_source": r["roadmap_source"],
+                }
+            if len(rows) < page_size:
+                return
+            after = (rows[-1]["created_at"], rows[-1]["id"])
+
+    def ndjson(self, records):
+        for rec in records:
+            yield json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+    def csv_header(self) -> list:
+        header = ["session_id", "region", "created_at", "overall_score"]
+        for p in self.pillar_columns:
+            header += [f"{p.lower()}_score", f"{p.lower()}_level"]
+        for qid in self.question_ids:
+            header += [qid, f"{qid}_note"]
+        return header + ["roadmap_source", "roadmap"]
+
+    def csv(self, records):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(self.csv_header())
+        for rec in records:
+            row = [rec["session_id"], rec["region"], rec["created_at"], rec["overall_score"]]
+            for p in self.pillar_columns:
+                row += [rec["pillar_scores"][p]["score"], rec["pillar_scores"][p]["level"]]
+            for qid in self.question_ids:
+                a = rec["answers"].get(qid) or {}
+                row += [a.get("answer", ""), a.get("note", "")]
+            row += [rec["roadmap_source"] or "", json.dumps(rec["roadmap"], ensure_ascii=False) if rec["roadmap"] else ""]
+            writer.writerow(row)
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        # header-only exports still need the header line flushed
+        if buf.tell():
+            yield buf.getvalue()
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import db_pool, catalogue, PILLAR_COLUMNS, maturity_level, compute_scores
+
+    parser = argparse.ArgumentParser(description="Stream ZT Compass sessions as NDJSON or CSV")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--region")
+    parser.add_argument("--from", dest="created_from")
+    parser.add_argument("--to", dest="created_to")
+    args = parser.parse_args()
+
+    exporter = SessionExporter(db_pool, catalogue.current.questions, PILLAR_COLUMNS, maturity_level, compute_scores)
+    records = exporter.iter_sessions(args.region, args.created_from, args.created_to)
+    for chunk in (exporter.csv(records) if args.format == "csv" else exporter.ndjson(records)):
+        sys.stdout.write(chunk)
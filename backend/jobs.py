@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "failed")
+
+log = logging.getLogger("ztcompass.jobs")
+
+
+class RoadmapJobQueue:
+    """Durable per-session roadmap jobs, executed by a pool of asyncio workers.
+
+    Jobs live in the `roadmap_jobs` table and results in `roadmaps`. The table is the queue:
+    workers in any process sharing the database claim the oldest queued job under a lease,
+    and a job whose lease expires (its worker died) goes back to `queued` for someone else.
+    The in-process queue only wakes local workers early; they also poll every `poll_interval`.
+    `handler(session_id, progress)` is an async callable returning `(roadmap, source)`; it may
+    call `progress(partial_roadmap)` as tasks arrive; the latest one is stored on the job for
+    pollers at most every `progress_interval` seconds, and each write renews the lease.
+    `max_running` caps running jobs (and so Gemini calls) across every process and node.
+    Database work runs in threads, never on the event loop.
+    """
+
+    def __init__(self, db, handler, concurrency: int = 4, lease_ttl: float = 60.0, poll_interval: float = 1.0,
+                 max_running: int = 0, progress_interval: float = 0.25):
+        self.db = db
+        self.handler = handler
+        self.concurrency = concurrency
+        self.max_running = max_running
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.progress_interval = progress_interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._queue = None
+        self._loop = None
+        self._workers = []
+
+    # ── Producer side ──────────────────────────────────────────────────────────
+
+    def enqueue(self, session_id: str) -> dict:
+        """Return the session's active job if there is one, otherwise queue a new job."""
+        now = time.time()
+        with self.db.connection(write=True) as con:
+            self.db.lock(con, f"roadmap_jobs:{session_id}")
+            row = con.execute(
+                "SELECT id FROM roadmap_jobs WHERE session_id=? AND status IN (?,?) ORDER BY created_at LIMIT 1",
+                (session_id, *ACTIVE),
+            ).fetchone()
+            if row:
+                return self.get(row["id"])
+            job_id = str(uuid.uuid4())
+            con.execute(
+                "INSERT INTO roadmap_jobs (id, session_id, status, created_at, updated_at) VALUES (?,?,?,?,?)",
+                (job_id, session_id, "queued", now, now),
+            )
+        if self._queue is not None:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, job_id)
+        return self.get(job_id)
+
+    def depth(self) -> int:
+        """Jobs waiting for a worker, across every process sharing the database."""
+        with self.db.connection() as con:
+            return con.execute("SELECT COUNT(*) AS n FROM roadmap_jobs WHERE status='queued'").fetchone()["n"]
+
+    def get(self, job_id: str):
+        with self.db.connection() as con:
+            row = con.execute("""
+                SELECT j.id, j.session_id, j.status, j.error, j.partial, j.created_at, j.updated_at, r.roadmap, r.source
+                FROM roadmap_jobs j LEFT JOIN roadmaps r ON r.job_id = j.id
+                WHERE j.id=?
+            """, (job_id,)).fetchone()
+        if not row:
+            return None
+        job = {
+            "job_id": row["id"],
+            "session_id": row["session_id"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+        if row["status"] == "done" and row["roadmap"]:
+            job["roadmap"] = json.loads(row["roadmap"])
+            job["source"] = row["source"]
+        elif row["status"] == "running" and row["partial"]:
+            job["partial"] = json.loads(row["partial"])
+        if row["error"]:
+            job["error"] = row["error"]
+        return job
+
+    def store_roadmap(self, session_id: str, roadmap: dict, source: str, job_id: str = None, stale_before: float = 0.0):
+        """Record a roadmap produced outside a job (e.g. the instant rule-based one).
+
+        A template never replaces a refined roadmap, unless that one predates `stale_before`
+        (the answers it was built from have changed since).
+        """
+        with self.db.connection(write=True) as con:
+            con.execute(
+                "INSERT INTO roadmaps (session_id, job_id, roadmap, source, created_at) VALUES (?,?,?,?,?) "
+                "ON CONFLICT(session_id) DO UPDATE SET job_id=excluded.job_id, roadmap=excluded.roadmap, "
+                "source=excluded.source, created_at=excluded.created_at "
+                "WHERE excluded.source <> 'template' OR roadmaps.source = 'template' OR roadmaps.created_at < ?",
+                (session_id, job_id, json.dumps(roadmap), source, time.time(), stale_before),
+            )
+
+    def latest_roadmap(self, session_id: str):
+        with self.db.connection() as con:
+            row = con.execute("SELECT job_id, roadmap, source, created_at FROM roadmaps WHERE session_id=?", (session_id,)).fetchone()
+        if not row:
+            return None
+        return {"job_id": row["job_id"], "roadmap": json.loads(row["roadmap"]), "source": row["source"], "created_at": row["created_at"]}
+
+    # ── Worker side ────────────────────────────────────────────────────────────
+
+    def _requeue_orphans(self):
+        with self.db.connection(write=True) as con:
+            # Jobs left "running" by a previous process with our identity (or with no lease at all)
+            # are orphans; other processes' jobs stay theirs until their lease runs out.
+            con.execute(
+                "UPDATE roadmap_jobs SET status='queued', lease_owner=NULL, lease_expires_at=NULL, updated_at=? "
+                "WHERE status='running' AND (lease_owner=? OR lease_owner IS NULL)",
+                (time.time(), self.owner),
+            )
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        await asyncio.to_thread(self._requeue_orphans)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def _claim_next(self):
+        """Lease the oldest queued job to this process; returns (job_id, session_id) or None."""
+        now = time.time()
+        with self.db.connection(write=True) as con:
+            con.execute(
+                "UPDATE roadmap_jobs SET status='queued', lease_owner=NULL, lease_expires_at=NULL, updated_at=? "
+                "WHERE status='running' AND lease_expires_at<?",
+                (now, now),
+            )
+            if self.max_running > 0:
+                # Keeps the count and the claim below atomic across workers.
+                self.db.lock(con, "roadmap_jobs:claim")
+                running = con.execute("SELECT COUNT(*) AS n FROM roadmap_jobs WHERE status='running'").fetchone()["n"]
+                if running >= self.max_running:
+                    return None
+            row = con.execute(
+                "SELECT id, session_id FROM roadmap_jobs WHERE status='queued' ORDER BY created_at LIMIT 1" + self.db.skip_locked
+            ).fetchone()
+            if row is None:
+                return None
+            con.execute(
+                "UPDATE roadmap_jobs SET status='running', attempts=attempts+1, lease_owner=?, lease_expires_at=?, updated_at=? WHERE id=?",
+                (self.owner, now + self.lease_ttl, now, row["id"]),
+            )
+            return row["id"], row["session_id"]
+
+    def _finish(self, job_id: str, session_id: str, roadmap=None, source=None, error=None) -> bool:
+        """Record the outcome; False (and nothing written) if the lease went to another worker meanwhile."""
+        now = time.time()
+        with self.db.connection(write=True) as con:
+            cur = con.execute(
+                "UPDATE roadmap_jobs SET status=?, error=?, partial=NULL, lease_owner=NULL, lease_expires_at=NULL, updated_at=? "
+                "WHERE id=? AND status='running' AND lease_owner=?",
+                ("done" if error is None else "failed", error, now, job_id, self.owner),
+            )
+            if cur.rowcount != 1:
+                return False
+            if error is None:
+                con.execute(
+                    "INSERT OR REPLACE INTO roadmaps (session_id, job_id, roadmap, source, created_at) VALUES (?,?,?,?,?)",
+                    (session_id, job_id, json.dumps(roadmap), source, now),
+                )
+        return True
+
+    def _progress(self, job_id: str, partial: dict) -> bool:
+        """Store the partial roadmap and extend the lease; False if the lease is no longer ours."""
+        now = time.time()
+        with self.db.connection(write=True) as con:
+            cur = con.execute(
+                "UPDATE roadmap_jobs SET partial=?, updated_at=?, lease_expires_at=? WHERE id=? AND status='running' AND lease_owner=?",
+                (json.dumps(partial), now, now + self.lease_ttl, job_id, self.owner),
+            )
+            return cur.rowcount == 1
+
+    async def _run(self, job_id: str, session_id: str):
+        latest = {}
+        writer = None
+
+        async def _write():
+            # Coalesces bursts of tasks into one write per `progress_interval`, in order.
+            nonlocal writer
+            try:
+                await asyncio.sleep(self.progress_interval)
+                while "partial" in latest:
+                    await asyncio.to_thread(self._progress, job_id, latest.pop("partial"))
+            except Exception:
+                log.warning("could not store progress of job %s", job_id, exc_info=True)
+            finally:
+                writer = None
+
+        def progress(partial: dict):
+            nonlocal writer
+            latest["partial"] = partial
+            if writer is None:
+                writer = asyncio.create_task(_write())
+
+        try:
+            roadmap, source = await self.handler(session_id, progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            outcome = {"error": str(e) or type(e).__name__}
+        else:
+            outcome = {"roadmap": roadmap, "source": source}
+        finally:
+            if writer is not None:
+                writer.cancel()
+        if not await asyncio.to_thread(self._finish, job_id, session_id, **outcome):
+            log.warning("job %s lost its lease before finishing; result discarded", job_id)
+
+    async def _worker(self):
+        while True:
+            try:
+                claimed = await asyncio.to_thread(self._claim_next)
+                if claimed is None:
+                    try:
+                        await asyncio.wait_for(self._queue.get(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(*claimed)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # A locked database or an exhausted pool; whatever was claimed comes back when its lease expires.
+                log.exception("roadmap worker iteration failed")
+                await asyncio.sleep(self.poll_interval)
+
+    async def events(self, job_id: str, poll_interval: float = 0.2, timeout: float = 120.0):
+        """Server-Sent Events stream: `status` on every change, `task` for each roadmap task as
+        the model produces it, then `result` once finished."""
+        last = None
+        sent = {}
+        expires = time.monotonic() + timeout
+        while time.monotonic() < expires:
+            job = await asyncio.to_thread(self.get, job_id)
+            if job is None:
+                yield "event: error\ndata: {\"detail\": \"Job not found\"}\n\n"
+                return
+            if job["status"] in FINISHED:
+                yield f"event: result\ndata: {json.dumps(job)}\n\n"
+                return
+            if job["status"] != last:
+                last = job["status"]
+                yield f"event: status\ndata: {json.dumps({'job_id': job_id, 'status': last})}\n\n"
+            for horizon, tasks in job.get("partial", {}).items():
+                for index in range(sent.get(horizon, 0), len(tasks)):
+                    payload = {"job_id": job_id, "horizon": horizon, "index": index, "task": tasks[index]}
+                    yield f"event: task\ndata: {json.dumps(payload)}\n\n"
+                sent[horizon] = max(sent.get(horizon, 0), len(tasks))
+            await asyncio.sleep(poll_interval)
+        yield "event: timeout\ndata: {}\n\n"
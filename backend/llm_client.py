@@ -0,0 +1,235 @@
+import json
+import asyncio
+import random
+import time
+from metrics import registry, LLM_BUCKETS
+from admission import CircuitOpenError
+
+LLM_ATTEMPTS = registry.counter("ztc_llm_attempts_total", "Gemini attempts by outcome (ok, timeout, error).", ("outcome",))
+LLM_ATTEMPT_DURATION = registry.histogram("ztc_llm_attempt_duration_seconds", "Duration of single Gemini attempts.", ("outcome",), LLM_BUCKETS)
+LLM_CALLS = registry.counter("ztc_llm_calls_total", "generate_stream() calls by result (ok, failed, rejected by the open circuit).", ("result",))
+LLM_CALL_DURATION = registry.histogram("ztc_llm_call_duration_seconds", "generate_stream() duration including retries and backoff.", ("result",), LLM_BUCKETS)
+LLM_FIRST_CHUNK = registry.histogram("ztc_llm_first_chunk_seconds", "generate_stream() time to the first text chunk.", buckets=LLM_BUCKETS)
+LLM_TOKENS = registry.counter("ztc_llm_tokens_total", "Tokens reported by the provider (input, cached, output).", ("kind",))
+LLM_QUEUE_WAIT = registry.histogram("ztc_llm_queue_wait_seconds", "Time spent waiting for an LLM concurrency slot.")
+LLM_IN_FLIGHT = registry.gauge("ztc_llm_in_flight", "Gemini calls currently holding a concurrency slot.")
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    pass
+
+
+class GeminiClient:
+    """Asyncio-native Gemini client: cancellable attempts, jittered backoff, bounded concurrency.
+
+    Each call gets a total deadline budget; within an attempt, the wait for each chunk is
+    capped by both `attempt_timeout` and whatever is left of that budget, and an attempt
+    that runs over is cancelled (not leaked).
+
+    With `endpoint` set, calls go to the Gemini REST API at that base URL (for example the
+    offline stand-in in bench/fake_gemini.py) instead of through the SDK's gRPC transport.
+
+    With a `breaker`, calls that ran out of retries count towards opening it, and while it is
+    open calls fail at once with CircuitOpenError instead of waiting on a degraded provider.
+    """
+
+    def __init__(self, model_name: str = "gemini-2.0-flash", max_concurrency: int = 64,
+                 max_retries: int = 3, attempt_timeout: float = 30.0, deadline: float = 45.0,
+                 backoff_base: float = 1.5, backoff_cap: float = 8.0,
+                 endpoint: str = None, api_key: str = None, http_transport=None, breaker=None):
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.endpoint = endpoint.rstrip("/") if endpoint else None
+        self.api_key = api_key
+        self.http_transport = http_transport
+        self.breaker = breaker
+        self._genai = None
+        self._model = None
+        self._models = {}
+        self._sem = None
+        self._sem_loop = None
+        self._http = None
+        self._http_loop = None
+
+    def _sdk(self):
+        # The SDK and its gRPC/protobuf tree take most of a second to import: only on first use.
+        if self._genai is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._genai = genai
+        return self._genai
+
+    def warm(self):
+        """Import the transport ahead of the first call (REST client or SDK)."""
+        if self.endpoint:
+            import httpx  # noqa: F401
+        else:
+            self._sdk()
+
+    def _get_model(self, system: str = None):
+        if system is not None:
+            # One model object per system prompt; the prompt is static per catalogue version.
+            model = self._models.get(system)
+            if model is None:
+                if len(self._models) > 16:
+                    self._models.clear()
+                model = self._models[system] = self._sdk().GenerativeModel(self.model_name, system_instruction=system)
+            return model
+        if self._model is None:
+            self._model = self._sdk().GenerativeModel(self.model_name)
+        return self._model
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives are bound to one loop; rebuild if the app runs under a new one.
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._sem_loop is not loop:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+            self._sem_loop = loop
+        return self._sem
+
+    def _admit(self):
+        if self.breaker is not None and not self.breaker.allow():
+            LLM_CALLS.inc("rejected")
+            raise CircuitOpenError(f"Gemini circuit open; retry in {self.breaker.retry_after()}s")
+
+    def _settle(self, result: str, cancelled: bool):
+        if self.breaker is not None:
+            if cancelled:
+                self.breaker.release()
+            else:
+                self.breaker.record(result == "ok")
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": uniform in [0, min(cap, base * 2^attempt)].
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def _http_client(self):
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http_loop is not loop:
+            import httpx
+            self._http = httpx.AsyncClient(transport=self.http_transport, timeout=None)
+            self._http_loop = loop
+        return self._http
+
+    async def _stream_rest(self, prompt: str, system: str, config: dict, usage: dict):
+        params = {"alt": "sse", **({"key": self.api_key} if self.api_key else {})}
+        body = {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+        if system:
+            body["systemInstruction"] = {"parts": [{"text": system}]}
+        if config:
+            rest = {"maxOutputTokens": config.get("max_output_tokens"), "responseMimeType": config.get("response_mime_type")}
+            body["generationConfig"] = {k: v for k, v in rest.items() if v is not None}
+        async with self._http_client().stream(
+            "POST",
+            f"{self.endpoint}/v1beta/models/{self.model_name}:streamGenerateContent",
+            params=params,
+            json=body,
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = json.loads(line[5:])
+                meta = data.get("usageMetadata")
+                if meta:
+                    usage.update(input_tokens=meta.get("promptTokenCount"), output_tokens=meta.get("candidatesTokenCount"),
+                                 cached_tokens=meta.get("cachedContentTokenCount", 0))
+                for candidate in data.get("candidates", [])[:1]:
+                    text = "".join(p.get("text", "") for p in candidate.get("content", {}).get("parts", []))
+                    if text:
+                        yield text
+
+    async def _stream(self, prompt: str, system: str, config: dict, usage: dict):
+        if self.endpoint:
+            async for text in self._stream_rest(prompt, system, config, usage):
+                yield text
+            return
+        response = await self._get_model(system).generate_content_async(
+            prompt, stream=True, generation_config={k: v for k, v in (config or {}).items() if v is not None} or None)
+        async for chunk in response:
+            meta = getattr(chunk, "usage_metadata", None)
+            if meta:
+                usage.update(input_tokens=meta.prompt_token_count, output_tokens=meta.candidates_token_count,
+                             cached_tokens=getattr(meta, "cached_content_token_count", 0))
+            text = "".join(p.text for c in chunk.candidates[:1] for p in c.content.parts)
+            if text:
+                yield text
+
+    async def generate_stream(self, prompt: str, deadline: float = None, system: str = None,
+                              max_output_tokens: int = None, json_output: bool = False, usage: dict = None):
+        """Yield the model's text as it is generated.
+
+        Attempts that fail before yielding anything are retried with backoff while the deadline
+        budget lasts; an attempt that already yielded text is not retried (the caller has
+        consumed it).
+        `system` is sent as the system instruction; the provider's token counts are written
+        into `usage` (input_tokens, cached_tokens, output_tokens) when it reports them.
+        """
+        usage = {} if usage is None else usage
+        config = None
+        if max_output_tokens or json_output:
+            config = {"max_output_tokens": max_output_tokens, "response_mime_type": "application/json" if json_output else None}
+        budget = self.deadline if deadline is None else deadline
+        started = time.monotonic()
+        expires = started + budget
+        last_error = None
+        result = "failed"
+        cancelled = False
+        self._admit()
+        try:
+            async with self._semaphore():
+                LLM_QUEUE_WAIT.observe(time.monotonic() - started)
+                with LLM_IN_FLIGHT.track():
+                    for attempt in range(self.max_retries):
+                        if expires - time.monotonic() <= 0:
+                            break
+                        attempt_started = time.monotonic()
+                        outcome = "error"
+                        received = False
+                        chunks = self._stream(prompt, system, config, usage)
+                        try:
+                            while True:
+                                remaining = expires - time.monotonic()
+                                if remaining <= 0:
+                                    raise asyncio.TimeoutError
+                                try:
+                                    text = await asyncio.wait_for(chunks.__anext__(), timeout=min(self.attempt_timeout, remaining))
+                                except StopAsyncIteration:
+                                    break
+                                if not received:
+                                    received = True
+                                    LLM_FIRST_CHUNK.observe(time.monotonic() - started)
+                                yield text
+                            outcome = result = "ok"
+                            for kind in ("input", "cached", "output"):
+                                LLM_TOKENS.inc(kind, amount=usage.get(f"{kind}_tokens") or 0)
+                            return
+                        except asyncio.TimeoutError:
+                            outcome = "timeout"
+                            last_error = LLMDeadlineExceeded("Gemini stream stalled or ran past the deadline")
+                        except Exception as e:
+                            last_error = e
+                        finally:
+                            await chunks.aclose()
+                            LLM_ATTEMPTS.inc(outcome)
+                            LLM_ATTEMPT_DURATION.observe(time.monotonic() - attempt_started, outcome)
+                        if received:
+                            break
+                        if attempt < self.max_retries - 1:
+                            wait = self._backoff(attempt)
+                            if time.monotonic() + wait >= expires:
+                                break
+                            await asyncio.sleep(wait)
+        except (asyncio.CancelledError, GeneratorExit):
+            cancelled = True
+            raise
+        finally:
+            LLM_CALLS.inc(result)
+            LLM_CALL_DURATION.observe(time.monotonic() - started, result)
+            self._settle(result, cancelled)
+        raise last_error or LLMDeadlineExceeded(f"Gemini deadline of {budget}s exhausted")
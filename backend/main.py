@@ -1,397 +1,1219 @@
+import time
+_import_started = time.perf_counter()
 import os
 import json
+import math
 import uuid
-import time
-import sqlite3
-from contextlib import contextmanager
-from typing import Optional
-from fastapi import FastAPI, HTTPException
+import logging
+import asyncio
+import hmac
+import codecs
+import hashlib
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional, Union
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
-import google.generativeai as genai
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, field_validator
+from roadmap_cache import RoadmapCache, cache_key
+from llm_client import GeminiClient
+from jobs import RoadmapJobQueue
+from singleflight import SingleFlight
+from db import open_pool, TimedConnection
+from migrations import migrate
+from export import SessionExporter
+from benchmarks import BenchmarkRollups, OVERALL
+from content import ContentRegistry, encode_json, etag_matches
+from catalogue import CatalogueStore, CatalogueError
+from roadmap_stream import RoadmapParser
+from roadmap_rules import template_roadmap
+from prompts import PromptBuilder, UsageLog, estimate_tokens
+from admission import RateLimiter, CircuitBreaker, CircuitOpenError
+from retention import Retention, SessionArchive
+from outbox import EmailOutbox, SMTPTransport, normalize_email
+from portfolios import PortfolioStore
+import metrics
+
+@asynccontextmanager
+async def lifespan(app):
+    maintenance_stop = threading.Event()
+    threading.Thread(target=startup_maintenance, kwargs={"stop": maintenance_stop}, name="startup-maintenance", daemon=True).start()
+    if RETENTION_INTERVAL > 0:
+        threading.Thread(target=retention_loop, args=(maintenance_stop,), name="retention", daemon=True).start()
+    await roadmap_jobs.start()
+    if email_outbox.transport:
+        await email_outbox.start()
+    poll = float(os.environ.get("CATALOGUE_POLL_INTERVAL", "10"))
+    watcher = asyncio.create_task(catalogue.watch(poll)) if poll > 0 else None
+    warmup = asyncio.create_task(asyncio.to_thread(warm_up, maintenance_stop))
+    yield
+    warmup.cancel()
+    if watcher:
+        watcher.cancel()
+    await roadmap_jobs.stop()
+    await email_outbox.stop()
+    maintenance_stop.set()
+    db_pool.close()
 
-app = FastAPI(title="ZT Compass API")
+app = FastAPI(title="ZT Compass API", lifespan=lifespan)
 
-DB_PATH = "/tmp/ztcompass.db"
+DB_PATH = os.environ.get("ZTC_DB_PATH", "/tmp/ztcompass.db")
 GEMINI_KEY = os.environ.get("GEMINI_API_KEY", "REDACTED_GEMINI_KEY")
-genai.configure(api_key=GEMINI_KEY)
+
+# Unset: a SQLite file per instance. postgresql://...: one database shared by every worker and node.
+DATABASE_URL = os.environ.get("ZTC_DATABASE_URL")
+db_pool = open_pool(DATABASE_URL, DB_PATH, size=int(os.environ.get("DB_POOL_SIZE", "8")))
 
 def init_db():
-    con = sqlite3.connect(DB_PATH)
-    con.execute("""
-        CREATE TABLE IF NOT EXISTS sessions (
-            id TEXT PRIMARY KEY,
-            region TEXT,
-            answers TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    con.execute("""
-        CREATE TABLE IF NOT EXISTS emails (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id TEXT,
-            email TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    con.commit(); con.close()
+    return migrate(db_pool)
+
+# "startup": apply pending migrations on import (a no-op read once up to date).
+# "off": the schema is managed by a release job (`python migrations.py`), instances run no DDL for it.
+ZTC_MIGRATE = os.environ.get("ZTC_MIGRATE", "startup")
+
+DB_WAIT = metrics.registry.histogram("ztc_db_acquire_seconds", "Time to get a pooled connection (and the write lock for writes).", ("mode",), metrics.DB_BUCKETS)
+DB_HOLD = metrics.registry.histogram("ztc_db_hold_seconds", "Time a connection (or write transaction) is held.", ("mode",), metrics.DB_BUCKETS)
+DB_QUERY = metrics.registry.histogram("ztc_db_query_seconds", "SQLite statement execution time by leading keyword.", ("statement",), metrics.DB_BUCKETS)
+metrics.registry.callback_gauge("ztc_db_pool_connections", "SQLite pool connections by state.", ("state",),
+                                lambda: {("opened",): db_pool.stats()["opened"], ("idle",): db_pool.stats()["idle"]})
 
 @contextmanager
-def get_db():
-    con = sqlite3.connect(DB_PATH)
-    con.row_factory = sqlite3.Row
-    try:
-        yield con
-        con.commit()
-    finally:
-        con.close()
+def get_db(write: bool = False):
+    """Pooled connection; pass write=True for statements that modify data (one IMMEDIATE transaction)."""
+    mode = "write" if write else "read"
+    started = time.perf_counter()
+    with db_pool.connection(write=write) as con:
+        acquired = time.perf_counter()
+        DB_WAIT.observe(acquired - started, mode)
+        try:
+            yield TimedConnection(con, DB_QUERY.observe)
+        finally:
+            DB_HOLD.observe(time.perf_counter() - acquired, mode)
+
+if ZTC_MIGRATE != "off":
+    init_db()
 
-init_db()
+# Bump whenever the prompt or the expected roadmap shape changes, so cached roadmaps are not reused.
+PROMPT_VERSION = "v3"
+ROADMAP_RESULTS = metrics.registry.counter("ztc_roadmap_results_total", "Roadmaps served by source (cache, gemini, template).", ("source",))
+# 0: serve the rule-based roadmap only and never call Gemini for roadmaps.
+ROADMAP_REFINE = os.environ.get("ROADMAP_REFINE", "1") == "1"
+prompt_builder = PromptBuilder(
+    budget=int(os.environ.get("LLM_PROMPT_BUDGET", "1200")),
+    note_chars=int(os.environ.get("LLM_NOTE_CHARS", "160")),
+    max_output_tokens=int(os.environ.get("LLM_MAX_OUTPUT_TOKENS", "2048")),
+)
+llm_usage = UsageLog(db_pool)
+roadmap_cache = RoadmapCache(
+    db_pool,
+    maxsize=int(os.environ.get("ROADMAP_CACHE_SIZE", "1024")),
+    ttl=int(os.environ.get("ROADMAP_CACHE_TTL", "86400")),
+    sync_interval=float(os.environ.get("ROADMAP_CACHE_SYNC_INTERVAL", "2")),
+)
+# Coalesces concurrent generations of the same cache key, within and across worker processes.
+roadmap_flight = SingleFlight(db_pool, lease_ttl=float(os.environ.get("LLM_DEADLINE", "45")) + 15)
+
+# Opens after LLM_BREAKER_FAILURES failed calls in a row; roadmaps then fall back to the template.
+llm_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURES", "5")),
+    reset_timeout=float(os.environ.get("LLM_BREAKER_RESET", "30")),
+)
+metrics.registry.callback_gauge("ztc_llm_circuit_state", "1 for the Gemini circuit breaker's current state.", ("state",),
+                                lambda: {(s,): int(llm_breaker.state == s) for s in (CircuitBreaker.CLOSED, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN)})
+
+llm = GeminiClient(
+    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "64")),
+    attempt_timeout=float(os.environ.get("LLM_ATTEMPT_TIMEOUT", "30")),
+    deadline=float(os.environ.get("LLM_DEADLINE", "45")),
+    endpoint=os.environ.get("GEMINI_API_ENDPOINT"),
+    api_key=GEMINI_KEY,
+    breaker=llm_breaker,
+)
+
+# Token buckets: requests per second and burst. A rate of 0 turns the limit off.
+ip_limiter = RateLimiter(float(os.environ.get("RATE_LIMIT_IP_RATE", "2")), float(os.environ.get("RATE_LIMIT_IP_BURST", "40")))
+roadmap_limiter = RateLimiter(float(os.environ.get("RATE_LIMIT_ROADMAP_RATE", "0.1")), float(os.environ.get("RATE_LIMIT_ROADMAP_BURST", "5")))
+# Number of proxies in front of the app that append to X-Forwarded-For; 0 trusts none of it.
+# The container image sets 1 for Cloud Run, whose front end appends the caller's address.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "0"))
+# Queued roadmap jobs (all workers and nodes) beyond which new refinements are skipped.
+ROADMAP_MAX_QUEUE = int(os.environ.get("ROADMAP_MAX_QUEUE", "200"))
+ROADMAP_SHED_RETRY_AFTER = int(os.environ.get("ROADMAP_SHED_RETRY_AFTER", "15"))
+ADMISSION_REJECTED = metrics.registry.counter("ztc_admission_rejected_total", "Requests refused with 429 (ip, session) or refinements skipped on a full queue (queue).", ("reason",))
+
+def client_ip(request: Request) -> str:
+    if TRUSTED_PROXY_HOPS:
+        hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if len(hops) >= TRUSTED_PROXY_HOPS:
+            return hops[-TRUSTED_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+def too_many_requests(reason: str, retry_after: float, detail: str = "Too many requests"):
+    ADMISSION_REJECTED.inc(reason)
+    raise HTTPException(429, detail, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+def admit(request: Request, session_id: str = None):
+    """429 unless the caller's IP (and `session_id`, for roadmap requests) has tokens left."""
+    wait = ip_limiter.hit(client_ip(request))
+    if wait:
+        too_many_requests("ip", wait)
+    if session_id is not None:
+        wait = roadmap_limiter.hit(session_id)
+        if wait:
+            too_many_requests("session", wait, "Roadmap requested too often for this session")
+
+# Operator endpoints (exports, maintenance, cache and catalogue control) need this bearer token;
+# while it is unset they are disabled.
+ADMIN_TOKEN = os.environ.get("ZTC_ADMIN_TOKEN", "")
+
+def require_admin(request: Request):
+    """401 without an `Authorization: Bearer <ZTC_ADMIN_TOKEN>` header, 403 with a wrong token."""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(401, "Admin token required", headers={"WWW-Authenticate": "Bearer"})
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(403, "Invalid admin token")
 
 class SessionCreate(BaseModel):
     region: str
 
+class AnswerFields(BaseModel):
+    answer: Optional[str] = None
+    note: Optional[str] = None
+
 class AnswerSubmit(BaseModel):
     session_id: str
-    answers: dict
+    answers: Dict[str, Union[AnswerFields, str]]
+    revision: Optional[int] = None
+
+class AnswerPatch(AnswerFields):
+    revision: Optional[int] = None
+
+class AnswersPatch(BaseModel):
+    answers: Dict[str, Union[AnswerFields, str]]
+    revision: Optional[int] = None
 
 class EmailCapture(BaseModel):
     email: str
 
-QUESTIONS = [
-    {"id": "id_mfa",    "pillar": "Identity",      "text": "Is MFA enforced for all users (including admins)?",                         "hint": "Consider employees, contractors, admins, and service accounts."},
-    {"id": "id_cond",   "pillar": "Identity",      "text": "Do you have conditional access policies restricting sign-in by device compliance or location?", "hint": "E.g. Entra ID CA, Okta policies, or equivalent."},
-    {"id": "dev_mdm",   "pillar": "Devices",       "text": "Are all corporate endpoints enrolled in an MDM solution?",                  "hint": "Intune, Jamf, VMware Workspace ONE, etc."},
-    {"id": "dev_edr",   "pillar": "Devices",       "text": "Is EDR (Endpoint Detection & Response) deployed on all endpoints?",         "hint": "CrowdStrike, Defender for Endpoint, SentinelOne, etc."},
-    {"id": "net_seg",   "pillar": "Network",       "text": "Is your network segmented to limit lateral movement?",                      "hint": "Micro-segmentation or VLAN isolation. Flat networks are high risk."},
-    {"id": "net_vpn",   "pillar": "Network",       "text": "Is remote access provided via ZTNA or a managed VPN with MFA?",            "hint": "ZTNA (Zscaler, Cloudflare Access) preferred over traditional VPN."},
-    {"id": "app_auth",  "pillar": "Applications",  "text": "Are your crown-jewel applications using modern authentication (OAuth2/SAML/OIDC)?", "hint": "Legacy NTLM/Kerberos-only apps are a significant risk."},
-    {"id": "app_pam",   "pillar": "Applications",  "text": "Is privileged access reviewed quarterly or more frequently?",               "hint": "Just-in-time access and PAM tools reduce exposure."},
-    {"id": "dat_class", "pillar": "Data",          "text": "Has sensitive data been classified and labelled across your environment?",  "hint": "Microsoft Purview, Varonis, or manual classification frameworks."},
-    {"id": "dat_bkp",   "pillar": "Data",          "text": "Has a backup restore been successfully tested in the last 6 months?",       "hint": "An untested backup is not a backup."},
-]
-
-SCORE_MAP = {"yes": 100, "partial": 50, "no": 0, "unknown": 10}
-
-def compute_scores(answers: dict):
-    pillars = {}
-    for q in QUESTIONS:
-        p = q["pillar"]
-        a = answers.get(q["id"], {})
-        raw = a.get("answer", "unknown").lower()
-        score = SCORE_MAP.get(raw, 10)
-        if p not in pillars:
-            pillars[p] = []
-        pillars[p].append(score)
-    result = {}
-    for p, scores in pillars.items():
-        avg = sum(scores) / len(scores)
-        if avg >= 80:
-            level = "Optimal"
-        elif avg >= 55:
-            level = "Advanced"
-        elif avg >= 30:
-            level = "Initial"
-        else:
-            level = "Traditional"
-        result[p] = {"score": round(avg), "level": level}
-    return result
-
-REGION_BANNERS = {
-    "CH": "🇨🇭 CH: Mandatory 24h incident reporting to NCSC applies if you operate critical infrastructure. ISG/KISG compliance required.",
-    "UK": "🇬🇧 UK: Cyber Breaches Survey 2025 — 43% of UK businesses suffered a breach last year. NCSC CAF alignment recommended.",
-    "EU": "🇪🇺 EU: NIS2 Directive requires risk management measures, incident reporting within 24h, and board accountability.",
-}
-
-RISK_TEMPLATES = {
-    "Identity":     ("No MFA = highest ransomware entry vector. Credential-based attacks account for 80% of breaches.", "Enable MFA for all accounts in 48h — free with Entra ID / Google Workspace."),
-    "Devices":      ("Unmanaged endpoints cannot be trusted. BYOD without MDM is a blind spot.", "Enrol all company-issued devices in MDM this sprint. Start with priority assets."),
-    "Network":      ("Flat networks allow lateral movement — one breach = full compromise.", "Implement VLAN segregation for crown-jewel systems as a quick win."),
-    "Applications": ("Legacy auth apps bypass modern identity controls entirely.", "Onboard top-5 apps to SSO/SAML — removes password sprawl and gives visibility."),
-    "Data":         ("Unclassified data = unprotected data. You can't protect what you can't see.", "Run a data discovery scan and label top-3 sensitive data stores this week."),
-}
-
-def generate_risks_and_wins(pillar_scores: dict):
+    @field_validator("email")
+    @classmethod
+    def _address(cls, v: str) -> str:
+        return normalize_email(v)
+
+class PortfolioCreate(BaseModel):
+    name: str
+    session_ids: list = []
+
+class PortfolioSessions(BaseModel):
+    session_ids: list
+
+class DashboardBatch(BaseModel):
+    session_ids: Optional[list] = None
+    portfolio_id: Optional[str] = None
+    since: Optional[dict] = None
+    cursor: Optional[str] = None
+    limit: int = 100
+
+# Score columns are schema, not content: every catalogue must use exactly these pillars.
+PILLAR_COLUMNS = {p: f"score_{p.lower()}" for p in ("Identity", "Devices", "Network", "Applications", "Data")}
+PILLARS = list(PILLAR_COLUMNS)
+benchmarks = BenchmarkRollups(db_pool, PILLARS)
+
+# Questions, scoring, risk templates, playbooks and region content live in a versioned data file.
+CATALOGUE_PATH = os.environ.get("ZTC_CATALOGUE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "catalogue.json"))
+catalogue = CatalogueStore(CATALOGUE_PATH, PILLARS)
+catalogue.load()
+
+def maturity_level(avg: float) -> str:
+    if avg >= 80:
+        return "Optimal"
+    elif avg >= 55:
+        return "Advanced"
+    elif avg >= 30:
+        return "Initial"
+    return "Traditional"
+
+def pillar_average(answers: dict, questions: list, cat) -> float:
+    scores = [cat.points((answers.get(q["id"]) or {}).get("answer")) for q in questions]
+    return sum(scores) / len(scores)
+
+def pillar_averages(answers: dict, cat=None):
+    cat = cat or catalogue.current
+    return {p: pillar_average(answers, questions, cat) for p, questions in cat.questions_by_pillar.items()}
+
+def compute_scores(answers: dict, cat=None):
+    return {p: {"score": round(avg), "level": maturity_level(avg)} for p, avg in pillar_averages(answers, cat).items()}
+
+def overall_score(pillar_scores: dict) -> int:
+    return round(sum(p["score"] for p in pillar_scores.values()) / len(pillar_scores))
+
+def generate_risks_and_wins(pillar_scores: dict, cat=None):
+    templates = (cat or catalogue.current).risk_templates
     ordered = sorted(pillar_scores.items(), key=lambda x: x[1]["score"])
-    risks = [{"pillar": p, "score": sc["score"], "risk": RISK_TEMPLATES.get(p, ("Risk", "Win"))[0]} for p, sc in ordered[:5]]
-    wins  = [{"pillar": p, "win":  RISK_TEMPLATES.get(p, ("Risk", "Win"))[1]} for p, sc in ordered]
+    risks = [{"pillar": p, "score": sc["score"], "risk": templates.get(p, ("Risk", "Win"))[0]} for p, sc in ordered[:5]]
+    wins  = [{"pillar": p, "win":  templates.get(p, ("Risk", "Win"))[1]} for p, sc in ordered]
     return risks[:5], wins[:5]
 
-def _gemini_generate_with_retry(prompt: str, max_retries: int = 3, timeout: int = 30) -> str:
-    """Generate content with retry and exponential backoff."""
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    last_error = None
-    for attempt in range(max_retries):
-        try:
-            import threading
-            result = [None]
-            error = [None]
-            def _call():
+def build_dashboard(session_id: str, region: str, pillar_scores: dict, cat=None) -> dict:
+    cat = cat or catalogue.current
+    risks, wins = generate_risks_and_wins(pillar_scores, cat)
+    return {
+        "session_id": session_id,
+        "region": region,
+        "overall_score": overall_score(pillar_scores),
+        "pillar_scores": pillar_scores,
+        "top_risks": risks,
+        "quick_wins": wins,
+        "region_banner": cat.region_banners.get(region, ""),
+        "catalogue_version": cat.version,
+    }
+
+def store_dashboard(db, session_id: str, payload: dict, replace: bool = True):
+    body = encode_json(payload)
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    db.execute(
+        f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO dashboards (session_id, etag, payload, updated_at) VALUES (?,?,?,?)",
+        (session_id, etag, body, time.time()),
+    )
+    return etag, body
+
+class RevisionConflict(Exception):
+    def __init__(self, revision: int):
+        super().__init__(f"session is at revision {revision}")
+        self.revision = revision
+
+def normalize_answers(answers: dict) -> dict:
+    """Bare answer strings or {answer, note} dicts -> {question_id: {"answer", "note"}}, dropping empty questions."""
+    out = {}
+    for qid, a in answers.items():
+        if not isinstance(a, dict):
+            a = {"answer": a}
+        if a.get("answer") is not None or a.get("note") is not None:
+            out[qid] = {"answer": a.get("answer"), "note": a.get("note")}
+    return out
+
+def store_answers(db, session_id: str, answers: dict, revision: int = None, bump: bool = True):
+    """Replace a session's answers, refresh its score columns, benchmark rollups and dashboard.
+
+    Scores are computed against one catalogue snapshot, whose version is recorded on the session.
+    With `revision`, raises RevisionConflict unless the session is still at that revision.
+    Returns the session's new revision, or None if the session does not exist.
+    """
+    benchmarks.lock(db)
+    db_pool.lock(db, f"session:{session_id}")
+    cat = catalogue.current
+    cols = ", ".join(PILLAR_COLUMNS.values())
+    old = db.execute(f"SELECT region, revision, in_benchmark, overall_score, {cols} FROM sessions WHERE id=?", (session_id,)).fetchone()
+    if old is None:
+        return None
+    if revision is not None and revision != old["revision"]:
+        raise RevisionConflict(old["revision"])
+    answers = normalize_answers(answers)
+    rows = [(session_id, qid, a["answer"], a["note"]) for qid, a in answers.items()]
+    averages = pillar_averages(answers, cat)
+    pillar_scores = compute_scores(answers, cat)
+    overall = overall_score(pillar_scores)
+    counted = is_complete(answers, cat)
+    assignments = ", ".join(f"{col}=?" for col in PILLAR_COLUMNS.values())
+    db.execute(
+        f"UPDATE sessions SET answers=NULL, answers_normalized=1, {assignments}, overall_score=?, answered_at=?, in_benchmark=?, catalogue_version=?, revision=? WHERE id=?",
+        (*(averages[p] for p in PILLAR_COLUMNS), overall, time.time(), int(counted), cat.version, old["revision"] + bump, session_id),
+    )
+    db.execute("DELETE FROM answers WHERE session_id=?", (session_id,))
+    db.executemany("INSERT INTO answers (session_id, question_id, answer, note) VALUES (?,?,?,?)", rows)
+
+    old_scores = None
+    if old["in_benchmark"]:
+        old_scores = {p: round(old[c]) for p, c in PILLAR_COLUMNS.items()}
+        old_scores[OVERALL] = old["overall_score"]
+    new_scores = None
+    if counted:
+        new_scores = {p: sc["score"] for p, sc in pillar_scores.items()}
+        new_scores[OVERALL] = overall
+    benchmarks.apply(db, old["region"], old_scores, new_scores)
+
+    store_dashboard(db, session_id, build_dashboard(session_id, old["region"], pillar_scores, cat))
+    return old["revision"] + bump
+
+def is_complete(answers: dict, cat) -> bool:
+    """A finished assessment: every catalogue question answered. Only these count in the benchmarks."""
+    return all((answers.get(q["id"]) or {}).get("answer") is not None for q in cat.questions)
+
+def _answer_row(a: dict):
+    return a.get("answer"), a.get("note")
+
+def patch_answers(db, session_id: str, changes: dict, revision: int = None):
+    """Merge the given fields into individual questions' answer and note (clear a question once both are None).
+
+    Only the pillars the changed questions belong to are rescored; the other score columns,
+    and their benchmark buckets, are left alone. Sessions still in the legacy blob or scored
+    against another catalogue version are rescored in full instead.
+    Returns the new revision, or None if the session does not exist.
+    """
+    benchmarks.lock(db)
+    db_pool.lock(db, f"session:{session_id}")
+    cat = catalogue.current
+    cols = ", ".join(PILLAR_COLUMNS.values())
+    old = db.execute(
+        f"SELECT region, revision, in_benchmark, overall_score, answers, answers_normalized, catalogue_version, {cols} FROM sessions WHERE id=?",
+        (session_id,),
+    ).fetchone()
+    if old is None:
+        return None
+    if revision is not None and revision != old["revision"]:
+        raise RevisionConflict(old["revision"])
+    if not changes:
+        return old["revision"]
+    if not old["answers_normalized"] or old["catalogue_version"] != cat.version:
+        answers = load_answers(db, session_id, old)
+        for qid, a in changes.items():
+            prev = answers.get(qid, {})
+            a = {**(prev if isinstance(prev, dict) else {"answer": prev}), **a}
+            if _answer_row(a) == (None, None):
+                answers.pop(qid, None)
+            else:
+                answers[qid] = {k: v for k, v in zip(("answer", "note"), _answer_row(a)) if v is not None}
+        return store_answers(db, session_id, answers)
+
+    stored = {
+        r["question_id"]: {"answer": r["answer"], "note": r["note"]}
+        for r in db.execute(
+            f"SELECT question_id, answer, note FROM answers WHERE session_id=? AND question_id IN ({','.join('?' * len(changes))})",
+            (session_id, *changes),
+        )
+    }
+    changes = {qid: {**stored.get(qid, {}), **a} for qid, a in changes.items()}
+    upserts = [(session_id, qid, *_answer_row(a)) for qid, a in changes.items() if _answer_row(a) != (None, None)]
+    clears = [(session_id, qid) for qid, a in changes.items() if _answer_row(a) == (None, None)]
+    db.executemany("INSERT OR REPLACE INTO answers (session_id, question_id, answer, note) VALUES (?,?,?,?)", upserts)
+    db.executemany("DELETE FROM answers WHERE session_id=? AND question_id=?", clears)
+
+    touched = {cat.questions_by_id[qid]["pillar"] for qid in changes}
+    qids = [q["id"] for p in touched for q in cat.questions_by_pillar[p]]
+    current = {
+        r["question_id"]: {"answer": r["answer"]}
+        for r in db.execute(
+            f"SELECT question_id, answer FROM answers WHERE session_id=? AND answer IS NOT NULL AND question_id IN ({','.join('?' * len(qids))})",
+            (session_id, *qids),
+        )
+    }
+    averages = {p: old[col] for p, col in PILLAR_COLUMNS.items()}
+    averages.update({p: pillar_average(current, cat.questions_by_pillar[p], cat) for p in touched})
+    pillar_scores = {p: {"score": round(avg), "level": maturity_level(avg)} for p, avg in averages.items()}
+    overall = overall_score(pillar_scores)
+    ids = [q["id"] for q in cat.questions]
+    counted = db.execute(
+        f"SELECT COUNT(*) FROM answers WHERE session_id=? AND answer IS NOT NULL AND question_id IN ({','.join('?' * len(ids))})",
+        (session_id, *ids),
+    ).fetchone()[0] == len(ids)
+    assignments = ", ".join(f"{PILLAR_COLUMNS[p]}=?" for p in touched)
+    db.execute(
+        f"UPDATE sessions SET {assignments}, overall_score=?, answered_at=?, in_benchmark=?, revision=? WHERE id=?",
+        (*(averages[p] for p in touched), overall, time.time(), int(counted), old["revision"] + 1, session_id),
+    )
+
+    old_scores = None
+    if old["in_benchmark"]:
+        old_scores = {p: round(old[c]) for p, c in PILLAR_COLUMNS.items()}
+        old_scores[OVERALL] = old["overall_score"]
+    new_scores = None
+    if counted:
+        new_scores = {p: sc["score"] for p, sc in pillar_scores.items()}
+        new_scores[OVERALL] = overall
+    benchmarks.apply(db, old["region"], old_scores, new_scores)
+
+    store_dashboard(db, session_id, build_dashboard(session_id, old["region"], pillar_scores, cat))
+    return old["revision"] + 1
+
+def load_answers(db, session_id: str, row=None) -> dict:
+    """Answers dict in the API shape; reads the legacy JSON blob for rows the backfill hasn't reached yet."""
+    if row is not None and not row["answers_normalized"]:
+        return json.loads(row["answers"] or "{}")
+    answers = {}
+    for r in db.execute("SELECT question_id, answer, note FROM answers WHERE session_id=?", (session_id,)):
+        a = {}
+        if r["answer"] is not None:
+            a["answer"] = r["answer"]
+        if r["note"] is not None:
+            a["note"] = r["note"]
+        answers[r["question_id"]] = a
+    return answers
+
+def stored_scores(row) -> dict:
+    return {p: {"score": round(row[col]), "level": maturity_level(row[col])} for p, col in PILLAR_COLUMNS.items()}
+
+def backfill_answers(batch_size: int = 200, stop: threading.Event = None) -> int:
+    """Move legacy JSON answer blobs into the answers table in small write transactions."""
+    migrated = 0
+    while not (stop and stop.is_set()):
+        with get_db(write=True) as db:
+            rows = db.execute("SELECT id, answers FROM sessions WHERE answers_normalized=0 ORDER BY id LIMIT ?", (batch_size,)).fetchall()
+            for row in rows:
                 try:
-                    result[0] = model.generate_content(prompt)
-                except Exception as e:
-                    error[0] = e
-            t = threading.Thread(target=_call)
-            t.start()
-            t.join(timeout=timeout)
-            if t.is_alive():
-                raise TimeoutError(f"Gemini call timed out after {timeout}s")
-            if error[0]:
-                raise error[0]
-            return result[0].text.strip()
-        except Exception as e:
-            last_error = e
-            if attempt < max_retries - 1:
-                wait = (2 ** attempt) * 1.5
-                time.sleep(wait)
-    raise last_error
+                    answers = json.loads(row["answers"] or "{}")
+                except ValueError:
+                    answers = {}
+                store_answers(db, row["id"], answers if isinstance(answers, dict) else {}, bump=False)
+        migrated += len(rows)
+        if len(rows) < batch_size:
+            break
+    return migrated
+
+def startup_maintenance(stop: threading.Event = None):
+    backfill_answers(stop=stop)
+    if not (stop and stop.is_set()) and benchmarks.is_empty():
+        benchmarks.rebuild(PILLAR_COLUMNS, [q["id"] for q in catalogue.current.questions])
+
+# Retention periods in days; 0 turns that step off. Archives must sit on storage every node can read.
+def _days(name: str, default: str) -> float:
+    return float(os.environ.get(name, default)) * 86400
+
+session_archive = SessionArchive(db_pool, os.environ.get("ZTC_ARCHIVE_DIR", os.path.splitext(DB_PATH)[0] + "-archive"))
+retention = Retention(
+    db_pool,
+    session_archive,
+    benchmarks,
+    PILLAR_COLUMNS,
+    incomplete_ttl=_days("SESSION_TTL_DAYS", "7"),
+    archive_after=_days("ARCHIVE_AFTER_DAYS", "180"),
+    job_ttl=_days("JOB_RETENTION_DAYS", "7"),
+    usage_ttl=_days("LLM_USAGE_RETENTION_DAYS", "90"),
+    chunk_size=int(os.environ.get("RETENTION_CHUNK", "500")),
+)
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", "3600"))
+# One retention pass at a time across every worker and node.
+retention_flight = SingleFlight(db_pool, lease_ttl=retention.max_seconds + 60)
+log = logging.getLogger("ztcompass.retention")
+
+def run_retention(stop: threading.Event = None, full_vacuum: bool = False):
+    """One pass, or None when another process is already running one."""
+    owner = retention_flight.try_lease("retention")
+    if owner is None:
+        return None
+    try:
+        return retention.run(stop=stop, full_vacuum=full_vacuum)
+    finally:
+        retention_flight.release("retention", owner)
+
+def retention_loop(stop: threading.Event):
+    while not stop.wait(RETENTION_INTERVAL):
+        try:
+            run_retention(stop)
+        except Exception:
+            log.exception("Retention pass failed")
 
 @app.post("/api/sessions")
-def create_session(body: SessionCreate):
+def create_session(body: SessionCreate, request: Request):
+    admit(request)
     sid = str(uuid.uuid4())
-    with get_db() as db:
-        db.execute("INSERT INTO sessions (id, region, answers) VALUES (?,?,?)", (sid, body.region, "{}"))
-    return {"session_id": sid, "questions": QUESTIONS}
+    cat = catalogue.current
+    with get_db(write=True) as db:
+        db.execute("INSERT INTO sessions (id, region) VALUES (?,?)", (sid, body.region))
+        revision = store_answers(db, sid, {})
+    return {"session_id": sid, "questions": cat.questions, "catalogue_version": cat.version, "revision": revision}
 
 @app.get("/api/sessions/{session_id}")
 def get_session(session_id: str):
     with get_db() as db:
         row = db.execute("SELECT * FROM sessions WHERE id=?", (session_id,)).fetchone()
-    if not row:
-        raise HTTPException(404, "Session not found")
+        answers = load_answers(db, session_id, row) if row else None
+    archived = row is None
+    if archived:
+        # Archived by retention: served read-only from the cold files.
+        row = session_archive.load(session_id)
+        if not row:
+            raise HTTPException(404, "Session not found")
+        answers = row["answers"]
     return {
         "session_id": row["id"],
         "region": row["region"],
-        "answers": json.loads(row["answers"]),
-        "questions": QUESTIONS,
+        "answers": answers,
+        "questions": catalogue.current.questions,
+        "catalogue_version": row["catalogue_version"],
+        "revision": row["revision"],
+        "archived": archived,
     }
 
+def _conflict(e: RevisionConflict):
+    return HTTPException(409, {"message": "Session was modified by another client", "revision": e.revision})
+
 @app.post("/api/sessions/{session_id}/answers")
 def submit_answers(session_id: str, body: AnswerSubmit):
+    try:
+        with get_db(write=True) as db:
+            answers = {qid: a.model_dump() if isinstance(a, AnswerFields) else a for qid, a in body.answers.items()}
+            revision = store_answers(db, session_id, answers, body.revision)
+    except RevisionConflict as e:
+        raise _conflict(e)
+    if revision is None:
+        raise HTTPException(404, "Session not found")
+    return {"ok": True, "revision": revision}
+
+def _apply_patch(session_id: str, changes: dict, revision: Optional[int]):
+    try:
+        with get_db(write=True) as db:
+            new_revision = patch_answers(db, session_id, changes, revision)
+    except RevisionConflict as e:
+        raise _conflict(e)
+    if new_revision is None:
+        raise HTTPException(404, "Session not found")
+    return {"ok": True, "revision": new_revision}
+
+@app.patch("/api/sessions/{session_id}/answers")
+def patch_session_answers(session_id: str, body: AnswersPatch):
+    """Several answer deltas in one transaction and one revision bump."""
+    questions = catalogue.current.questions_by_id
+    unknown = sorted(qid for qid in body.answers if qid not in questions)
+    if unknown:
+        raise HTTPException(422, f"Unknown questions: {', '.join(unknown)}")
+    changes = {
+        qid: a.model_dump(exclude_unset=True) if isinstance(a, AnswerFields) else {"answer": a}
+        for qid, a in body.answers.items()
+    }
+    return _apply_patch(session_id, changes, body.revision)
+
+@app.patch("/api/sessions/{session_id}/answers/{question_id}")
+def patch_session_answer(session_id: str, question_id: str, body: AnswerPatch):
+    if question_id not in catalogue.current.questions_by_id:
+        raise HTTPException(404, "Question not found")
+    return _apply_patch(session_id, {question_id: body.model_dump(include={"answer", "note"}, exclude_unset=True)}, body.revision)
+
+@app.get("/api/sessions/{session_id}/dashboard")
+def get_dashboard(session_id: str, request: Request):
+    snapshot = None
     with get_db() as db:
-        row = db.execute("SELECT id FROM sessions WHERE id=?", (session_id,)).fetchone()
-        if not row:
+        snap = db.execute("SELECT etag, payload FROM dashboards WHERE session_id=?", (session_id,)).fetchone()
+        if snap:
+            etag, body = snap["etag"], snap["payload"]
+        else:
+            row = db.execute("SELECT * FROM sessions WHERE id=?", (session_id,)).fetchone()
+            if row and row["answers_normalized"]:
+                snapshot = build_dashboard(session_id, row["region"], stored_scores(row))
+            elif row:
+                snapshot = build_dashboard(session_id, row["region"], compute_scores(load_answers(db, session_id, row)))
+    if snapshot is not None:
+        # Sessions scored before snapshots existed are materialized on first read. IGNORE so a
+        # concurrent submit_answers snapshot is never overwritten by this (possibly older) one.
+        with get_db(write=True) as db:
+            etag, body = store_dashboard(db, session_id, snapshot, replace=False)
+    elif not snap:
+        # Archived by retention: the snapshot taken when it was archived.
+        archived = session_archive.load(session_id)
+        if not archived or archived["dashboard"] is None:
             raise HTTPException(404, "Session not found")
-        db.execute("UPDATE sessions SET answers=? WHERE id=?", (json.dumps(body.answers), session_id))
+        etag, body = archived["dashboard_etag"], encode_json(archived["dashboard"])
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=bytes(body), media_type="application/json", headers=headers)
+
+portfolios = PortfolioStore(db_pool)
+LEVELS = ["Traditional", "Initial", "Advanced", "Optimal"]
+DASHBOARD_BATCH_LIMIT = int(os.environ.get("DASHBOARD_BATCH_LIMIT", "500"))
+DASHBOARD_BATCH_MAX_IDS = int(os.environ.get("DASHBOARD_BATCH_MAX_IDS", "5000"))
+
+@app.post("/api/portfolios")
+def create_portfolio(body: PortfolioCreate, request: Request):
+    admit(request)
+    portfolio_id = portfolios.create(body.name)
+    unknown = portfolios.add(portfolio_id, body.session_ids)
+    return {**portfolios.get(portfolio_id), "unknown": unknown}
+
+@app.get("/api/portfolios/{portfolio_id}")
+def get_portfolio(portfolio_id: str):
+    portfolio = portfolios.get(portfolio_id)
+    if not portfolio:
+        raise HTTPException(404, "Portfolio not found")
+    return portfolio
+
+@app.post("/api/portfolios/{portfolio_id}/sessions")
+def add_portfolio_sessions(portfolio_id: str, body: PortfolioSessions):
+    if not portfolios.get(portfolio_id):
+        raise HTTPException(404, "Portfolio not found")
+    unknown = portfolios.add(portfolio_id, body.session_ids)
+    return {**portfolios.get(portfolio_id), "unknown": unknown}
+
+@app.delete("/api/portfolios/{portfolio_id}/sessions/{session_id}")
+def remove_portfolio_session(portfolio_id: str, session_id: str):
+    if not portfolios.remove(portfolio_id, session_id):
+        raise HTTPException(404, "Session not in portfolio")
     return {"ok": True}
 
-@app.get("/api/sessions/{session_id}/dashboard")
-def get_dashboard(session_id: str):
-    with get_db() as db:
-        row = db.execute("SELECT * FROM sessions WHERE id=?", (session_id,)).fetchone()
-    if not row:
-        raise HTTPException(404, "Session not found")
-    answers = json.loads(row["answers"])
-    region = row["region"]
-    pillar_scores = compute_scores(answers)
-    risks, wins = generate_risks_and_wins(pillar_scores)
-    overall = round(sum(p["score"] for p in pillar_scores.values()) / len(pillar_scores))
+@app.post("/api/dashboards:batch")
+def dashboards_batch(body: DashboardBatch, request: Request):
+    """Scores of many sessions in one request, as pillar × session matrices.
+
+    Pass `session_ids` or a `portfolio_id`. Sessions come in id order, `limit` per page;
+    pass `next_cursor` back as `cursor` for the next one. With `since` ({session_id: revision}
+    the client already holds), sessions still at that revision are only counted in `unchanged`.
+    `levels` holds indexes into `levels_legend`.
+    """
+    admit(request)
+    if (body.session_ids is None) == (body.portfolio_id is None):
+        raise HTTPException(400, "Pass either session_ids or portfolio_id")
+    limit = min(max(body.limit, 1), DASHBOARD_BATCH_LIMIT)
+    if body.portfolio_id is not None:
+        page = portfolios.page(body.portfolio_id, body.cursor, limit + 1)
+        if not page and not portfolios.get(body.portfolio_id):
+            raise HTTPException(404, "Portfolio not found")
+    else:
+        if len(body.session_ids) > DASHBOARD_BATCH_MAX_IDS:
+            raise HTTPException(400, f"At most {DASHBOARD_BATCH_MAX_IDS} session_ids per request")
+        page = sorted({str(sid) for sid in body.session_ids if str(sid) > (body.cursor or "")})[:limit + 1]
+    next_cursor = page[limit - 1] if len(page) > limit else None
+    page = page[:limit]
+
+    rows = {}
+    if page:
+        cols = ", ".join(PILLAR_COLUMNS.values())
+        with get_db() as db:
+            for row in db.execute(
+                f"SELECT id, region, revision, catalogue_version, answers_normalized, answers, overall_score, {cols} "
+                f"FROM sessions WHERE id IN ({','.join('?' * len(page))})", page,
+            ):
+                rows[row["id"]] = row
+    for sid in page:
+        if sid not in rows:
+            archived = session_archive.load(sid)
+            if archived:
+                rows[sid] = archived
+
+    since = body.since or {}
+    out = {"session_ids": [], "regions": [], "revisions": [], "catalogue_versions": [], "overall": []}
+    scores, levels = [[] for _ in PILLARS], [[] for _ in PILLARS]
+    unchanged = 0
+    for sid in page:
+        row = rows.get(sid)
+        if row is None:
+            continue
+        if since.get(sid) == row["revision"]:
+            unchanged += 1
+            continue
+        if row["answers_normalized"]:
+            averages, overall = {p: row[col] for p, col in PILLAR_COLUMNS.items()}, row["overall_score"]
+        else:
+            averages = pillar_averages(json.loads(row["answers"] or "{}"))
+            overall = overall_score({p: {"score": round(a)} for p, a in averages.items()})
+        for key, value in (("session_ids", sid), ("regions", row["region"]), ("revisions", row["revision"]),
+                           ("catalogue_versions", row["catalogue_version"]), ("overall", overall)):
+            out[key].append(value)
+        for i, p in enumerate(PILLARS):
+            scores[i].append(round(averages[p]))
+            levels[i].append(LEVELS.index(maturity_level(averages[p])))
     return {
-        "session_id": session_id,
-        "region": region,
-        "overall_score": overall,
-        "pillar_scores": pillar_scores,
-        "top_risks": risks,
-        "quick_wins": wins,
-        "region_banner": REGION_BANNERS.get(region, ""),
+        "pillars": PILLARS,
+        "levels_legend": LEVELS,
+        **out,
+        "scores": scores,
+        "levels": levels,
+        "unchanged": unchanged,
+        "missing": [sid for sid in page if sid not in rows],
+        "next_cursor": next_cursor,
     }
 
-@app.post("/api/sessions/{session_id}/roadmap")
-def generate_roadmap(session_id: str):
+@app.get("/api/benchmarks/{region}")
+def get_benchmarks(region: str, session_id: Optional[str] = None):
+    """Per-pillar peer distribution for a region (or ALL); with session_id, also that session's percentiles."""
+    session_scores = None
+    if session_id:
+        cols = ", ".join(PILLAR_COLUMNS.values())
+        with get_db() as db:
+            row = db.execute(f"SELECT answers_normalized, overall_score, {cols} FROM sessions WHERE id=?", (session_id,)).fetchone()
+        if not row:
+            raise HTTPException(404, "Session not found")
+        if row["answers_normalized"]:
+            session_scores = {p: round(row[c]) for p, c in PILLAR_COLUMNS.items()}
+            session_scores[OVERALL] = row["overall_score"]
+    return {"region": region.upper(), "pillars": benchmarks.summary(region, session_scores)}
+
+def roadmap_key(region: str, answers: dict, cat=None) -> str:
+    # The prompt embeds question text, so a catalogue change must not reuse roadmaps cached under the old one.
+    return cache_key(region, answers, f"{PROMPT_VERSION}:{(cat or catalogue.current).version}")
+
+def session_template(region: str, answers: dict, cat=None) -> dict:
+    cat = cat or catalogue.current
+    return template_roadmap(region, answers, pillar_averages(answers, cat), cat)
+
+async def build_roadmap(session_id: str, progress=None):
+    """Gemini refinement of a session's rule-based roadmap, plus where the result came from:
+    "cache", "gemini" or "template" (Gemini failed; the draft is returned as is).
+
+    Gemini's reply is streamed and parsed task by task; `progress(partial_roadmap)` is called
+    whenever another valid task has arrived.
+    """
+    def _load():
+        with get_db() as db:
+            row = db.execute("SELECT * FROM sessions WHERE id=?", (session_id,)).fetchone()
+            if not row:
+                raise LookupError("Session not found")
+            answers = load_answers(db, session_id, row)
+        cat = catalogue.current
+        key = roadmap_key(row["region"], answers, cat)
+        return row["region"], answers, cat, key, roadmap_cache.get(key)
+
+    # Database and cache work runs in one thread hop before the Gemini call and one after it.
+    region, answers, cat, key, cached = await asyncio.to_thread(_load)
+    if cached is not None:
+        ROADMAP_RESULTS.inc("cache")
+        return cached, "cache"
+
+    def _record(tokens, usage, seconds, outcome, roadmap):
+        llm_usage.record(PROMPT_VERSION, tokens, usage, seconds, outcome)
+        if roadmap is not None:
+            roadmap_cache.put(key, region, roadmap)
+
+    async def _generate():
+        pillar_scores = compute_scores(answers, cat)
+        draft = session_template(region, answers, cat)
+        system = prompt_builder.system(cat)
+        prompt, prompt_tokens = prompt_builder.user(region, answers, pillar_scores, cat, draft)
+        parser = RoadmapParser()
+        usage, outcome, started, roadmap = {}, "failed", time.monotonic(), None
+        try:
+            async for chunk in llm.generate_stream(prompt, system=system, max_output_tokens=prompt_builder.max_output_tokens,
+                                                   json_output=True, usage=usage):
+                if parser.feed(chunk) and progress:
+                    progress(parser.partial())
+            roadmap = parser.result()
+            outcome = "ok"
+        except CircuitOpenError:
+            outcome = "rejected"
+        except Exception:
+            pass
+        finally:
+            if outcome != "rejected":
+                await asyncio.to_thread(_record, estimate_tokens(system) + prompt_tokens, usage, time.monotonic() - started, outcome, roadmap)
+        if roadmap is None:
+            # The draft is never cached as a refined roadmap, so the next request gets another shot at Gemini.
+            return draft, "template"
+        return roadmap, "gemini"
+
+    def _published():
+        cached = roadmap_cache.get(key)
+        return (cached, "cache") if cached is not None else None
+
+    roadmap, source = await roadmap_flight.do(key, _generate, lookup=_published)
+    ROADMAP_RESULTS.inc(source)
+    return roadmap, source
+
+roadmap_jobs = RoadmapJobQueue(
+    db_pool,
+    build_roadmap,
+    concurrency=int(os.environ.get("ROADMAP_WORKERS", "4")),
+    lease_ttl=float(os.environ.get("LLM_DEADLINE", "45")) + 15,
+    # Gemini calls in flight across every worker and node; 0 means only ROADMAP_WORKERS per process.
+    max_running=int(os.environ.get("LLM_GLOBAL_CONCURRENCY", "32")),
+)
+
+def _session_region(session_id: str):
+    with get_db() as db:
+        row = db.execute("SELECT region FROM sessions WHERE id=?", (session_id,)).fetchone()
+    return row["region"] if row else None
+
+@app.post("/api/sessions/{session_id}/roadmap", status_code=202)
+def generate_roadmap(session_id: str, request: Request, response: Response):
+    """Respond at once with a cached, stored refined or rule-based roadmap; Gemini refinement continues as a job.
+
+    A refined roadmap already stored for the current answers is served as is, with no new job.
+    200 + status "done" when nothing is left to do, otherwise 202 with the job to follow; 429 +
+    Retry-After when rate limited. With Gemini's circuit open or the job queue full, only the
+    refinement is dropped: the template comes back as 200, with Retry-After for a full queue.
+    """
+    admit(request, session_id)
     with get_db() as db:
         row = db.execute("SELECT * FROM sessions WHERE id=?", (session_id,)).fetchone()
-    if not row:
-        raise HTTPException(404, "Session not found")
-    answers = json.loads(row["answers"])
-    region = row["region"]
-    pillar_scores = compute_scores(answers)
+        if not row:
+            raise HTTPException(404, "Session not found")
+        answers = load_answers(db, session_id, row)
+    region, cat = row["region"], catalogue.current
+    roadmap = roadmap_cache.get(roadmap_key(region, answers, cat))
+    answered_at = row["answered_at"] or 0.0
+    if roadmap is None:
+        stored = roadmap_jobs.latest_roadmap(session_id)
+        if stored and stored["source"] != "template" and stored["created_at"] >= answered_at:
+            ROADMAP_RESULTS.inc(stored["source"])
+            response.status_code = 200
+            return {"session_id": session_id, "status": "done", "roadmap": stored["roadmap"], "source": stored["source"], "region": region}
+    source = "cache" if roadmap is not None else "template"
+    refine = roadmap is None and ROADMAP_REFINE and llm_breaker.state != CircuitBreaker.OPEN
+    if refine and roadmap_jobs.depth() >= ROADMAP_MAX_QUEUE:
+        ADMISSION_REJECTED.inc("queue")
+        response.headers["Retry-After"] = str(ROADMAP_SHED_RETRY_AFTER)
+        refine = False
+    if roadmap is None:
+        roadmap = session_template(region, answers, cat)
+    roadmap_jobs.store_roadmap(session_id, roadmap, source, stale_before=answered_at)
+    ROADMAP_RESULTS.inc(source)
+    if not refine:
+        response.status_code = 200
+        return {"session_id": session_id, "status": "done", "roadmap": roadmap, "source": source, "region": region}
+    job = roadmap_jobs.enqueue(session_id)
+    # A job that already finished carries the refined roadmap, which wins over the draft.
+    return {"roadmap": roadmap, "source": source, **job, "region": region}
 
-    summary_lines = []
-    for q in QUESTIONS:
-        a = answers.get(q["id"], {})
-        ans = a.get("answer", "unknown")
-        note = a.get("note", "")
-        summary_lines.append(f"- {q['pillar']} / {q['text']}: {ans}" + (f" (note: {note})" if note else ""))
+@app.get("/api/sessions/{session_id}/roadmap")
+def get_roadmap(session_id: str):
+    region = _session_region(session_id)
+    if region is None:
+        archived = session_archive.load(session_id)
+        if not archived:
+            raise HTTPException(404, "Session not found")
+        if not archived["roadmap"]:
+            raise HTTPException(404, "Roadmap not generated yet")
+        return {"session_id": session_id, "status": "done", **archived["roadmap"], "region": archived["region"]}
+    stored = roadmap_jobs.latest_roadmap(session_id)
+    if not stored:
+        raise HTTPException(404, "Roadmap not generated yet")
+    return {**stored, "region": region}
 
-    prompt = f"""You are a Zero Trust security advisor. Generate a prioritised roadmap for an organisation in region {region}.
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = roadmap_jobs.get(job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return {**job, "region": _session_region(job["session_id"])}
 
-Assessment answers:
-{chr(10).join(summary_lines)}
+@app.get("/api/jobs/{job_id}/events")
+def stream_job(job_id: str):
+    if not roadmap_jobs.get(job_id):
+        raise HTTPException(404, "Job not found")
+    return StreamingResponse(
+        roadmap_jobs.events(job_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-Pillar scores: {json.dumps(pillar_scores)}
+@app.get("/api/llm/usage")
+def get_llm_usage(since: float = 0.0):
+    """Average provider-reported tokens and latency per roadmap call, by prompt version."""
+    cat = catalogue.current
+    return {
+        "prompt_version": PROMPT_VERSION,
+        "system_prompt_tokens": estimate_tokens(prompt_builder.system(cat)),
+        "prompt_budget": prompt_builder.budget,
+        "versions": llm_usage.summary(since),
+    }
 
-Return ONLY a JSON object with this EXACT structure (no markdown, no code fences, pure JSON):
-{{
-  "30_day": [
-    {{"title": "...", "description": "...", "owner": "CISO / IT Manager / etc", "effort": "S", "definition_of_done": "..."}}
-  ],
-  "60_day": [...],
-  "90_day": [...]
-}}
+@app.get("/api/cache/roadmaps/stats")
+def roadmap_cache_stats():
+    return roadmap_cache.stats()
 
-30-day: 5 tasks (highest priority, quick wins)
-60-day: 4 tasks (medium-term improvements)
-90-day: 3 tasks (strategic / architectural changes)
+@app.get("/api/singleflight/stats")
+def singleflight_stats():
+    return roadmap_flight.stats()
 
-Be specific, actionable, and tailored to the {region} regulatory context."""
+@app.delete("/api/cache/roadmaps")
+def invalidate_roadmap_cache(request: Request, region: Optional[str] = None, session_id: Optional[str] = None):
+    """Drop cached roadmaps on every node (admin only); the next requests pay for fresh Gemini calls."""
+    require_admin(request)
+    if session_id:
+        with get_db() as db:
+            row = db.execute("SELECT * FROM sessions WHERE id=?", (session_id,)).fetchone()
+            if not row:
+                raise HTTPException(404, "Session not found")
+            answers = load_answers(db, session_id, row)
+        removed = roadmap_cache.invalidate(key=roadmap_key(row["region"], answers))
+    else:
+        removed = roadmap_cache.invalidate(region=region)
+    return {"ok": True, "removed": removed}
 
-    try:
-        text = _gemini_generate_with_retry(prompt, max_retries=3, timeout=30)
-        if text.startswith("```"):
-            parts = text.split("```")
-            text = parts[1]
-            if text.startswith("json"):
-                text = text[4:]
-        roadmap = json.loads(text.strip())
-    except Exception as e:
-        reg_task = {"CH": "ISG/KISG compliance review", "UK": "NCSC CAF assessment", "EU": "NIS2 Article 21 gap analysis"}.get(region, "Regulatory compliance review")
-        roadmap = {
-            "30_day": [
-                {"title": "Enable MFA for all users", "description": "Roll out MFA to 100% of accounts, starting with admins and privileged users.", "owner": "IT Manager", "effort": "S", "definition_of_done": "Zero accounts without MFA enforced. Legacy auth blocked."},
-                {"title": "Enrol endpoints in MDM", "description": "Inventory all endpoints and enrol in Intune/Jamf. Set compliance baseline.", "owner": "IT Manager", "effort": "M", "definition_of_done": "100% corporate endpoints enrolled and compliant."},
-                {"title": "Deploy EDR on all endpoints", "description": "Install EDR agent (Defender/CrowdStrike/SentinelOne) and verify telemetry.", "owner": "Security Team", "effort": "M", "definition_of_done": "EDR coverage >95% with active monitoring."},
-                {"title": "Conditional access baseline policy", "description": "Block sign-in from non-compliant devices. Require MFA for all cloud apps.", "owner": "CISO", "effort": "S", "definition_of_done": "CA policy active in enforce mode. Compliant devices only."},
-                {"title": "Data classification discovery scan", "description": "Run automated scan to identify sensitive data stores and apply labels.", "owner": "Data Owner", "effort": "S", "definition_of_done": "Sensitive data catalogue created and published."},
-            ],
-            "60_day": [
-                {"title": "Network micro-segmentation", "description": "Segment crown-jewel systems into isolated VLANs. Block lateral movement paths.", "owner": "Network Engineer", "effort": "L", "definition_of_done": "Crown-jewel systems unreachable from general network segment."},
-                {"title": "SSO for top-5 applications", "description": "Onboard priority apps to SAML/OIDC via your IdP. Remove local passwords.", "owner": "IT Manager", "effort": "M", "definition_of_done": "5 apps federated. No local authentication paths."},
-                {"title": "Privileged access review", "description": "Audit and right-size all admin accounts. Enable JIT access where possible.", "owner": "CISO", "effort": "M", "definition_of_done": "Admin count reduced by >50%. JIT access enabled."},
-                {"title": "Backup restore test", "description": "Perform a full restore test from offline backups. Document RTO/RPO results.", "owner": "IT Manager", "effort": "S", "definition_of_done": "Restore completed and documented. RTO within target."},
-            ],
-            "90_day": [
-                {"title": "ZTNA deployment", "description": "Replace VPN with ZTNA solution (Cloudflare Access / Zscaler). Decommission VPN.", "owner": "Network Engineer", "effort": "L", "definition_of_done": "VPN decommissioned. All remote access via ZTNA with device posture."},
-                {"title": reg_task, "description": "Assess readiness against regional requirements and produce a gap report.", "owner": "CISO", "effort": "M", "definition_of_done": "Gap report produced. Remediation plan approved by board."},
-                {"title": "Security awareness training programme", "description": "Deploy phishing simulation and mandatory annual training for all staff.", "owner": "HR / Security", "effort": "M", "definition_of_done": ">90% staff trained. Phishing click rate <5%."},
-            ],
-        }
-    return {"roadmap": roadmap, "region": region}
+def report_context(session_id: str):
+    """What the emailed report shows (see reports.render_report), or None if the session is gone."""
+    with get_db() as db:
+        row = db.execute("SELECT * FROM sessions WHERE id=?", (session_id,)).fetchone()
+        if not row:
+            return None
+        snap = db.execute("SELECT payload FROM dashboards WHERE session_id=?", (session_id,)).fetchone()
+        answers = load_answers(db, session_id, row)
+    region = row["region"]
+    dashboard = json.loads(bytes(snap["payload"])) if snap else build_dashboard(session_id, region, compute_scores(answers))
+    stored = roadmap_jobs.latest_roadmap(session_id)
+    return {
+        "session_id": session_id,
+        "region": region,
+        "dashboard": dashboard,
+        "roadmap": stored["roadmap"] if stored else session_template(region, answers),
+        "report_url": f"{PUBLIC_BASE_URL}/dashboard/{session_id}" if PUBLIC_BASE_URL else None,
+    }
+
+# Report delivery runs in this process only when SMTP_HOST is set; captured addresses queue up regardless.
+SMTP_HOST = os.environ.get("SMTP_HOST")
+PUBLIC_BASE_URL = os.environ.get("PUBLIC_BASE_URL", "").rstrip("/")
+email_outbox = EmailOutbox(
+    db_pool,
+    report_context,
+    SMTPTransport(
+        SMTP_HOST,
+        port=int(os.environ.get("SMTP_PORT", "587")),
+        username=os.environ.get("SMTP_USERNAME"),
+        password=os.environ.get("SMTP_PASSWORD"),
+        starttls=os.environ.get("SMTP_STARTTLS", "1") == "1",
+    ) if SMTP_HOST else None,
+    sender=os.environ.get("EMAIL_FROM", "ZT Compass <noreply@localhost>"),
+    batch_size=int(os.environ.get("EMAIL_BATCH_SIZE", "20")),
+    max_attempts=int(os.environ.get("EMAIL_MAX_ATTEMPTS", "8")),
+    backoff=float(os.environ.get("EMAIL_RETRY_BACKOFF", "60")),
+    render_processes=int(os.environ.get("EMAIL_RENDER_PROCESSES", "1")),
+)
+metrics.registry.callback_gauge("ztc_email_outbox", "Report emails in the outbox by status.", ("status",),
+                                lambda: {(status,): n for status, n in email_outbox.stats().items()})
 
 @app.post("/api/sessions/{session_id}/email")
-def capture_email(session_id: str, body: EmailCapture):
-    with get_db() as db:
+def capture_email(session_id: str, body: EmailCapture, request: Request):
+    admit(request)
+    with get_db(write=True) as db:
         row = db.execute("SELECT id FROM sessions WHERE id=?", (session_id,)).fetchone()
         if not row:
             raise HTTPException(404, "Session not found")
         db.execute("INSERT INTO emails (session_id, email) VALUES (?,?)", (session_id, body.email))
+        email_outbox.enqueue(db, session_id, body.email)
+    email_outbox.wake()
     return {"ok": True, "message": "Thank you! Your full report will be sent shortly."}
 
-PLAYBOOKS = [
-    {
-        "id": "pb_mfa", "title": "Identity: MFA Rollout Path", "pillar": "Identity", "icon": "🔐",
-        "steps": [
-            {"step": 1, "title": "Inventory all accounts", "description": "Export full user list including service accounts, shared mailboxes, break-glass accounts.", "owner": "IT Manager", "evidence": "User export CSV with account types tagged"},
-            {"step": 2, "title": "Enable MFA for admins first", "description": "Force MFA on all Global Admin, Security Admin, and privileged roles immediately.", "owner": "CISO", "evidence": "Sign-in logs showing MFA required for admin logins"},
-            {"step": 3, "title": "Roll out in waves", "description": "Wave 1: IT. Wave 2: Finance/HR. Wave 3: All remaining users. 2-week waves.", "owner": "IT Manager", "evidence": "MFA registration report >90% per wave"},
-            {"step": 4, "title": "Block legacy authentication", "description": "Create CA policy to block all legacy auth protocols (IMAP, POP, SMTP Auth, basic auth).", "owner": "CISO", "evidence": "Legacy auth sign-in count = 0"},
-            {"step": 5, "title": "Exception process", "description": "Document exceptions (e.g. service accounts) with compensating controls and review schedule.", "owner": "CISO", "evidence": "Exception register maintained and reviewed quarterly"},
-            {"step": 6, "title": "Monitor and report", "description": "Weekly MFA adoption dashboard. Escalate users not registered after reminder cycle.", "owner": "IT Manager", "evidence": "MFA coverage >99% maintained continuously"},
-        ],
-        "definition_of_done": "100% of interactive user accounts have MFA enforced. Legacy authentication blocked. Exception register maintained."
-    },
-    {
-        "id": "pb_ca", "title": "Identity: Conditional Access Starter", "pillar": "Identity", "icon": "🛡️",
-        "steps": [
-            {"step": 1, "title": "Baseline: Require MFA for all users", "description": "Create CA policy requiring MFA for all cloud app sign-ins. Exclude break-glass accounts.", "owner": "CISO", "evidence": "Policy in report-only for 2 weeks, then enforced"},
-            {"step": 2, "title": "Block risky locations", "description": "Create named locations for trusted offices/countries. Block or step-up others.", "owner": "CISO", "evidence": "Named locations configured. Risky sign-ins alerted"},
-            {"step": 3, "title": "Require compliant device", "description": "For sensitive apps, require device compliance (MDM-enrolled and healthy).", "owner": "IT Manager", "evidence": "Compliant device CA policy active for crown-jewel apps"},
-            {"step": 4, "title": "Block high-risk sign-ins", "description": "Integrate Identity Protection. Auto-block or force password reset on high-risk sign-ins.", "owner": "CISO", "evidence": "Risk-based CA active. Alerts flowing to SIEM"},
-            {"step": 5, "title": "Quarterly review", "description": "Review sign-in logs, identify gaps, adjust policies. Document rationale for each policy.", "owner": "CISO", "evidence": "Quarterly review log with policy change history"},
-        ],
-        "definition_of_done": "5 baseline CA policies active and enforced. No interactive sign-in without MFA. Risk-based policies active."
-    },
-    {
-        "id": "pb_mdm", "title": "Devices: MDM Adoption Steps", "pillar": "Devices", "icon": "💻",
-        "steps": [
-            {"step": 1, "title": "Inventory all endpoints", "description": "Create authoritative asset register: all laptops, desktops, mobiles, tablets.", "owner": "IT Manager", "evidence": "Asset register with device types, OS versions, ownership"},
-            {"step": 2, "title": "Deploy MDM agent", "description": "Push Intune/Jamf enrolment to all managed devices via email + IT-assisted sessions.", "owner": "IT Manager", "evidence": "MDM enrolment report >90%"},
-            {"step": 3, "title": "Configure compliance policies", "description": "Define compliant device: OS version, encryption, screen lock, EDR installed.", "owner": "CISO", "evidence": "Compliance policies published. Non-compliant devices flagged"},
-            {"step": 4, "title": "Block non-compliant access", "description": "Enforce CA policy: corporate resources require compliant device. Communicate deadline.", "owner": "CISO", "evidence": "Non-compliant devices blocked from email/SharePoint"},
-            {"step": 5, "title": "BYOD policy", "description": "Define BYOD policy. MAM (app management) rather than full MDM for personal devices.", "owner": "HR / CISO", "evidence": "BYOD policy signed off. MAM profiles deployed"},
-            {"step": 6, "title": "Automated new device onboarding", "description": "Autopilot/DEP enrolment for all new devices — zero-touch provisioning.", "owner": "IT Manager", "evidence": "New devices automatically enrolled within 30 mins of unboxing"},
-        ],
-        "definition_of_done": "100% corporate endpoints MDM-enrolled and compliant. BYOD covered by MAM. New device onboarding automated."
-    },
-    {
-        "id": "pb_edr", "title": "Devices: EDR Coverage Checklist", "pillar": "Devices", "icon": "🔍",
-        "steps": [
-            {"step": 1, "title": "Select and procure EDR solution", "description": "Evaluate Defender for Endpoint (M365 E5), CrowdStrike, SentinelOne. Procure licenses.", "owner": "CISO", "evidence": "EDR vendor selected. Licensing procured"},
-            {"step": 2, "title": "Pilot on IT team", "description": "Run 2-week pilot on IT team devices. Validate telemetry, alerts, performance impact.", "owner": "IT Manager", "evidence": "Pilot sign-off document. Telemetry confirmed in console"},
-            {"step": 3, "title": "Roll out to all endpoints", "description": "Deploy EDR agent via MDM software push. Target: 100% coverage in 2 weeks.", "owner": "IT Manager", "evidence": "EDR console shows >95% endpoint coverage"},
-            {"step": 4, "title": "Enable prevention mode", "description": "Switch from detection-only to prevention mode after 2-week tuning period.", "owner": "CISO", "evidence": "Prevention mode active. False positive rate <2%"},
-            {"step": 5, "title": "Connect to SIEM / SOC", "description": "Forward EDR alerts to SIEM or managed SOC. Define escalation path.", "owner": "Security Team", "evidence": "Alerts flowing to SIEM. Escalation runbook documented"},
-            {"step": 6, "title": "Monthly coverage review", "description": "Review EDR coverage report monthly. Investigate and remediate any gaps.", "owner": "IT Manager", "evidence": "Monthly coverage reports with <2% gap tolerance"},
-        ],
-        "definition_of_done": ">95% endpoint EDR coverage. Prevention mode enabled. Alerts in SIEM/SOC. Monthly reviews documented."
-    },
-    {
-        "id": "pb_ir", "title": "Incident Readiness: Triage + Comms", "pillar": "Data", "icon": "🚨",
-        "steps": [
-            {"step": 1, "title": "Define severity levels", "description": "P1 (active breach), P2 (suspected breach/data exposure), P3 (policy violation/near miss).", "owner": "CISO", "evidence": "Severity matrix documented and communicated to all staff"},
-            {"step": 2, "title": "IR runbook", "description": "Create step-by-step runbook: Detect → Contain → Eradicate → Recover → Lessons Learned.", "owner": "CISO", "evidence": "IR runbook published. Board reviewed and approved"},
-            {"step": 3, "title": "Internal comms template", "description": "Template for notifying staff: what happened, what to do, who to contact. Plain language.", "owner": "CISO / HR", "evidence": "Template stored in offline location and tested"},
-            {"step": 4, "title": "Regulatory notification template", "description": "CH: NCSC portal. UK: ICO 72h. EU: NIS2 24h. Pre-fill templates, store regulatory contacts.", "owner": "CISO / Legal", "evidence": "Templates legally reviewed. Contacts in IR runbook"},
-            {"step": 5, "title": "Customer notification template", "description": "Draft notification for customers if their data is affected. Legal review required.", "owner": "CISO / Legal / CEO", "evidence": "Template legally reviewed. Approval process documented"},
-            {"step": 6, "title": "Tabletop exercise", "description": "Run 2-hour tabletop simulating a ransomware attack. Test runbook and comms.", "owner": "CISO", "evidence": "Exercise report with gaps identified and remediated"},
-            {"step": 7, "title": "Post-incident review", "description": "Mandatory PIR within 5 days of any P1/P2 incident. Feed lessons back into runbook.", "owner": "CISO", "evidence": "PIR template exists. At least 1 exercise completed per year"},
-        ],
-        "definition_of_done": "IR runbook published. All templates legally reviewed. Tabletop exercise completed. Regulatory process tested."
-    },
-]
-
-REGION_OVERLAYS = {
-    "CH": {
-        "title": "Switzerland — Cyber Regulatory Context",
-        "sections": [
-            {"heading": "NCSC 24-Hour Incident Reporting", "content": "Under ISG (Informationssicherheitsgesetz), operators of critical infrastructure must report significant cyber incidents to the NCSC within 24 hours of detection.", "items": ["Applies to: energy, water, transport, health, banking, government ICT", "Report via: report.ncsc.admin.ch", "Include: nature of incident, affected systems, initial impact assessment", "Follow-up: detailed report within 72 hours"]},
-            {"heading": "Critical Infrastructure Sectors", "content": "Sectors subject to mandatory reporting under Swiss law:", "items": ["Energy (electricity, gas, district heating)", "Water supply and wastewater", "Transport (rail, air, road infrastructure)", "Health (hospitals, pharmaceutical supply)", "Banking and financial market infrastructure", "Government ICT and digital services", "Telecommunications"]},
-            {"heading": "Reporting Portal Steps", "content": "How to report an incident to NCSC:", "items": ["1. Go to report.ncsc.admin.ch", "2. Select 'Meldung fur kritische Infrastrukturen'", "3. Authenticate with your CHy-Mail or HIN identity", "4. Complete the structured incident form", "5. Receive confirmation number", "6. NCSC will contact you within 4 hours for P1 incidents"]},
-            {"heading": "ZT Compass Alignment", "content": "Key ZT controls mapped to Swiss requirements:", "items": ["Identity controls: reduce credential-based breach risk", "EDR/MDM: meet ISG Article 5 baseline security measures", "Network segmentation: limit blast radius of incidents", "Data classification: support proportionate protection under revised DSG", "IR runbook: meet 24h reporting obligation"]},
-        ]
-    },
-    "UK": {
-        "title": "United Kingdom — Cyber Regulatory Context",
-        "sections": [
-            {"heading": "Cyber Breaches Survey 2025", "content": "DSIT Cyber Security Breaches Survey 2025 findings:", "items": ["43% of UK businesses experienced a cyber attack in the past 12 months", "32% of businesses have a formal incident response plan", "Only 13% of businesses conduct regular penetration testing", "Phishing remains #1 attack vector (84% of breached businesses)", "Median cost of a breach for medium businesses: GBP 10,830", "Only 31% of businesses have board-level cyber security oversight"]},
-            {"heading": "Common Gaps for UK SMEs", "content": "Frequent findings from NCSC assessments:", "items": ["MFA not enabled on email and Microsoft 365", "No patch management process", "Insufficient backup testing", "No network segmentation", "Lack of security awareness training", "ICO breach notification missed — 72h deadline not tracked"]},
-            {"heading": "NCSC Cyber Essentials", "content": "UK businesses should target Cyber Essentials certification:", "items": ["Firewalls and internet gateways", "Secure configuration of devices and software", "User access control and admin privileges", "Malware protection (EDR)", "Patch management — update all software within 14 days", "CE+ adds independent technical verification"]},
-            {"heading": "ICO Breach Notification", "content": "Under UK GDPR, personal data breaches must be reported to the ICO:", "items": ["72-hour notification deadline from time of becoming aware", "Report via: ico.org.uk/make-a-complaint/data-security", "Include: nature of breach, categories/volumes of data, likely consequences", "Notify affected individuals if high risk to their rights and freedoms", "Document all breaches even if not reported"]},
-        ]
-    },
-    "EU": {
-        "title": "European Union — NIS2 & Cyber Regulatory Context",
-        "sections": [
-            {"heading": "NIS2 Directive — 10 Key Requirements", "content": "NIS2 (EU 2022/2555) — key requirements for essential and important entities:", "items": ["1. Risk analysis and information system security policies", "2. Incident handling (detection, response, recovery)", "3. Business continuity and crisis management", "4. Supply chain security — vet ICT suppliers", "5. Security in network and information systems acquisition", "6. Policies to assess cybersecurity risk measures effectiveness", "7. Basic cyber hygiene practices and cybersecurity training", "8. Policies on cryptography and encryption", "9. Human resources security, access control, asset management", "10. Multi-factor authentication or continuous authentication"]},
-            {"heading": "ENISA Guidance Mapping", "content": "ENISA guidance aligned to NIS2:", "items": ["ENISA Good Practice Guide on Incident Management: NIS2 Art. 21(2)(b)", "ENISA Cloud Security Guide: supply chain and ICT security", "ENISA Threat Landscape 2024: ransomware top threat", "ENISA Guidelines on Vulnerability Disclosure", "ENISA Cybersecurity Certification Framework: EUCC for ICT products"]},
-            {"heading": "Incident Reporting Under NIS2", "content": "Multi-stage reporting obligations:", "items": ["Early warning: 24 hours — notify national CSIRT", "Incident notification: 72 hours — detailed notification with initial assessment", "Intermediate report: on request from CSIRT/authority", "Final report: 1 month after incident notification — full analysis", "Significant incident: major operational disruption or financial loss"]},
-            {"heading": "NIS2 Scope — Are You In?", "content": "NIS2 covers essential entities (EE) and important entities (IE):", "items": ["Essential entities: energy, transport, banking, health, water, digital infrastructure", "Important entities: postal, waste, chemicals, food, manufacturing, digital providers", "Size threshold: medium enterprises (50+ employees or EUR 10M+ turnover) in covered sectors", "Penalties: EE up to EUR 10M or 2% global turnover; IE up to EUR 7M or 1.4% global turnover"]},
-        ]
+BATCH_CHUNK = int(os.environ.get("BATCH_SCORE_CHUNK", "10000"))
+
+async def _batch_ndjson(request: Request, reader, model):
+    """NDJSON for the request body, read and scored `BATCH_CHUNK` rows at a time off the loop."""
+    from batch_scoring import ndjson
+
+    def _score(rows, start):
+        return "".join(ndjson(reader.score(model, rows, start)))
+
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    rows, start, error = [], 1, None
+    try:
+        async for chunk in request.stream():
+            rows += reader.feed(decoder.decode(chunk))
+            while len(rows) >= BATCH_CHUNK:
+                yield await asyncio.to_thread(_score, rows[:BATCH_CHUNK], start)
+                rows, start = rows[BATCH_CHUNK:], start + BATCH_CHUNK
+        rows += reader.feed(decoder.decode(b"", final=True)) + reader.close()
+    except ValueError as e:
+        if start == 1 and not rows:
+            raise
+        error = str(e)
+    if rows:
+        yield await asyncio.to_thread(_score, rows, start)
+    if error:
+        # The rows before the break are already out; say why the rest is missing.
+        yield "".join(ndjson([{"error": error}]))
+
+@app.post("/api/batch/score")
+async def batch_score(request: Request):
+    """Score many questionnaires at once; accepts text/csv or {"sessions": [...]} and streams NDJSON.
+
+    Rows that can't be scored get an error record in their place; a body that is unreadable from
+    the start is a 400, and one that breaks off later ends with a trailing `{"error"}` record.
+    """
+    admit(request)
+    from batch_scoring import CsvReader, SessionsReader
+    reader = CsvReader() if request.headers.get("content-type", "").startswith("text/csv") else SessionsReader()
+    body = _batch_ndjson(request, reader, scoring_model())
+    try:
+        first = await anext(body, "")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    async def _stream():
+        yield first
+        async for part in body:
+            yield part
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+@app.get("/api/export/sessions")
+def export_sessions(request: Request, format: str = "ndjson", region: Optional[str] = None,
+                    created_from: Optional[str] = None, created_to: Optional[str] = None):
+    """Every live session with answers, scores and roadmap (admin only); archived sessions are not included."""
+    require_admin(request)
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(400, "format must be ndjson or csv")
+    records = exporter.iter_sessions(region, created_from, created_to)
+    if format == "csv":
+        return StreamingResponse(exporter.csv(records), media_type="text/csv",
+                                 headers={"Content-Disposition": 'attachment; filename="ztcompass-sessions.csv"'})
+    return StreamingResponse(exporter.ndjson(records), media_type="application/x-ndjson")
+
+content = ContentRegistry(max_age=int(os.environ.get("CONTENT_MAX_AGE", "300")))
+
+_batch_model = None  # (catalogue version, ScoringModel)
+
+def scoring_model():
+    """Vectorised batch scorer for the current catalogue, built on first use (it pulls in numpy)."""
+    global _batch_model
+    cat = catalogue.current
+    built = _batch_model
+    if built is None or built[0] != cat.version:
+        from batch_scoring import ScoringModel
+        built = _batch_model = (cat.version, ScoringModel(cat.questions, cat.score_map))
+    return built[1]
+
+def apply_catalogue(cat):
+    """Rebuild everything derived from the catalogue; each swap is a single assignment."""
+    global exporter
+    content.load(cat.playbooks, cat.region_overlays, version=cat.version)
+    exporter = SessionExporter(db_pool, cat.questions, PILLAR_COLUMNS, maturity_level, compute_scores)
+    # Archive every version a session may have been scored against, so old scores stay reproducible.
+    with get_db() as db:
+        known = db.execute("SELECT 1 FROM catalogue_versions WHERE version=?", (cat.version,)).fetchone()
+    if not known:
+        with get_db(write=True) as db:
+            db.execute(
+                "INSERT OR IGNORE INTO catalogue_versions (version, digest, content, loaded_at) VALUES (?,?,?,?)",
+                (cat.version, cat.digest, cat.source, time.time()),
+            )
+
+catalogue.subscribe(apply_catalogue)
+
+@app.get("/api/catalogue")
+def get_catalogue():
+    cat = catalogue.current
+    return {
+        "version": cat.version,
+        "digest": cat.digest,
+        "questions": len(cat.questions),
+        "pillars": cat.pillars,
+        "playbooks": len(cat.playbooks),
+        "regions": sorted(cat.region_overlays),
     }
-}
+
+@app.get("/api/catalogue/versions/{version}")
+def get_catalogue_version(version: str):
+    with get_db() as db:
+        row = db.execute("SELECT version, digest, content, loaded_at FROM catalogue_versions WHERE version=?", (version,)).fetchone()
+    if not row:
+        raise HTTPException(404, "Catalogue version not found")
+    return {"version": row["version"], "digest": row["digest"], "loaded_at": row["loaded_at"], "catalogue": json.loads(row["content"])}
+
+@app.post("/api/catalogue/reload")
+def reload_catalogue(request: Request):
+    require_admin(request)
+    try:
+        reloaded = catalogue.load()
+    except (CatalogueError, ValueError, OSError) as e:
+        raise HTTPException(422, f"Catalogue rejected, still serving {catalogue.current.version}: {e}")
+    return {"ok": True, "reloaded": reloaded, "version": catalogue.current.version}
 
 @app.get("/api/playbooks")
-def list_playbooks():
-    return [{"id": p["id"], "title": p["title"], "pillar": p["pillar"], "icon": p["icon"]} for p in PLAYBOOKS]
+def list_playbooks(request: Request):
+    return content.respond(request, "playbooks")
 
 @app.get("/api/playbooks/{playbook_id}")
-def get_playbook(playbook_id: str):
-    for p in PLAYBOOKS:
-        if p["id"] == playbook_id:
-            return p
-    raise HTTPException(404, "Playbook not found")
+def get_playbook(playbook_id: str, request: Request):
+    response = content.respond(request, f"playbook:{playbook_id}")
+    if response is None:
+        raise HTTPException(404, "Playbook not found")
+    return response
 
 @app.get("/api/regions/{region}")
-def get_region_overlay(region: str):
-    region = region.upper()
-    if region not in REGION_OVERLAYS:
+def get_region_overlay(region: str, request: Request):
+    response = content.respond(request, f"region:{region.upper()}")
+    if response is None:
         raise HTTPException(404, "Region not found")
-    return REGION_OVERLAYS[region]
+    return response
+
+@app.post("/api/maintenance/retention")
+def run_retention_now(request: Request, full_vacuum: bool = False):
+    """Run a retention pass now (admin only); `full_vacuum` also rewrites the SQLite file (slow, for maintenance windows)."""
+    require_admin(request)
+    done = run_retention(full_vacuum=full_vacuum)
+    if done is None:
+        raise HTTPException(409, "A retention pass is already running")
+    return done
+
+@app.get("/api/outbox/stats")
+def outbox_stats():
+    return email_outbox.stats()
+
+@app.get("/api/metrics")
+def get_metrics():
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+# Opt-in: samples every thread's stack for a few seconds and returns folded stacks for a flame graph.
+PROFILER_ENABLED = os.environ.get("ZTC_PROFILER", "0") == "1"
+profiler = metrics.SamplingProfiler()
+
+@app.get("/api/debug/profile")
+async def profile(request: Request, seconds: float = 5.0):
+    """Folded stacks sampled for `seconds` (admin only, and only with ZTC_PROFILER=1)."""
+    require_admin(request)
+    if not PROFILER_ENABLED:
+        raise HTTPException(404, "Profiler disabled; set ZTC_PROFILER=1")
+    try:
+        folded = await asyncio.to_thread(profiler.run, min(max(seconds, 0.1), 60.0))
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+    return PlainTextResponse(folded)
+
+# Off the request path once the app is serving: everything deferred at import is done here.
+LLM_WARMUP = os.environ.get("LLM_WARMUP", "1") == "1"
+# Failed required warm-up steps are retried with backoff, doubling from 0.5s up to this many seconds.
+WARMUP_RETRY_MAX = float(os.environ.get("WARMUP_RETRY_MAX", "30"))
+STARTUP = {"import": time.perf_counter() - _import_started}
+metrics.registry.callback_gauge("ztc_startup_seconds", "Startup phase durations (import, warmup).", ("phase",),
+                                lambda: {(phase,): seconds for phase, seconds in STARTUP.items()})
+warmed = threading.Event()
+warmup_log = logging.getLogger("ztcompass.warmup")
+
+def _warm_required():
+    if ZTC_MIGRATE != "off":
+        init_db()  # one read once up to date; applies what an earlier failure left pending
+    with get_db() as db:
+        db.execute("SELECT 1").fetchone()
+    scoring_model()
+
+def warm_up(stop: threading.Event = None):
+    """Required checks (database and schema, scoring model), then caches that only save the first request time.
+
+    A failing required step is logged and retried with backoff until it passes or `stop` is set;
+    readiness stays 503 meanwhile.
+    """
+    started = time.perf_counter()
+    stop = stop or threading.Event()
+    delay = 0.5
+    attempt = 1
+    while True:
+        try:
+            _warm_required()
+            break
+        except Exception:
+            warmup_log.exception("Required warm-up failed (attempt %d); retrying in %.1fs", attempt, delay)
+            if stop.wait(delay):
+                return
+            delay = min(delay * 2, WARMUP_RETRY_MAX)
+            attempt += 1
+    cat = catalogue.current
+    optional = [("content", content.warm), ("prompt", lambda: prompt_builder.system(cat))]
+    if ROADMAP_REFINE and LLM_WARMUP:
+        optional.append(("llm", llm.warm))
+    for name, step in optional:
+        try:
+            step()
+        except Exception:
+            warmup_log.exception("Warm-up step %s failed; it will run on first use", name)
+    STARTUP["warmup"] = time.perf_counter() - started
+    warmed.set()
 
 @app.get("/api/health")
 def health():
+    """Liveness: the process is up. Does not touch the database."""
     return {"status": "ok", "service": "ztcompass", "version": "beta"}
 
+@app.get("/api/ready")
+def ready(response: Response):
+    """Readiness: warm-up has finished and the database answers; 503 until then."""
+    checks = {"warmed": warmed.is_set(), "database": False}
+    try:
+        with get_db() as db:
+            checks["database"] = db.execute("SELECT 1").fetchone() is not None
+    except Exception:
+        pass
+    if not all(checks.values()):
+        response.status_code = 503
+    return {"status": "ready" if all(checks.values()) else "starting", "checks": checks,
+            "startup_seconds": {phase: round(seconds, 3) for phase, seconds in STARTUP.items()}}
+
 # Serve React frontend
 STATIC_DIR = "/app/static"
 if os.path.exists(STATIC_DIR):
@@ -403,3 +1225,5 @@ if os.path.exists(STATIC_DIR):
         if os.path.exists(index):
             return FileResponse(index)
         return {"error": "Frontend not built"}
+
+metrics.instrument_routes(app.routes)
@@ -0,0 +1,277 @@
+"""
+In-process metrics in the Prometheus text exposition format, plus an opt-in sampling profiler.
+
+Counters, gauges and histograms are sharded per thread: each thread only ever writes its
+own dict, so the hot path takes no lock (the GIL makes each dict update atomic) and a
+scrape sums the shards. A lock is only taken once per (metric, thread) to register a shard.
+"""
+import sys
+import time
+import bisect
+import threading
+import collections
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 45.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def _merged(self) -> dict:
+        merged = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for key, value in shard.copy().items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    def value(self, *labels):
+        return self._merged().get(labels, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self._merged().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Up/down gauge; increments and decrements may happen on different threads."""
+    kind = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    @contextmanager
+    def track(self, *labels):
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class CallbackGauge(_Metric):
+    """Gauge whose values are read at scrape time from `fn() -> {label values tuple: value}`."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames, fn):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def _merged(self) -> dict:
+        return self.fn()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # one slot per bucket, one for +Inf, then the running sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def _merged(self) -> dict:
+        merged = {}
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for key, counts in shard.copy().items():
+                counts = list(counts)
+                total = merged.setdefault(key, [0] * len(counts))
+                for i, c in enumerate(counts):
+                    total[i] += c
+        return merged
+
+    def count(self, *labels) -> int:
+        return sum(self._merged().get(labels, [0])[:-1])
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts in sorted(self._merged().items()):
+            cumulative = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                bound = 'le="%s"' % _number(le)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, bound)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(counts[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames=()) -> Gauge:
+        return self._register(Gauge, name, help, labelnames)
+
+    def callback_gauge(self, name: str, help: str, labelnames, fn) -> CallbackGauge:
+        return self._register(CallbackGauge, name, help, labelnames, fn)
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labelnames, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_DURATION = registry.histogram("ztc_http_request_duration_seconds", "HTTP request latency, including streamed bodies.", ("method", "route", "status"))
+HTTP_IN_FLIGHT = registry.gauge("ztc_http_requests_in_flight", "HTTP requests currently being served.", ("method", "route"))
+
+
+def _timed_route(app, route_path: str):
+    async def instrumented(scope, receive, send):
+        if scope["type"] != "http":
+            return await app(scope, receive, send)
+        method = scope["method"]
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc(method, route_path)
+        try:
+            await app(scope, receive, send_status)
+        finally:
+            HTTP_IN_FLIGHT.dec(method, route_path)
+            HTTP_DURATION.observe(time.perf_counter() - started, method, route_path, str(status))
+    return instrumented
+
+
+def instrument_routes(routes):
+    """Wrap each matched route's ASGI app, so labels are the route template at no extra matching cost."""
+    for route in routes:
+        if getattr(route, "endpoint", None) is not None and not getattr(route, "_metrics_wrapped", False):
+            route.app = _timed_route(route.app, route.path)
+            route._metrics_wrapped = True
+
+
+class SamplingProfiler:
+    """Samples every thread's stack at a fixed interval and counts folded stacks.
+
+    Output is one `frame;frame;frame count` line per distinct stack, the input format of
+    flamegraph.pl / speedscope. Only runs while `run()` is active.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._busy = threading.Lock()
+
+    def _fold(self, frame) -> str:
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def run(self, seconds: float) -> str:
+        if not self._busy.acquire(blocking=False):
+            raise RuntimeError("a profile is already running")
+        try:
+            me = threading.get_ident()
+            samples = collections.Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident != me:
+                        samples[self._fold(frame)] += 1
+                time.sleep(self.interval)
+            return "".join(f"{stack} {n}\n" for stack, n in samples.most_common())
+        finally:
+            self._busy.release()
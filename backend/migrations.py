@@ -0,0 +1,257 @@
+import time
+
+# (version, name, statements). Append only — never edit a migration that has shipped.
+MIGRATIONS = [
+    (1, "sessions and emails", [
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            region TEXT,
+            answers TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS emails (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT,
+            email TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "normalized answers and precomputed pillar scores", [
+        """
+        CREATE TABLE IF NOT EXISTS answers (
+            session_id TEXT NOT NULL,
+            question_id TEXT NOT NULL,
+            answer TEXT,
+            note TEXT,
+            PRIMARY KEY (session_id, question_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_answers_question ON answers(question_id, answer)",
+        "CREATE INDEX IF NOT EXISTS idx_emails_session ON emails(session_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_region_created ON sessions(region, created_at)",
+        # 0 = answers still only in the legacy JSON blob, 1 = answers table + score columns are authoritative
+        "ALTER TABLE sessions ADD COLUMN answers_normalized INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE sessions ADD COLUMN score_identity REAL",
+        "ALTER TABLE sessions ADD COLUMN score_devices REAL",
+        "ALTER TABLE sessions ADD COLUMN score_network REAL",
+        "ALTER TABLE sessions ADD COLUMN score_applications REAL",
+        "ALTER TABLE sessions ADD COLUMN score_data REAL",
+        "ALTER TABLE sessions ADD COLUMN overall_score INTEGER",
+        "ALTER TABLE sessions ADD COLUMN answered_at REAL",
+        "CREATE INDEX IF NOT EXISTS idx_sessions_pending_backfill ON sessions(answers_normalized) WHERE answers_normalized = 0",
+    ]),
+    (3, "materialized dashboard snapshots", [
+        """
+        CREATE TABLE IF NOT EXISTS dashboards (
+            session_id TEXT PRIMARY KEY,
+            etag TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            updated_at REAL
+        )
+        """,
+    ]),
+    (4, "keyset index for exports", [
+        "CREATE INDEX IF NOT EXISTS idx_sessions_created_id ON sessions(created_at, id)",
+    ]),
+    (5, "benchmark rollups", [
+        """
+        CREATE TABLE IF NOT EXISTS benchmark_rollups (
+            region TEXT NOT NULL,
+            pillar TEXT NOT NULL,
+            score INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (region, pillar, score)
+        ) WITHOUT ROWID
+        """,
+        "ALTER TABLE sessions ADD COLUMN in_benchmark INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (6, "catalogue versions", [
+        """
+        CREATE TABLE IF NOT EXISTS catalogue_versions (
+            version TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            content TEXT NOT NULL,
+            loaded_at REAL
+        )
+        """,
+        # NULL = scored before catalogues were versioned (the built-in 2026.02.1 content)
+        "ALTER TABLE sessions ADD COLUMN catalogue_version TEXT",
+    ]),
+    (7, "roadmap job leases", [
+        """
+        CREATE TABLE IF NOT EXISTS roadmap_jobs (
+            id TEXT PRIMARY KEY,
+            session_id TEXT,
+            status TEXT,
+            error TEXT,
+            attempts INTEGER DEFAULT 0,
+            created_at REAL,
+            updated_at REAL
+        )
+        """,
+        # Which process is running the job, and until when; expired leases are requeued by any worker.
+        "ALTER TABLE roadmap_jobs ADD COLUMN lease_owner TEXT",
+        "ALTER TABLE roadmap_jobs ADD COLUMN lease_expires_at REAL",
+    ]),
+    (8, "session revisions", [
+        # Bumped by every answer write; PATCH/POST with a stale revision get 409.
+        "ALTER TABLE sessions ADD COLUMN revision INTEGER NOT NULL DEFAULT 0",
+    ]),
+    (9, "partial roadmaps", [
+        # Tasks parsed so far from the streaming model reply, while the job is running.
+        "ALTER TABLE roadmap_jobs ADD COLUMN partial TEXT",
+    ]),
+    (10, "llm usage log", [
+        """
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            prompt_version TEXT,
+            estimated_tokens INTEGER,
+            input_tokens INTEGER,
+            cached_tokens INTEGER,
+            output_tokens INTEGER,
+            latency REAL,
+            outcome TEXT,
+            created_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_llm_usage_created ON llm_usage(created_at)",
+    ]),
+    (11, "session retention", [
+        # answered_at is the last answer write (creation counts); retention selects on it.
+        "CREATE INDEX IF NOT EXISTS idx_sessions_retention ON sessions(in_benchmark, answered_at)",
+        "CREATE INDEX IF NOT EXISTS idx_roadmap_jobs_updated ON roadmap_jobs(updated_at)",
+        """
+        CREATE TABLE IF NOT EXISTS archived_sessions (
+            session_id TEXT PRIMARY KEY,
+            region TEXT,
+            archive_file TEXT NOT NULL,
+            archived_at REAL
+        )
+        """,
+    ]),
+    (12, "email outbox", [
+        """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            email TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            error TEXT,
+            created_at REAL,
+            sent_at REAL,
+            UNIQUE (session_id, email)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox(status, next_attempt_at)",
+    ]),
+    (13, "portfolios", [
+        "CREATE TABLE IF NOT EXISTS portfolios (id TEXT PRIMARY KEY, name TEXT NOT NULL, created_at REAL)",
+        """
+        CREATE TABLE IF NOT EXISTS portfolio_sessions (
+            portfolio_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            added_at REAL,
+            PRIMARY KEY (portfolio_id, session_id)
+        )
+        """,
+    ]),
+    (14, "roadmap cache, results and single-flight leases", [
+        # Created by their classes' constructors before migrations existed; existing databases already have them.
+        """
+        CREATE TABLE IF NOT EXISTS roadmap_cache (
+            key TEXT PRIMARY KEY,
+            region TEXT,
+            roadmap TEXT,
+            created_at REAL,
+            expires_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_roadmap_cache_expires ON roadmap_cache(expires_at)",
+        """
+        CREATE TABLE IF NOT EXISTS roadmap_cache_invalidations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            key TEXT,
+            region TEXT,
+            created_at REAL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS roadmaps (
+            session_id TEXT PRIMARY KEY,
+            job_id TEXT,
+            roadmap TEXT,
+            source TEXT,
+            created_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_roadmap_jobs_session ON roadmap_jobs(session_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_roadmap_jobs_status ON roadmap_jobs(status, created_at)",
+        """
+        CREATE TABLE IF NOT EXISTS singleflight_leases (
+            key TEXT PRIMARY KEY,
+            owner TEXT,
+            expires_at REAL
+        )
+        """,
+    ]),
+    (15, "archived benchmark scores", [
+        # The session's contribution to benchmark_rollups, so a rebuild still counts it once archived.
+        "ALTER TABLE archived_sessions ADD COLUMN scores TEXT",
+    ]),
+    (16, "recount benchmarks for completed assessments only", [
+        # Partially answered sessions used to count; an empty table makes startup rebuild it.
+        "DELETE FROM benchmark_rollups",
+    ]),
+]
+
+
+def current_version(con) -> int:
+    row = con.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+    return row[0] or 0
+
+
+def migrate(db, migrations=MIGRATIONS) -> list:
+    """Apply pending migrations in order, each in its own IMMEDIATE transaction.
+
+    Safe to call from several workers at once: the version is re-checked under the
+    migrations lock, so each migration runs exactly once.
+    """
+    with db.connection() as con:
+        con.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at REAL
+            )
+        """)
+        # Up to date (the common case on every start): one read, no write transactions.
+        if current_version(con) >= max((m[0] for m in migrations), default=0):
+            return []
+    applied = []
+    for version, name, statements in migrations:
+        with db.connection(write=True) as con:
+            db.lock(con, "schema_migrations")
+            if current_version(con) >= version:
+                continue
+            for sql in statements:
+                con.execute(sql)
+            con.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (?,?,?)", (version, name, time.time()))
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    # One-off schema setup (a release job) for deployments that start with ZTC_MIGRATE=off.
+    import os
+    from db import open_pool
+
+    print("applied:", migrate(open_pool(os.environ.get("ZTC_DATABASE_URL"), os.environ.get("ZTC_DB_PATH", "/tmp/ztcompass.db"))))
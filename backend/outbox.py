@@ -0,0 +1,269 @@
+"""
+Email outbox: delivers the assessment report to captured leads, off the request path.
+
+Capturing an address only inserts an `email_outbox` row, in the same transaction as the lead
+itself; (session, address) is unique, so a repeated capture never sends a second report.
+Workers in any process sharing the database lease due rows in batches, gather each report's
+data, render it in a process pool (`reports.render_report`) and hand the batch to the
+transport over one connection. Failed sends go back to `pending` with jittered exponential
+backoff and are given up on after `max_attempts`.
+
+Delivery is at least once: a worker that dies between sending and recording the result
+leaves a lease that expires and the row is sent again. Message-IDs are derived from the
+outbox row, so receiving systems can drop the duplicate.
+"""
+import os
+import re
+import time
+import random
+import socket
+import asyncio
+import smtplib
+import multiprocessing
+from email.message import EmailMessage
+from email.utils import parseaddr
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from reports import render_report
+
+EMAILS = metrics.registry.counter("ztc_emails_total", "Report emails by outcome (sent, retry, failed).", ("result",))
+EMAIL_RENDER = metrics.registry.histogram("ztc_email_render_seconds", "Time to render one report, including the hop to the pool.")
+EMAIL_SEND = metrics.registry.histogram("ztc_email_send_batch_seconds", "Time to hand one batch to the transport.")
+
+
+_LOCAL = r'[^\s\x00-\x1f\x7f@<>(),;:"\[\]\\]+'
+_LABEL = r'[^\s\x00-\x1f\x7f@<>(),;:"\[\]\\.]+'
+_ADDRESS = re.compile(rf"{_LOCAL}@{_LABEL}(\.{_LABEL})+")
+
+
+def normalize_email(email: str) -> str:
+    """Trimmed, lower-cased plain address (`user@example.com`); ValueError for anything else,
+    including display names and embedded line breaks that would end up in a mail header."""
+    address = email.strip().lower()
+    if len(address) > 254 or not _ADDRESS.fullmatch(address):
+        raise ValueError("not a valid email address")
+    return address
+
+
+class SMTPTransport:
+    """Sends each batch over one SMTP connection. Any SMTP server works, including a local
+    debugging one (`python -m aiosmtpd -n -l localhost:1025` with `starttls=False`)."""
+
+    def __init__(self, host: str, port: int = 587, username: str = None, password: str = None,
+                 starttls: bool = True, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send_batch(self, messages: list) -> list:
+        """Send `messages`; returns one error string (or None when accepted) per message.
+
+        Connection and authentication failures raise, and the whole batch is retried; after a
+        mid-batch disconnect the remaining messages fail individually, so nothing sent is resent.
+        """
+        errors = []
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            for message in messages:
+                try:
+                    smtp.send_message(message)
+                    errors.append(None)
+                except smtplib.SMTPException as e:
+                    errors.append(str(e) or type(e).__name__)
+        return errors
+
+
+class EmailOutbox:
+    """`context(session_id)` returns the data for `reports.render_report`, or None when the
+    session is gone; `transport.send_batch(messages)` returns an error (or None) per message.
+    `render_processes=0` renders in a thread instead of a process pool.
+    """
+
+    def __init__(self, db, context, transport, sender: str, batch_size: int = 20, max_attempts: int = 8,
+                 backoff: float = 60.0, backoff_cap: float = 3600.0, lease_ttl: float = 300.0,
+                 poll_interval: float = 5.0, render_processes: int = 1):
+        self.db = db
+        self.context = context
+        self.transport = transport
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_cap = backoff_cap
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.render_processes = render_processes
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.domain = parseaddr(sender)[1].rpartition("@")[2] or "localhost"
+        self._pool = None
+        self._wake = None
+        self._loop = None
+        self._worker_task = None
+
+    # ── Producer side ──────────────────────────────────────────────────────────
+
+    def enqueue(self, con, session_id: str, email: str):
+        """Queue the report for `email` on the caller's write transaction (no-op if already queued)."""
+        now = time.time()
+        con.execute(
+            "INSERT OR IGNORE INTO email_outbox (session_id, email, status, attempts, next_attempt_at, created_at) "
+            "VALUES (?,?,'pending',0,?,?)",
+            (session_id, normalize_email(email), now, now),
+        )
+
+    def wake(self):
+        """Let the local worker pick up new rows now rather than at its next poll."""
+        if self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def stats(self) -> dict:
+        with self.db.connection() as con:
+            rows = con.execute("SELECT status, COUNT(*) AS n FROM email_outbox GROUP BY status").fetchall()
+        return {"pending": 0, "sending": 0, "sent": 0, "failed": 0, **{r["status"]: r["n"] for r in rows}}
+
+    # ── Worker side ────────────────────────────────────────────────────────────
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        with self.db.connection(write=True) as con:
+            # Rows a previous process with our identity was sending are orphans.
+            con.execute("UPDATE email_outbox SET status='pending', lease_owner=NULL, lease_expires_at=NULL "
+                        "WHERE status='sending' AND lease_owner=?", (self.owner,))
+        self._worker_task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._worker_task:
+            self._worker_task.cancel()
+            await asyncio.gather(self._worker_task, return_exceptions=True)
+            self._worker_task = None
+        self._wake = None
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _claim(self) -> list:
+        """Lease up to `batch_size` due rows (including ones whose sender's lease ran out)."""
+        now = time.time()
+        with self.db.connection(write=True) as con:
+            rows = con.execute(
+                "SELECT id, session_id, email, attempts FROM email_outbox "
+                "WHERE (status='pending' AND next_attempt_at<=?) OR (status='sending' AND lease_expires_at<?) "
+                "ORDER BY next_attempt_at LIMIT ?" + self.db.skip_locked,
+                (now, now, self.batch_size),
+            ).fetchall()
+            if rows:
+                ids = [r["id"] for r in rows]
+                con.execute(
+                    f"UPDATE email_outbox SET status='sending', attempts=attempts+1, lease_owner=?, lease_expires_at=? "
+                    f"WHERE id IN ({','.join('?' * len(ids))})",
+                    (self.owner, now + self.lease_ttl, *ids),
+                )
+        return [{"id": r["id"], "session_id": r["session_id"], "email": r["email"], "attempts": r["attempts"] + 1} for r in rows]
+
+    def _delay(self, attempts: int) -> float:
+        delay = min(self.backoff_cap, self.backoff * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _settle(self, outcomes: list):
+        """Record `(row, error or None)` pairs; rows leased to someone else meanwhile are left alone."""
+        now = time.time()
+        sent, retry, failed = [], [], []
+        for row, error in outcomes:
+            if error is None:
+                sent.append((now, row["id"], self.owner))
+            elif row["attempts"] >= self.max_attempts:
+                failed.append((error[:500], row["id"], self.owner))
+            else:
+                retry.append((now + self._delay(row["attempts"]), error[:500], row["id"], self.owner))
+        with self.db.connection(write=True) as con:
+            con.executemany("UPDATE email_outbox SET status='sent', sent_at=?, error=NULL, lease_owner=NULL, lease_expires_at=NULL "
+                            "WHERE id=? AND lease_owner=?", sent)
+            con.executemany("UPDATE email_outbox SET status='pending', next_attempt_at=?, error=?, lease_owner=NULL, lease_expires_at=NULL "
+                            "WHERE id=? AND lease_owner=?", retry)
+            con.executemany("UPDATE email_outbox SET status='failed', error=?, lease_owner=NULL, lease_expires_at=NULL "
+                            "WHERE id=? AND lease_owner=?", failed)
+        EMAILS.inc("sent", amount=len(sent))
+        EMAILS.inc("retry", amount=len(retry))
+        EMAILS.inc("failed", amount=len(failed))
+
+    async def _render(self, context: dict) -> dict:
+        if self.render_processes > 0 and self._pool is None:
+            self._pool = ProcessPoolExecutor(self.render_processes, mp_context=multiprocessing.get_context("spawn"))
+        started = time.perf_counter()
+        try:
+            return await self._loop.run_in_executor(self._pool, render_report, context)
+        except BrokenProcessPool:
+            self._pool = None
+            raise
+        finally:
+            EMAIL_RENDER.observe(time.perf_counter() - started)
+
+    def _message(self, row: dict, report: dict) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = row["email"]
+        message["Subject"] = report["subject"]
+        message["Message-ID"] = f"<report-{row['id']}.{row['session_id']}@{self.domain}>"
+        message.set_content(report["text"])
+        message.add_alternative(report["html"], subtype="html")
+        return message
+
+    async def run_once(self) -> int:
+        """Claim, render and send one batch; returns how many rows were claimed."""
+        self._loop = asyncio.get_running_loop()
+        rows = await asyncio.to_thread(self._claim)
+        if not rows:
+            return 0
+        contexts = await asyncio.to_thread(lambda: {sid: self.context(sid) for sid in {r["session_id"] for r in rows}})
+        outcomes, ready = [], []
+        reports = await asyncio.gather(*(self._render(contexts[r["session_id"]]) for r in rows if contexts[r["session_id"]]),
+                                       return_exceptions=True)
+        reports = iter(reports)
+        for row in rows:
+            if contexts[row["session_id"]] is None:
+                # Deleted or archived since it was captured: nothing to retry.
+                outcomes.append(({**row, "attempts": self.max_attempts}, "session not found"))
+                continue
+            report = next(reports)
+            if isinstance(report, BaseException):
+                outcomes.append((row, f"render: {report!r}"))
+                continue
+            try:
+                ready.append((row, self._message(row, report)))
+            except Exception as e:
+                # An address or subject no header accepts will never send; don't hold up its batch-mates.
+                outcomes.append(({**row, "attempts": self.max_attempts}, f"message: {e!r}"))
+        if ready:
+            started = time.perf_counter()
+            try:
+                errors = await asyncio.to_thread(self.transport.send_batch, [m for _, m in ready])
+            except Exception as e:
+                errors = [f"send: {e!r}"] * len(ready)
+            EMAIL_SEND.observe(time.perf_counter() - started)
+            outcomes += [(row, error) for (row, _), error in zip(ready, errors)]
+        await asyncio.to_thread(self._settle, outcomes)
+        return len(rows)
+
+    async def _worker(self):
+        while True:
+            try:
+                claimed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                claimed = 0  # database hiccup; the leases expire and the rows come back
+            if claimed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
@@ -0,0 +1,60 @@
+"""
+Portfolios: named groups of sessions, e.g. an MSSP's client organisations.
+
+Membership is by session id only; a member that retention later deletes leaves its
+portfolios with it, and one it archives stays and is served from the archive.
+"""
+import time
+import uuid
+
+
+def _in(ids: list) -> str:
+    return "(" + ",".join("?" * len(ids)) + ")"
+
+
+class PortfolioStore:
+    def __init__(self, db):
+        self.db = db
+
+    def create(self, name: str) -> str:
+        portfolio_id = str(uuid.uuid4())
+        with self.db.connection(write=True) as con:
+            con.execute("INSERT INTO portfolios (id, name, created_at) VALUES (?,?,?)", (portfolio_id, name, time.time()))
+        return portfolio_id
+
+    def get(self, portfolio_id: str):
+        with self.db.connection() as con:
+            row = con.execute("SELECT id, name, created_at FROM portfolios WHERE id=?", (portfolio_id,)).fetchone()
+            if row is None:
+                return None
+            n = con.execute("SELECT COUNT(*) AS n FROM portfolio_sessions WHERE portfolio_id=?", (portfolio_id,)).fetchone()["n"]
+        return {"portfolio_id": row["id"], "name": row["name"], "created_at": row["created_at"], "sessions": n}
+
+    def add(self, portfolio_id: str, session_ids: list) -> list:
+        """Add the existing sessions among `session_ids`; returns the ids that do not exist."""
+        ids = list(dict.fromkeys(session_ids))
+        if not ids:
+            return []
+        now = time.time()
+        with self.db.connection(write=True) as con:
+            known = {r["id"] for r in con.execute(f"SELECT id FROM sessions WHERE id IN {_in(ids)}", ids)}
+            known |= {r["session_id"] for r in con.execute(f"SELECT session_id FROM archived_sessions WHERE session_id IN {_in(ids)}", ids)}
+            con.executemany(
+                "INSERT OR IGNORE INTO portfolio_sessions (portfolio_id, session_id, added_at) VALUES (?,?,?)",
+                [(portfolio_id, sid, now) for sid in ids if sid in known],
+            )
+        return [sid for sid in ids if sid not in known]
+
+    def remove(self, portfolio_id: str, session_id: str) -> bool:
+        with self.db.connection(write=True) as con:
+            cur = con.execute("DELETE FROM portfolio_sessions WHERE portfolio_id=? AND session_id=?", (portfolio_id, session_id))
+            return cur.rowcount > 0
+
+    def page(self, portfolio_id: str, after: str = None, limit: int = 100) -> list:
+        """Member session ids in id order, starting after the `after` cursor."""
+        with self.db.connection() as con:
+            rows = con.execute(
+                "SELECT session_id FROM portfolio_sessions WHERE portfolio_id=? AND session_id>? ORDER BY session_id LIMIT ?",
+                (portfolio_id, after or "", limit),
+            ).fetchall()
+        return [r["session_id"] for r in rows]
@@ -0,0 +1,127 @@
+"""
+Roadmap prompts split into a static system prompt and a compact per-session delta.
+
+The system prompt (role, output schema, rules and the question legend) depends only on the
+catalogue version, so it is byte-identical across calls and can be served from the
+provider's context cache. The per-session part references questions by id and answers by
+one-letter code, truncates notes, and lists the rule-based draft by title only; when it
+would exceed the token budget, notes are shortened and then dropped, then the draft.
+
+Token counts are estimates (about four characters per token for English text and JSON),
+good enough for budgeting; the provider's own counts are recorded by `UsageLog`.
+"""
+import math
+import time
+import threading
+
+from catalogue import canonical_answer
+
+ANSWER_CODES = {"yes": "Y", "partial": "P", "no": "N", "unknown": "U"}
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text.encode("utf-8")) / 4) if text else 0
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:max(0, limit - 1)].rstrip() + "…"
+
+
+class PromptBuilder:
+    def __init__(self, budget: int = 1200, note_chars: int = 160, max_output_tokens: int = 2048):
+        self.budget = budget
+        self.note_chars = note_chars
+        self.max_output_tokens = max_output_tokens
+        self._system = {}
+        self._lock = threading.Lock()
+
+    def system(self, cat) -> str:
+        prompt = self._system.get(cat.digest)
+        if prompt is None:
+            legend = "\n".join(f"{q['id']}: [{q['pillar']}] {q['text']}" for q in cat.questions)
+            prompt = f"""You are a Zero Trust security advisor. You turn a short assessment into a prioritised 30/60/90-day roadmap.
+
+Reply with ONLY a JSON object, no markdown or prose:
+{{"30_day": [TASK x5], "60_day": [TASK x4], "90_day": [TASK x3]}}
+TASK = {{"title": str, "description": str, "owner": str, "effort": "S"|"M"|"L", "definition_of_done": str}}
+
+30-day: highest priority, quick wins. 60-day: medium-term improvements. 90-day: strategic / architectural changes.
+Be specific and actionable, tailored to the organisation's answers, notes and regulatory region.
+
+Input format: region, pillar scores (0-100), answers as question_id=code (Y yes, P partial, N no, U unknown),
+optional notes, and a draft from our rule engine listed by title. Keep the draft's priorities unless the answers or
+notes justify a change.
+
+Questions:
+{legend}"""
+            with self._lock:
+                if len(self._system) > 16:
+                    self._system.clear()
+                self._system[cat.digest] = prompt
+        return prompt
+
+    def _render(self, region: str, answers: dict, pillar_scores: dict, cat, draft, note_chars: int) -> str:
+        codes, notes = [], []
+        for q in cat.questions:
+            a = answers.get(q["id"], {})
+            code = ANSWER_CODES.get(canonical_answer(a.get("answer")), "U")
+            codes.append(f"{q['id']}={code}")
+            if note_chars and a.get("note"):
+                notes.append(f"{q['id']}: {_clip(a['note'], note_chars)}")
+        scores = " ".join(f"{p}={s['score']}" for p, s in pillar_scores.items())
+        lines = [f"region: {region}", f"scores: {scores}", f"answers: {' '.join(codes)}"]
+        if notes:
+            lines.append("notes:\n" + "\n".join(notes))
+        if draft:
+            lines.append("draft:\n" + "\n".join(f"{h}: " + "; ".join(t["title"] for t in tasks) for h, tasks in draft.items()))
+        return "\n".join(lines)
+
+    def user(self, region: str, answers: dict, pillar_scores: dict, cat, draft: dict = None) -> tuple:
+        """(prompt, estimated tokens), shrinking notes and then the draft to fit the budget."""
+        note_chars = self.note_chars
+        while True:
+            prompt = self._render(region, answers, pillar_scores, cat, draft, note_chars)
+            tokens = estimate_tokens(prompt)
+            if tokens <= self.budget:
+                return prompt, tokens
+            if note_chars > 20:
+                note_chars //= 2
+            elif note_chars:
+                note_chars = 0
+            elif draft:
+                draft = None
+            else:
+                return prompt, tokens
+
+
+class UsageLog:
+    """Per-call token usage and latency of LLM requests, for comparing prompt versions."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def record(self, prompt_version: str, estimated_tokens: int, usage: dict, latency: float, outcome: str):
+        with self.db.connection(write=True) as con:
+            con.execute(
+                "INSERT INTO llm_usage (prompt_version, estimated_tokens, input_tokens, cached_tokens, output_tokens, latency, outcome, created_at) "
+                "VALUES (?,?,?,?,?,?,?,?)",
+                (prompt_version, estimated_tokens, usage.get("input_tokens"), usage.get("cached_tokens"),
+                 usage.get("output_tokens"), latency, outcome, time.time()),
+            )
+
+    def summary(self, since: float = 0.0) -> dict:
+        with self.db.connection() as con:
+            rows = con.execute("""
+                SELECT prompt_version, COUNT(*) AS calls, AVG(estimated_tokens) AS estimated_tokens, AVG(input_tokens) AS input_tokens,
+                       AVG(cached_tokens) AS cached_tokens, AVG(output_tokens) AS output_tokens, AVG(latency) AS latency
+                FROM llm_usage WHERE created_at >= ? GROUP BY prompt_version ORDER BY prompt_version
+            """, (since,)).fetchall()
+        return {
+            r["prompt_version"]: {
+                "calls": r["calls"],
+                **{k: (round(r[k], 1) if r[k] is not None else None) for k in ("estimated_tokens", "input_tokens", "cached_tokens", "output_tokens")},
+                "avg_latency": round(r["latency"], 3) if r["latency"] is not None else None,
+            }
+            for r in rows
+        }
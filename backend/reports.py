@@ -0,0 +1,50 @@
+"""
+The emailed assessment report: dashboard and roadmap rendered as HTML with a plain-text part.
+
+`render_report` is a pure function of a picklable context dict, so the outbox can run it in a
+process pool without the app (or its database connections) being imported there.
+"""
+from html import escape
+
+HORIZONS = (("30_day", "First 30 days"), ("60_day", "Days 31-60"), ("90_day", "Days 61-90"))
+
+
+def render_report(context: dict) -> dict:
+    """{"subject", "html", "text"} for `context` = {session_id, region, dashboard, roadmap, report_url}."""
+    dash, roadmap = context["dashboard"], context.get("roadmap") or {}
+    region, url = context["region"], context.get("report_url")
+    subject = f"Your Zero Trust assessment: {dash['overall_score']}/100"
+
+    text = [f"ZT Compass report ({region})", f"Overall score: {dash['overall_score']}/100", "", "Pillar scores:"]
+    text += [f"  {p}: {s['score']} ({s['level']})" for p, s in dash["pillar_scores"].items()]
+    text += ["", "Top risks:"] + [f"  - {r['pillar']}: {r['risk']}" for r in dash["top_risks"]]
+    text += ["", "Quick wins:"] + [f"  - {w['pillar']}: {w['win']}" for w in dash["quick_wins"]]
+    for key, label in HORIZONS:
+        text += ["", f"{label}:"] + [f"  - {t['title']} [{t.get('owner', '')}, effort {t.get('effort', '?')}]" for t in roadmap.get(key, [])]
+    if url:
+        text += ["", f"Full report: {url}"]
+
+    rows = "".join(f"<tr><td>{escape(p)}</td><td>{s['score']}</td><td>{escape(s['level'])}</td></tr>"
+                   for p, s in dash["pillar_scores"].items())
+    risks = "".join(f"<li><b>{escape(r['pillar'])}</b>: {escape(r['risk'])}</li>" for r in dash["top_risks"])
+    wins = "".join(f"<li><b>{escape(w['pillar'])}</b>: {escape(w['win'])}</li>" for w in dash["quick_wins"])
+    phases = "".join(
+        f"<h3>{label}</h3><ol>" + "".join(
+            f"<li><b>{escape(t['title'])}</b> ({escape(str(t.get('owner', '')))}, effort {escape(str(t.get('effort', '?')))})"
+            f"<br>{escape(t.get('description', ''))}<br><i>Done when: {escape(t.get('definition_of_done', ''))}</i></li>"
+            for t in roadmap.get(key, [])
+        ) + "</ol>"
+        for key, label in HORIZONS
+    )
+    banner = f"<p><i>{escape(dash['region_banner'])}</i></p>" if dash.get("region_banner") else ""
+    link = f'<p><a href="{escape(url)}">Open the interactive report</a></p>' if url else ""
+    html = f"""<!doctype html>
+<html><body style="font-family:sans-serif;max-width:720px">
+<h1>ZT Compass report</h1>
+<p>Region: {escape(region)} &middot; Overall score: <b>{dash['overall_score']}/100</b></p>{banner}
+<h2>Pillar scores</h2><table border="1" cellpadding="4" cellspacing="0"><tr><th>Pillar</th><th>Score</th><th>Level</th></tr>{rows}</table>
+<h2>Top risks</h2><ul>{risks}</ul>
+<h2>Quick wins</h2><ul>{wins}</ul>
+<h2>30/60/90-day roadmap</h2>{phases}{link}
+</body></html>"""
+    return {"subject": subject, "html": html, "text": "\n".join(text) + "\n"}
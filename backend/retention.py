@@ -0,0 +1,240 @@
+"""
+Retention: expiring abandoned sessions, archiving old assessments and compacting the store.
+
+A pass works through small chunks, each in its own short write transaction, and pauses
+between them so request traffic is never locked out for long:
+
+- unfinished sessions (not every question answered, so not in the benchmarks) are deleted
+  `incomplete_ttl` seconds after their last write
+- finished sessions untouched for `archive_after` seconds move to gzip-compressed NDJSON files
+  (session row, answers, dashboard, roadmap, emails) indexed by `archived_sessions`, and stay
+  readable through `SessionArchive.load`; they keep counting towards the benchmark rollups
+  (`archived_sessions` keeps their scores for a rebuild) but are left out of the export
+- finished roadmap jobs and the LLM usage log are pruned after `job_ttl` / `usage_ttl`
+
+Afterwards SQLite gives up to `vacuum_pages` free pages back to the filesystem (auto_vacuum
+INCREMENTAL) and refreshes planner statistics with `PRAGMA optimize`; PostgreSQL leaves space
+to autovacuum and only gets an ANALYZE of the tables that changed.
+"""
+import os
+import gzip
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+import metrics
+from benchmarks import OVERALL
+
+RETENTION_ROWS = metrics.registry.counter("ztc_retention_sessions_total", "Sessions removed from the live tables by action (deleted, archived).", ("action",))
+SESSION_TABLES = (("answers", "session_id"), ("dashboards", "session_id"), ("roadmaps", "session_id"),
+                  ("roadmap_jobs", "session_id"), ("emails", "session_id"), ("email_outbox", "session_id"),
+                  ("portfolio_sessions", "session_id"), ("sessions", "id"))
+# Archived sessions stay portfolio members; the portfolio dashboard serves them from the archive.
+ARCHIVE_KEEPS = ("portfolio_sessions",)
+
+
+def _in(ids: list) -> str:
+    return "(" + ",".join("?" * len(ids)) + ")"
+
+
+def _row(row) -> dict:
+    return {k: row[k] for k in row.keys()}
+
+
+class SessionArchive:
+    """Archived sessions, one JSON object per line in `<directory>/sessions-*.jsonl.gz`."""
+
+    def __init__(self, db, directory: str, cache_size: int = 256):
+        self.db = db
+        self.directory = directory
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def write(self, records: list) -> str:
+        """Write one archive file (atomically) and return its name."""
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"sessions-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as out:
+                for record in records:
+                    out.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(path + ".tmp", path)
+        return name
+
+    def load(self, session_id: str):
+        """The archived record for `session_id`, or None if it was never archived."""
+        with self._lock:
+            if session_id in self._cache:
+                self._cache.move_to_end(session_id)
+                return self._cache[session_id]
+        with self.db.connection() as con:
+            row = con.execute("SELECT archive_file FROM archived_sessions WHERE session_id=?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        prefix = f'{{"id":{json.dumps(session_id)},'.encode()
+        record = None
+        with gzip.open(os.path.join(self.directory, row["archive_file"]), "rb") as lines:
+            for line in lines:
+                if line.startswith(prefix):
+                    record = json.loads(line)
+                    break
+        if record is not None:
+            with self._lock:
+                self._cache[session_id] = record
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return record
+
+
+class Retention:
+    def __init__(self, db, archive: SessionArchive, benchmarks, pillar_columns: dict, incomplete_ttl: float = 7 * 86400, archive_after: float = 180 * 86400,
+                 job_ttl: float = 7 * 86400, usage_ttl: float = 90 * 86400, chunk_size: int = 500,
+                 pause: float = 0.02, max_seconds: float = 30.0, vacuum_pages: int = 2000):
+        self.db = db
+        self.archive = archive
+        self.benchmarks = benchmarks
+        self.pillar_columns = pillar_columns
+        self.incomplete_ttl = incomplete_ttl
+        self.archive_after = archive_after
+        self.job_ttl = job_ttl
+        self.usage_ttl = usage_ttl
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.max_seconds = max_seconds
+        self.vacuum_pages = vacuum_pages
+        self.last_run = None
+
+    @staticmethod
+    def _delete_sessions(con, ids: list, archiving: bool = False):
+        for table, column in SESSION_TABLES:
+            if archiving and table in ARCHIVE_KEEPS:
+                continue
+            con.execute(f"DELETE FROM {table} WHERE {column} IN {_in(ids)}", ids)
+
+    def _lock_sessions(self, con, ids: list):
+        # The same per-session lock answer writes take; sorted so two passes can't deadlock.
+        for sid in sorted(ids):
+            self.db.lock(con, f"session:{sid}")
+
+    def _scores(self, record: dict) -> dict:
+        """The session's benchmark contribution, as `BenchmarkRollups.apply` takes it."""
+        scores = {p: round(record[c]) for p, c in self.pillar_columns.items()}
+        scores[OVERALL] = record["overall_score"]
+        return scores
+
+    def delete_incomplete(self, cutoff: float) -> int:
+        """One chunk of unfinished sessions last written before `cutoff`."""
+        with self.db.connection(write=True) as con:
+            ids = [r["id"] for r in con.execute(
+                "SELECT id FROM sessions WHERE in_benchmark=0 AND answers_normalized=1 AND answered_at<? LIMIT ?",
+                (cutoff, self.chunk_size),
+            ).fetchall()]
+            if ids:
+                # Re-check under the locks: a session may have been answered since the select.
+                self._lock_sessions(con, ids)
+                ids = [r["id"] for r in con.execute(
+                    f"SELECT id FROM sessions WHERE in_benchmark=0 AND answered_at<? AND id IN {_in(ids)}", (cutoff, *ids),
+                ).fetchall()]
+            if ids:
+                self._delete_sessions(con, ids)
+        RETENTION_ROWS.inc("deleted", amount=len(ids))
+        return len(ids)
+
+    def archive_completed(self, cutoff: float) -> int:
+        """Archive one chunk of finished sessions last written before `cutoff`."""
+        with self.db.connection() as con:
+            rows = con.execute(
+                "SELECT * FROM sessions WHERE in_benchmark=1 AND answers_normalized=1 AND answered_at<? ORDER BY answered_at LIMIT ?",
+                (cutoff, self.chunk_size),
+            ).fetchall()
+            if not rows:
+                return 0
+            # "id" leads each line, which is what SessionArchive.load scans for.
+            records = {r["id"]: {"id": r["id"], **_row(r), "answers": {}, "dashboard": None, "dashboard_etag": None, "roadmap": None, "emails": []}
+                       for r in rows}
+            ids = list(records)
+            for a in con.execute(f"SELECT session_id, question_id, answer, note FROM answers WHERE session_id IN {_in(ids)}", ids):
+                records[a["session_id"]]["answers"][a["question_id"]] = {"answer": a["answer"], "note": a["note"]}
+            for d in con.execute(f"SELECT session_id, etag, payload FROM dashboards WHERE session_id IN {_in(ids)}", ids):
+                records[d["session_id"]].update(dashboard=json.loads(bytes(d["payload"])), dashboard_etag=d["etag"])
+            for m in con.execute(f"SELECT session_id, roadmap, source FROM roadmaps WHERE session_id IN {_in(ids)}", ids):
+                records[m["session_id"]]["roadmap"] = {"roadmap": json.loads(m["roadmap"]), "source": m["source"]}
+            for e in con.execute(f"SELECT session_id, email, created_at FROM emails WHERE session_id IN {_in(ids)}", ids):
+                records[e["session_id"]]["emails"].append({"email": e["email"], "created_at": e["created_at"]})
+        name = self.archive.write(list(records.values()))
+
+        archived = []
+        now = time.time()
+        with self.db.connection(write=True) as con:
+            # Moving a session's benchmark contribution into archived_sessions must not interleave with a rebuild.
+            self.benchmarks.lock(con)
+            self._lock_sessions(con, list(records))
+            for sid, record in records.items():
+                # Skip sessions written to (or recounted) since they were read; the stale copy in the file is never indexed.
+                still = con.execute("SELECT 1 FROM sessions WHERE id=? AND revision=? AND in_benchmark=1",
+                                    (sid, record["revision"])).fetchone()
+                if still:
+                    archived.append(sid)
+            if archived:
+                con.executemany(
+                    "INSERT OR REPLACE INTO archived_sessions (session_id, region, archive_file, archived_at, scores) VALUES (?,?,?,?,?)",
+                    [(sid, records[sid]["region"], name, now, json.dumps(self._scores(records[sid]))) for sid in archived],
+                )
+                self._delete_sessions(con, archived, archiving=True)
+        RETENTION_ROWS.inc("archived", amount=len(archived))
+        return len(archived)
+
+    def prune(self, table: str, where: str, cutoff: float) -> int:
+        with self.db.connection(write=True) as con:
+            cur = con.execute(
+                f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} WHERE {where} LIMIT ?)"
+                if self.db.backend == "sqlite" else
+                f"DELETE FROM {table} WHERE ctid IN (SELECT ctid FROM {table} WHERE {where} LIMIT ?)",
+                (cutoff, self.chunk_size),
+            )
+            return max(cur.rowcount, 0)
+
+    def compact(self, full: bool = False):
+        """Return free pages to the filesystem and refresh planner statistics.
+
+        `full` runs a complete VACUUM, which also switches databases created before
+        auto_vacuum was enabled to incremental mode; it rewrites the whole file.
+        """
+        with self.db.connection() as con:
+            if self.db.backend != "sqlite":
+                for table in ("sessions", "answers", "dashboards", "roadmap_jobs"):
+                    con.execute(f"ANALYZE {table}")
+                return
+            if full:
+                con.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                con.execute("VACUUM")
+            elif con.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                con.execute(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)})").fetchall()
+            con.execute("PRAGMA optimize")
+
+    def run(self, stop: threading.Event = None, now: float = None, full_vacuum: bool = False) -> dict:
+        """One retention pass, bounded by `max_seconds`; returns what it did."""
+        now = time.time() if now is None else now
+        started = time.monotonic()
+        done = {"deleted": 0, "archived": 0, "jobs_pruned": 0, "usage_pruned": 0}
+        steps = [("deleted", lambda: self.delete_incomplete(now - self.incomplete_ttl), self.incomplete_ttl > 0),
+                 ("archived", lambda: self.archive_completed(now - self.archive_after), self.archive_after > 0),
+                 ("jobs_pruned", lambda: self.prune("roadmap_jobs", "status IN ('done','failed') AND updated_at<?", now - self.job_ttl), self.job_ttl > 0),
+                 ("usage_pruned", lambda: self.prune("llm_usage", "created_at<?", now - self.usage_ttl), self.usage_ttl > 0)]
+        for key, step, enabled in steps:
+            while enabled and not (stop and stop.is_set()) and time.monotonic() - started < self.max_seconds:
+                n = step()
+                done[key] += n
+                if n < self.chunk_size:
+                    break
+                time.sleep(self.pause)
+        self.compact(full=full_vacuum)
+        done["seconds"] = round(time.monotonic() - started, 3)
+        self.last_run = {**done, "finished_at": time.time()}
+        return done
@@ -0,0 +1,141 @@
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from catalogue import canonical_answer
+
+
+def cache_key(region: str, answers: dict, prompt_version: str) -> str:
+    """Stable hash of everything that influences the generated roadmap."""
+    canonical = {}
+    for qid, a in (answers or {}).items():
+        if not isinstance(a, dict):
+            a = {"answer": a}
+        canonical[qid] = {
+            "answer": canonical_answer(a.get("answer")),
+            "note": " ".join(str(a.get("note") or "").split()),
+        }
+    payload = json.dumps(
+        {"region": (region or "").upper(), "answers": canonical, "prompt": prompt_version},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RoadmapCache:
+    """In-process LRU in front of a persistent table, both with TTL expiry.
+
+    The table is shared by every process using the same database. Entries never change
+    for a key, so the only thing another process can make stale is an invalidation: those
+    are appended to `roadmap_cache_invalidations` and replayed into the local LRU at most
+    `sync_interval` seconds later.
+    """
+
+    def __init__(self, db, maxsize: int = 1024, ttl: int = 86400, sync_interval: float = 2.0):
+        self.db = db
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self.db.connection() as con:
+            self._seen = con.execute("SELECT COALESCE(MAX(id), 0) FROM roadmap_cache_invalidations").fetchone()[0]
+        self._next_sync = time.monotonic() + sync_interval
+
+    def _drop_local(self, key=None, region=None):
+        if key:
+            self._lru.pop(key, None)
+        elif region:
+            for k in [k for k, v in self._lru.items() if v[0] == region]:
+                del self._lru[k]
+        else:
+            self._lru.clear()
+
+    def sync(self):
+        """Apply invalidations made by other processes since the last sync."""
+        with self.db.connection() as con:
+            rows = con.execute("SELECT id, key, region FROM roadmap_cache_invalidations WHERE id>? ORDER BY id", (self._seen,)).fetchall()
+        with self._lock:
+            for r in rows:
+                self._drop_local(r["key"], r["region"])
+                self._seen = max(self._seen, r["id"])
+            self._next_sync = time.monotonic() + self.sync_interval
+
+    def _remember(self, key, region, roadmap, expires_at):
+        self._lru[key] = (region, roadmap, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str):
+        if time.monotonic() >= self._next_sync:
+            self.sync()
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry and entry[2] > now:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry:
+                del self._lru[key]
+        with self.db.connection() as con:
+            row = con.execute("SELECT region, roadmap, expires_at FROM roadmap_cache WHERE key=? AND expires_at>?", (key, now)).fetchone()
+        with self._lock:
+            if not row:
+                self.misses += 1
+                return None
+            roadmap = json.loads(row["roadmap"])
+            self._remember(key, row["region"], roadmap, row["expires_at"])
+            self.hits += 1
+            return roadmap
+
+    def put(self, key: str, region: str, roadmap: dict):
+        now = time.time()
+        expires_at = now + self.ttl
+        with self.db.connection(write=True) as con:
+            con.execute(
+                "INSERT OR REPLACE INTO roadmap_cache (key, region, roadmap, created_at, expires_at) VALUES (?,?,?,?,?)",
+                (key, (region or "").upper(), json.dumps(roadmap), now, expires_at),
+            )
+            con.execute("DELETE FROM roadmap_cache WHERE expires_at<=?", (now,))
+            con.execute("DELETE FROM roadmap_cache_invalidations WHERE created_at<=?", (now - self.ttl,))
+        with self._lock:
+            self._remember(key, (region or "").upper(), roadmap, expires_at)
+
+    def invalidate(self, key: str = None, region: str = None) -> int:
+        """Drop one key, every key for a region, or (no arguments) the whole cache."""
+        with self.db.connection(write=True) as con:
+            if key:
+                cur = con.execute("DELETE FROM roadmap_cache WHERE key=?", (key,))
+            elif region:
+                cur = con.execute("DELETE FROM roadmap_cache WHERE region=?", (region.upper(),))
+            else:
+                cur = con.execute("DELETE FROM roadmap_cache")
+            removed = cur.rowcount
+            con.execute(
+                "INSERT INTO roadmap_cache_invalidations (key, region, created_at) VALUES (?,?,?)",
+                (key, region.upper() if region and not key else None, time.time()),
+            )
+        with self._lock:
+            self._drop_local(key, region.upper() if region else None)
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._lru),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+            }
@@ -0,0 +1,86 @@
+"""
+Deterministic 30/60/90-day roadmap built from the assessment itself, in microseconds.
+
+Every question in the catalogue carries a remediation `action`. Gaps are ranked by how far
+the answer is from "yes" and then by how weak the question's pillar is, so the 30-day plan
+closes the worst gaps in the weakest pillars first; partial answers follow in the 60-day
+plan, and the 90-day plan holds the region's regulatory task plus whatever did not fit.
+Mature organisations with few gaps get the next steps of the playbooks for their weakest
+pillars instead, so every horizon is always filled.
+"""
+
+SLOTS = {"30_day": 5, "60_day": 4, "90_day": 3}
+URGENT = 10  # answer points at or below this ("no", "unknown") belong in the first 30 days
+DEFAULT_REGION_ACTION = {
+    "title": "Regulatory compliance review",
+    "description": "Assess readiness against the regulations that apply in your region and produce a gap report.",
+    "owner": "CISO",
+    "effort": "M",
+    "definition_of_done": "Gap report produced. Remediation plan approved by the board.",
+}
+
+
+def _task(action: dict) -> dict:
+    return {k: action[k] for k in ("title", "description", "owner", "effort", "definition_of_done")}
+
+
+def _question_task(q: dict, cat) -> dict:
+    if "action" in q:
+        return _task(q["action"])
+    win = cat.risk_templates.get(q["pillar"], ("", ""))[1]
+    return {"title": f"{q['pillar']}: close gap", "description": win or q["text"], "owner": "Security Team",
+            "effort": "M", "definition_of_done": q["text"]}
+
+
+def _playbook_tasks(pillars: list, cat, skip: set) -> list:
+    """Playbook steps for `pillars` (weakest first), interleaved so no single pillar dominates."""
+    queues = []
+    for p in pillars:
+        for pb in cat.playbooks_by_pillar.get(p, []):
+            steps = [s for s in pb.get("steps", []) if s.get("title") and s.get("title") not in skip]
+            if steps:
+                queues.append(steps)
+    out = []
+    while any(queues):
+        for steps in queues:
+            if steps:
+                s = steps.pop(0)
+                out.append({"title": s["title"], "description": s.get("description", ""), "owner": s.get("owner", "Security Team"),
+                            "effort": "M", "definition_of_done": s.get("evidence", "")})
+    return out
+
+
+def template_roadmap(region: str, answers: dict, averages: dict, cat) -> dict:
+    """`averages` is {pillar: average points}, as stored on the session."""
+    gaps = []
+    for order, q in enumerate(cat.questions):
+        points = cat.points((answers.get(q["id"]) or {}).get("answer"))
+        if points < 100:
+            gaps.append((points > URGENT, averages.get(q["pillar"], 0), points, order, q))
+    gaps.sort(key=lambda g: g[:4])
+
+    roadmap = {h: [] for h in SLOTS}
+    used = set()
+    overflow = []
+    for urgent_later, _, _, _, q in gaps:
+        task = _question_task(q, cat)
+        used.add(task["title"])
+        horizon = "60_day" if urgent_later else "30_day"
+        if len(roadmap[horizon]) < SLOTS[horizon]:
+            roadmap[horizon].append(task)
+        elif horizon == "30_day" and len(roadmap["60_day"]) < SLOTS["60_day"]:
+            roadmap["60_day"].append(task)
+        else:
+            overflow.append(task)
+
+    roadmap["90_day"].append(_task(cat.region_actions.get((region or "").upper(), DEFAULT_REGION_ACTION)))
+    for task in overflow:
+        if len(roadmap["90_day"]) < SLOTS["90_day"]:
+            roadmap["90_day"].append(task)
+
+    weakest = sorted(averages, key=lambda p: averages[p])
+    extra = _playbook_tasks(weakest, cat, used)
+    for horizon in SLOTS:
+        while len(roadmap[horizon]) < SLOTS[horizon] and extra:
+            roadmap[horizon].append(extra.pop(0))
+    return roadmap
@@ -0,0 +1,121 @@
+import time
+import uuid
+import asyncio
+import threading
+import concurrent.futures
+
+
+class _Call:
+    def __init__(self):
+        self.future = concurrent.futures.Future()
+
+
+class SingleFlight:
+    """Coalesce concurrent computations of the same key into one.
+
+    Within a process, the first caller for a key becomes the leader and everyone else
+    (on any event loop) waits on its future. Across processes, leaders take a lease row in
+    the database; a process that finds the lease held waits for it to be released and
+    then asks `lookup()` for the result the other process published (e.g. via a cache).
+    """
+
+    def __init__(self, db, lease_ttl: float = 60.0, poll_interval: float = 0.2):
+        self.db = db
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.remote_waits = 0
+
+    # ── Cross-process lease ───────────────────────────────────────────────────
+
+    def _acquire(self, key: str, owner: str) -> bool:
+        now = time.time()
+        with self.db.connection(write=True) as con:
+            cur = con.execute("""
+                INSERT INTO singleflight_leases (key, owner, expires_at) VALUES (?,?,?)
+                ON CONFLICT(key) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+                WHERE singleflight_leases.expires_at < ?
+            """, (key, owner, now + self.lease_ttl, now))
+            return cur.rowcount == 1
+
+    def _release(self, key: str, owner: str):
+        with self.db.connection(write=True) as con:
+            con.execute("DELETE FROM singleflight_leases WHERE key=? AND owner=?", (key, owner))
+
+    def _held_elsewhere(self, key: str) -> bool:
+        with self.db.connection() as con:
+            return con.execute("SELECT 1 FROM singleflight_leases WHERE key=? AND expires_at>=?", (key, time.time())).fetchone() is not None
+
+    def try_lease(self, key: str):
+        """Take the cross-process lease on `key` without coalescing: an owner token for
+        `release`, or None while another process holds it."""
+        owner = uuid.uuid4().hex
+        return owner if self._acquire(key, owner) else None
+
+    def release(self, key: str, owner: str):
+        self._release(key, owner)
+
+    # ── In-process coalescing ─────────────────────────────────────────────────
+
+    def _join(self, key: str):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def _settle(self, key: str, call: _Call, result=None, error=None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            call.future.set_exception(error)
+        else:
+            call.future.set_result(result)
+
+    async def do(self, key: str, fn, lookup=None):
+        """Run `await fn()` once per key no matter how many callers ask concurrently.
+
+        The lease queries and `lookup()` block on the database, so they run in a thread.
+        """
+        call, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(call.future)
+        owner = uuid.uuid4().hex
+        try:
+            waited = False
+            while True:
+                if await asyncio.to_thread(self._acquire, key, owner):
+                    try:
+                        result = await fn()
+                    finally:
+                        await asyncio.to_thread(self._release, key, owner)
+                    break
+                if not waited:
+                    waited = True
+                    with self._lock:
+                        self.remote_waits += 1
+                while await asyncio.to_thread(self._held_elsewhere, key):
+                    await asyncio.sleep(self.poll_interval)
+                result = await asyncio.to_thread(lookup) if lookup else None
+                if result is not None:
+                    break
+        except BaseException as e:
+            self._settle(key, call, error=e)
+            raise
+        self._settle(key, call, result=result)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "remote_waits": self.remote_waits,
+                "in_flight": len(self._calls),
+            }
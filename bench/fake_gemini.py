@@ -0,0 +1,149 @@
+"""
+Offline stand-in for the Gemini REST API (`POST /v1beta/models/{model}:generateContent` and
+`:streamGenerateContent?alt=sse`, which spreads the latency over `--chunks` SSE events).
+
+Latency, error rate and the share of malformed replies are configurable on the command line
+or at runtime through `POST /_config`, so the backend's retry, deadline and fallback paths
+can be exercised without a key or network access. `usageMetadata` counts about four
+characters per token and, like implicit context caching, reports a system instruction it has
+already seen as cached:
+
+    python bench/fake_gemini.py --port 8765 --latency 0.8 --jitter 0.3 --error-rate 0.05 --malformed-rate 0.05
+    GEMINI_API_ENDPOINT=http://127.0.0.1:8765 uvicorn main:app
+"""
+import json
+import random
+import asyncio
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Bodies that fail parse_roadmap: prose, a truncated object, a trailing comma.
+MALFORMED = [
+    "I'm sorry, I can't help with that request.",
+    '{"30_day": [{"title": "Enable MFA", "description": "Roll out',
+    '{"30_day": [], "60_day": [], "90_day": [],}',
+]
+
+
+def fake_roadmap(rng: random.Random) -> dict:
+    def task(horizon, i):
+        return {
+            "title": f"{horizon} task {i + 1}",
+            "description": "Generated offline by the Gemini stand-in.",
+            "owner": rng.choice(["CISO", "IT Manager", "Network Engineer", "Data Owner"]),
+            "effort": rng.choice("SML"),
+            "definition_of_done": "Evidence recorded.",
+        }
+    return {h: [task(h, i) for i in range(n)] for h, n in (("30_day", 5), ("60_day", 4), ("90_day", 3))}
+
+
+def _text(content) -> str:
+    return "".join(p.get("text", "") for c in (content if isinstance(content, list) else [content or {}]) for p in c.get("parts", []))
+
+
+def _candidate(text: str, finish: bool = True, prompt_tokens: int = 0, cached_tokens: int = 0, output_tokens: int = None) -> dict:
+    out = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}],
+           "usageMetadata": {"promptTokenCount": prompt_tokens, "cachedContentTokenCount": cached_tokens,
+                             "candidatesTokenCount": len(text) // 4 if output_tokens is None else output_tokens}}
+    if finish:
+        out["candidates"][0]["finishReason"] = "STOP"
+    return out
+
+
+def create_app(latency: float = 0.5, jitter: float = 0.0, error_rate: float = 0.0,
+               malformed_rate: float = 0.0, fenced: bool = False, seed: int = None, chunks: int = 8) -> FastAPI:
+    app = FastAPI(title="Fake Gemini")
+    app.state.config = {"latency": latency, "jitter": jitter, "error_rate": error_rate,
+                        "malformed_rate": malformed_rate, "fenced": fenced, "chunks": chunks}
+    app.state.stats = {"requests": 0, "errors": 0, "malformed": 0}
+    app.state.seen_system = set()
+    rng = random.Random(seed)
+
+    def usage(body: dict) -> tuple:
+        """(prompt tokens, cached tokens) for a request body."""
+        system = _text(body.get("systemInstruction"))
+        prompt_tokens = (len(system) + len(_text(body.get("contents")))) // 4
+        cached = len(system) // 4 if system in app.state.seen_system else 0
+        if system:
+            app.state.seen_system.add(system)
+        return prompt_tokens, cached
+
+    def reply():
+        """(delay, error response or None, text)"""
+        cfg, stats = app.state.config, app.state.stats
+        stats["requests"] += 1
+        delay = max(0.0, cfg["latency"] + rng.uniform(-cfg["jitter"], cfg["jitter"]))
+        if rng.random() < cfg["error_rate"]:
+            stats["errors"] += 1
+            code = rng.choice([429, 500, 503])
+            return delay, JSONResponse({"error": {"code": code, "message": "fake upstream error", "status": "UNAVAILABLE"}}, status_code=code), None
+        if rng.random() < cfg["malformed_rate"]:
+            stats["malformed"] += 1
+            return delay, None, rng.choice(MALFORMED)
+        text = json.dumps(fake_roadmap(rng))
+        if cfg["fenced"]:
+            text = f"```json\n{text}\n```"
+        return delay, None, text
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate_content(model: str, request: Request):
+        prompt_tokens, cached = usage(await request.json())
+        delay, error, text = reply()
+        if delay:
+            await asyncio.sleep(delay)
+        return error or _candidate(text, prompt_tokens=prompt_tokens, cached_tokens=cached)
+
+    @app.post("/v1beta/models/{model}:streamGenerateContent")
+    async def stream_generate_content(model: str, request: Request):
+        prompt_tokens, cached = usage(await request.json())
+        delay, error, text = reply()
+        if error:
+            await asyncio.sleep(delay)
+            return error
+        n = max(1, int(app.state.config["chunks"]))
+        size = -(-len(text) // n)
+
+        async def events():
+            for i in range(n):
+                await asyncio.sleep(delay / n)
+                piece = text[i * size:(i + 1) * size]
+                if piece:
+                    # Usage is cumulative; the last event carries the totals.
+                    out = _candidate(piece, i == n - 1, prompt_tokens, cached, len(text[:(i + 1) * size]) // 4)
+                    yield f"data: {json.dumps(out)}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/_config")
+    async def configure(request: Request):
+        app.state.config.update({k: v for k, v in (await request.json()).items() if k in app.state.config})
+        return app.state.config
+
+    @app.get("/_stats")
+    def get_stats():
+        return {**app.state.stats, "config": app.state.config}
+
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Gemini REST stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="mean response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- jitter in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 429/500/503 replies")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share of replies that are not a valid roadmap")
+    parser.add_argument("--fenced", action="store_true", help="wrap valid replies in ```json fences")
+    parser.add_argument("--chunks", type=int, default=8, help="SSE events per streamed reply")
+    parser.add_argument("--seed", type=int)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    args = parse_args()
+    uvicorn.run(create_app(args.latency, args.jitter, args.error_rate, args.malformed_rate, args.fenced, args.seed, args.chunks),
+                host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,190 @@
+"""
+End-to-end load generator: create session -> submit answers -> dashboard -> roadmap job.
+
+Flows start open-loop at `--rps` for `--duration` seconds (a slow server does not slow the
+arrival rate, so queueing shows up in the latencies). Each step and the whole flow report
+p50/p95/p99 and throughput. `--spawn` starts the API and the Gemini stand-in locally on a
+throwaway database, so the whole run is offline:
+
+    python bench/load.py --spawn --rps 20 --duration 30 --gemini-latency 0.8 --save bench/baselines/load.json
+    python bench/load.py --base-url http://127.0.0.1:8080 --rps 50 --duration 60
+"""
+import os
+import sys
+import time
+import random
+import socket
+import asyncio
+import tempfile
+import argparse
+import subprocess
+import httpx
+
+from stats import summarize, report, add_baseline_args
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+STEPS = ("create", "answers", "dashboard", "roadmap", "flow")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_healthy(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not healthy after {timeout}s")
+
+
+def spawn(args) -> tuple:
+    """Start the Gemini stand-in and the API on free ports; returns (base_url, processes)."""
+    gemini_port, api_port = free_port(), free_port()
+    fake = subprocess.Popen([sys.executable, os.path.join(ROOT, "bench", "fake_gemini.py"), "--port", str(gemini_port),
+                             "--latency", str(args.gemini_latency), "--jitter", str(args.gemini_jitter),
+                             "--error-rate", str(args.gemini_error_rate), "--malformed-rate", str(args.gemini_malformed_rate)])
+    env = {**os.environ,
+           "ZTC_DB_PATH": os.path.join(tempfile.mkdtemp(prefix="ztcompass-load-"), "ztcompass.db"),
+           "GEMINI_API_ENDPOINT": f"http://127.0.0.1:{gemini_port}",
+           "GEMINI_API_KEY": "offline"}
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(api_port), "--log-level", "warning",
+                            "--workers", str(args.workers)], cwd=os.path.join(ROOT, "backend"), env=env)
+    procs = [fake, api]
+    try:
+        wait_healthy(f"http://127.0.0.1:{gemini_port}/_stats")
+        wait_healthy(f"http://127.0.0.1:{api_port}/api/health")
+    except Exception:
+        for p in procs:
+            p.terminate()
+        raise
+    return f"http://127.0.0.1:{api_port}", procs
+
+
+class LoadRun:
+    def __init__(self, client: httpx.AsyncClient, profiles: int, roadmap_timeout: float, seed: int):
+        self.client = client
+        self.roadmap_timeout = roadmap_timeout
+        self.rng = random.Random(seed)
+        self.profiles = profiles
+        self.answer_sets = None
+        self.latencies = {s: [] for s in STEPS}
+        self.errors = {s: 0 for s in STEPS}
+        self.sources = {}
+
+    async def _step(self, name, coro):
+        started = time.perf_counter()
+        try:
+            response = await coro
+            if isinstance(response, httpx.Response):
+                response.raise_for_status()
+        except Exception:
+            self.errors[name] += 1
+            raise
+        self.latencies[name].append(time.perf_counter() - started)
+        return response
+
+    def _answers(self, questions: list) -> dict:
+        # A bounded set of answer profiles, so the roadmap cache sees realistic repeat traffic.
+        if self.answer_sets is None:
+            self.answer_sets = [{q["id"]: {"answer": self.rng.choice(["yes", "partial", "no", "unknown"])} for q in questions}
+                                for _ in range(self.profiles)]
+        return self.rng.choice(self.answer_sets)
+
+    async def _roadmap(self, sid: str):
+        job = (await self.client.post(f"/api/sessions/{sid}/roadmap")).raise_for_status().json()
+        deadline = time.monotonic() + self.roadmap_timeout
+        while job["status"] not in ("done", "failed"):
+            if time.monotonic() > deadline:
+                raise TimeoutError("roadmap job did not finish")
+            await asyncio.sleep(0.05)
+            job = (await self.client.get(f"/api/jobs/{job['job_id']}")).raise_for_status().json()
+        if job["status"] != "done":
+            raise RuntimeError(job.get("error") or "roadmap job failed")
+        self.sources[job.get("source")] = self.sources.get(job.get("source"), 0) + 1
+        return job
+
+    async def flow(self):
+        started = time.perf_counter()
+        try:
+            region = self.rng.choice(["CH", "UK", "EU"])
+            created = (await self._step("create", self.client.post("/api/sessions", json={"region": region}))).json()
+            sid = created["session_id"]
+            answers = self._answers(created["questions"])
+            await self._step("answers", self.client.post(f"/api/sessions/{sid}/answers", json={"session_id": sid, "answers": answers}))
+            await self._step("dashboard", self.client.get(f"/api/sessions/{sid}/dashboard"))
+            await self._step("roadmap", self._roadmap(sid))
+        except Exception:
+            self.errors["flow"] += 1
+            return
+        self.latencies["flow"].append(time.perf_counter() - started)
+
+
+async def drive(base_url: str, rps: float, duration: float, max_in_flight: int, profiles: int,
+                roadmap_timeout: float, seed: int) -> dict:
+    limits = httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=roadmap_timeout) as client:
+        run = LoadRun(client, profiles, roadmap_timeout, seed)
+        tasks, dropped = set(), 0
+        started = time.perf_counter()
+        n = 0
+        while True:
+            due = started + n / rps
+            if due - started >= duration:
+                break
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            n += 1
+            if len(tasks) >= max_in_flight:
+                dropped += 1  # the generator itself is saturated; count it rather than slow down
+                continue
+            task = asyncio.create_task(run.flow())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        elapsed = time.perf_counter() - started
+    results = {step: summarize(run.latencies[step], elapsed, run.errors[step]) for step in STEPS}
+    results["flow"].update(offered=n, dropped=dropped, roadmap_sources=run.sources)
+    return results
+
+
+def cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ZT Compass end-to-end load generator")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8080")
+    parser.add_argument("--spawn", action="store_true", help="start the API and Gemini stand-in locally")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers when spawning")
+    parser.add_argument("--rps", type=float, default=10.0, help="new flows per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to generate load for")
+    parser.add_argument("--max-in-flight", type=int, default=200)
+    parser.add_argument("--profiles", type=int, default=50, help="distinct answer sets")
+    parser.add_argument("--roadmap-timeout", type=float, default=60.0)
+    parser.add_argument("--gemini-latency", type=float, default=0.8)
+    parser.add_argument("--gemini-jitter", type=float, default=0.3)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.02)
+    parser.add_argument("--gemini-malformed-rate", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    add_baseline_args(parser)
+    args = parser.parse_args(argv)
+
+    procs = []
+    base_url = args.base_url
+    if args.spawn:
+        base_url, procs = spawn(args)
+    try:
+        results = asyncio.run(drive(base_url, args.rps, args.duration, args.max_in_flight, args.profiles,
+                                    args.roadmap_timeout, args.seed))
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait(timeout=10)
+    return report(results, args.save, args.compare, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,86 @@
+"""
+Micro-benchmarks for the per-request hot paths: scoring, risk/win ranking, dashboard encoding
+and the rule-based roadmap.
+
+Each benchmark runs `--samples` batches of `--batch` calls; the reported p50/p95/p99 are
+per-call times across batches, and throughput is calls per second over the whole run.
+
+    python bench/micro.py --save bench/baselines/micro.json
+    python bench/micro.py --compare bench/baselines/micro.json --tolerance 0.25
+"""
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+os.environ.setdefault("ZTC_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="ztcompass-bench-"), "ztcompass.db"))
+os.environ.setdefault("CATALOGUE_POLL_INTERVAL", "0")
+
+from stats import summarize, report, add_baseline_args  # noqa: E402
+
+
+def random_answers(questions: list, rng: random.Random) -> dict:
+    return {q["id"]: {"answer": rng.choice(["yes", "partial", "no", "unknown"])} for q in questions}
+
+
+def run(fn, inputs: list, samples: int, batch: int) -> dict:
+    timings = []
+    started = time.perf_counter()
+    for s in range(samples):
+        chunk = inputs[(s * batch) % len(inputs):][:batch] or inputs[:batch]
+        t0 = time.perf_counter()
+        for x in chunk:
+            fn(x)
+        timings.append((time.perf_counter() - t0) / len(chunk))
+    elapsed = time.perf_counter() - started
+    out = summarize(timings)
+    out["count"] = samples * batch
+    out["throughput"] = round(samples * batch / elapsed, 2)
+    return out
+
+
+def benchmarks(seed: int = 0, inputs: int = 2000) -> dict:
+    """name -> (function, list of inputs)"""
+    import main
+    from content import encode_json
+
+    rng = random.Random(seed)
+    questions = main.catalogue.current.questions
+    answers = [random_answers(questions, rng) for _ in range(inputs)]
+    scores = [main.compute_scores(a) for a in answers]
+    dashboards = [main.build_dashboard("00000000-0000-0000-0000-000000000000", "CH", s) for s in scores]
+    return {
+        "compute_scores": (main.compute_scores, answers),
+        "generate_risks_and_wins": (main.generate_risks_and_wins, scores),
+        "build_dashboard": (lambda s: main.build_dashboard("00000000-0000-0000-0000-000000000000", "CH", s), scores),
+        "encode_dashboard": (encode_json, dashboards),
+        "json_dumps_dashboard": (json.dumps, dashboards),
+        "roadmap_cache_key": (lambda a: main.roadmap_key("CH", a), answers),
+        "template_roadmap": (lambda a: main.session_template("CH", a), answers),
+    }
+
+
+def cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ZT Compass micro-benchmarks")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--only", nargs="*", help="run only these benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    add_baseline_args(parser)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, (fn, inputs) in benchmarks(args.seed).items():
+        if args.only and name not in args.only:
+            continue
+        run(fn, inputs, max(1, args.samples // 10), args.batch)  # warm-up
+        results[name] = run(fn, inputs, args.samples, args.batch)
+    return report(results, args.save, args.compare, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
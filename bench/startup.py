@@ -0,0 +1,78 @@
+"""
+Cold-start benchmark: how long a new instance takes to import the app, answer its first
+request (`/api/health`, liveness) and report ready (`/api/ready`, after the background warm-up).
+
+Every run is a fresh process against an already migrated throwaway database, the way a new
+Cloud Run instance starts next to an existing schema:
+
+    python bench/startup.py --runs 10 --save bench/baselines/startup.json
+    python bench/startup.py --compare bench/baselines/startup.json --tolerance 0.3
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import subprocess
+import httpx
+
+from stats import summarize, report, add_baseline_args
+from load import free_port
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BACKEND = os.path.join(ROOT, "backend")
+IMPORT_MAIN = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def wait_ok(url: str, started: float, timeout: float) -> float:
+    """Seconds from `started` until `url` first answers 200."""
+    while time.perf_counter() - started < timeout:
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def serve_once(env: dict, timeout: float) -> tuple:
+    """(seconds to first /api/health, seconds to /api/ready) for one fresh uvicorn process."""
+    port = free_port()
+    started = time.perf_counter()
+    api = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                           cwd=BACKEND, env=env)
+    try:
+        first = wait_ok(f"http://127.0.0.1:{port}/api/health", started, timeout)
+        ready = wait_ok(f"http://127.0.0.1:{port}/api/ready", started, timeout)
+    finally:
+        api.terminate()
+        api.wait()
+    return first, ready
+
+
+def cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ZT Compass cold-start benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per measurement")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    add_baseline_args(parser)
+    args = parser.parse_args(argv)
+
+    env = {**os.environ,
+           "ZTC_DB_PATH": os.path.join(tempfile.mkdtemp(prefix="ztcompass-startup-"), "ztcompass.db"),
+           "CATALOGUE_POLL_INTERVAL": "0"}
+    subprocess.run([sys.executable, "-c", "import main"], cwd=BACKEND, env=env, check=True)  # create the schema
+
+    imports, first, ready = [], [], []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", IMPORT_MAIN], cwd=BACKEND, env=env, check=True, capture_output=True, text=True)
+        imports.append(float(out.stdout.split()[-1]))
+        f, r = serve_once(env, args.timeout)
+        first.append(f)
+        ready.append(r)
+    results = {"import_main": summarize(imports), "first_response": summarize(first), "ready": summarize(ready)}
+    return report(results, args.save, args.compare, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
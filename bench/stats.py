@@ -0,0 +1,90 @@
+"""
+Percentiles, result summaries and baseline files shared by the micro and load benchmarks.
+
+A baseline is the JSON a run printed, saved with `--save`. `--compare` re-runs and fails
+(exit code 1) when a tracked metric is worse than the baseline by more than `--tolerance`.
+"""
+import os
+import sys
+import json
+import time
+import platform
+
+# Metrics where bigger is worse; everything else in a summary is informational.
+LOWER_IS_BETTER = ("p50", "p95", "p99")
+HIGHER_IS_BETTER = ("throughput",)
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies: list, elapsed: float = None, errors: int = 0) -> dict:
+    """Latencies in seconds -> count, errors, p50/p95/p99/max in milliseconds, throughput per second."""
+    values = sorted(latencies)
+    out = {"count": len(values), "errors": errors}
+    if values:
+        ms = lambda s: round(s * 1000, 6)
+        out.update(p50=ms(percentile(values, 50)), p95=ms(percentile(values, 95)), p99=ms(percentile(values, 99)),
+                   max=ms(values[-1]), mean=ms(sum(values) / len(values)))
+    if elapsed:
+        out["throughput"] = round(len(values) / elapsed, 2)
+    return out
+
+
+def environment() -> dict:
+    return {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+
+
+def save_baseline(path: str, results: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=2, sort_keys=True)
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """Regressions of `results` against `baseline["results"]`, as readable strings."""
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        for key in LOWER_IS_BETTER:
+            if before.get(key) and current.get(key) is not None and current[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{name}.{key}: {current[key]} vs baseline {before[key]} (+{current[key] / before[key] - 1:.0%})")
+        for key in HIGHER_IS_BETTER:
+            if before.get(key) and current.get(key) is not None and current[key] < before[key] * (1 - tolerance):
+                regressions.append(f"{name}.{key}: {current[key]} vs baseline {before[key]} ({current[key] / before[key] - 1:.0%})")
+    return regressions
+
+
+def report(results: dict, save: str = None, compare_to: str = None, tolerance: float = 0.2) -> int:
+    """Print a table and the JSON results, save/compare baselines; returns the process exit code."""
+    width = max(len(n) for n in results) if results else 10
+    print(f"{'benchmark':<{width}}  {'count':>8} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'per sec':>12} {'errors':>7}", file=sys.stderr)
+    for name, r in results.items():
+        print(f"{name:<{width}}  {r['count']:>8} {r.get('p50', '-'):>10} {r.get('p95', '-'):>10} {r.get('p99', '-'):>10} "
+              f"{r.get('throughput', '-'):>12} {r.get('errors', 0):>7}", file=sys.stderr)
+    print(json.dumps(results, indent=2, sort_keys=True))
+    code = 0
+    if compare_to:
+        with open(compare_to) as f:
+            regressions = compare(results, json.load(f), tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        code = 1 if regressions else 0
+    if save:
+        save_baseline(save, results)
+        print(f"baseline saved to {save}", file=sys.stderr)
+    return code
+
+
+def add_baseline_args(parser):
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline file")
+    parser.add_argument("--compare", metavar="PATH", help="fail if results regress against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression (default 0.2)")
@@ -91,10 +91,18 @@ export default function Dashboard() {
   const [data, setData] = useState(null)
   const [loading, setLoading] = useState(true)
   const [loadError, setLoadError] = useState(null)
+  const [peers, setPeers] = useState(null)
 
   useEffect(() => {
     axios.get(`/api/sessions/${sessionId}/dashboard`)
-      .then(res => { setData(res.data); setLoading(false) })
+      .then(res => {
+        setData(res.data)
+        setLoading(false)
+        // Peer percentiles are a separate, non-blocking request so the dashboard never waits on them
+        axios.get(`/api/benchmarks/${res.data.region}`, { params: { session_id: sessionId } })
+          .then(b => setPeers(b.data.pillars))
+          .catch(() => {})
+      })
       .catch(() => {
         setLoadError(true)
         setLoading(false)
@@ -171,6 +179,9 @@ export default function Dashboard() {
               <div className={`text-xs font-semibold px-2 py-0.5 rounded-full inline-block ${LEVEL_COLORS[data.level]}`}>
                 {data.level}
               </div>
+              {peers?.[pillar]?.your_percentile != null && peers[pillar].count >= 5 && (
+                <div className="text-xs text-slate-500 mt-2">Better than {Math.round(peers[pillar].your_percentile)}% of {region} peers</div>
+              )}
             </div>
           ))}
         </div>
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { useSearchParams, useNavigate } from 'react-router-dom'
 import axios from 'axios'
 
@@ -21,6 +21,12 @@ export default function QuickScan() {
   const [current, setCurrent] = useState(0)
   const [submitting, setSubmitting] = useState(false)
   const [loadError, setLoadError] = useState(null)
+  // Autosave: changed question ids are PATCHed in one batch shortly after the last edit.
+  const revision = useRef(null)
+  const dirty = useRef(new Set())
+  const saveTimer = useRef(null)
+  const answersRef = useRef(answers)
+  answersRef.current = answers
 
   useEffect(() => {
     if (!sessionId) { navigate('/'); return }
@@ -31,6 +37,7 @@ export default function QuickScan() {
     axios.get(`/api/sessions/${sessionId}`)
       .then(res => {
         setQuestions(res.data.questions || [])
+        revision.current = res.data.revision
         if (res.data.answers && Object.keys(res.data.answers).length > 0) {
           setAnswers(res.data.answers)
         }
@@ -45,6 +52,31 @@ export default function QuickScan() {
 
   function setAnswer(qid, field, value) {
     setAnswers(prev => ({ ...prev, [qid]: { ...prev[qid], [field]: value } }))
+    dirty.current.add(qid)
+    clearTimeout(saveTimer.current)
+    saveTimer.current = setTimeout(() => save().catch(console.error), 800)
+  }
+
+  async function save(retry = true) {
+    clearTimeout(saveTimer.current)
+    if (!dirty.current.size) return
+    const ids = [...dirty.current]
+    dirty.current.clear()
+    const delta = Object.fromEntries(ids.map(id => [id, answersRef.current[id] || {}]))
+    try {
+      const res = await axios.patch(`/api/sessions/${sessionId}/answers`, { answers: delta, revision: revision.current })
+      revision.current = res.data.revision
+    } catch (e) {
+      ids.forEach(id => dirty.current.add(id))
+      if (e.response?.status === 409 && retry) {
+        // Another tab saved first: take its answers for the questions we haven't touched, then re-send ours.
+        const res = await axios.get(`/api/sessions/${sessionId}`)
+        revision.current = res.data.revision
+        setAnswers(prev => ({ ...res.data.answers, ...Object.fromEntries(ids.map(id => [id, prev[id]])) }))
+        return save(false)
+      }
+      throw e
+    }
   }
 
   function canProceed() {
@@ -62,7 +94,7 @@ export default function QuickScan() {
   async function finish() {
     setSubmitting(true)
     try {
-      await axios.post(`/api/sessions/${sessionId}/answers`, { session_id: sessionId, answers })
+      await save()
       navigate(`/dashboard/${sessionId}`)
     } catch (e) {
       console.error(e)
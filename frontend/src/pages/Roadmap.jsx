@@ -48,19 +48,96 @@ export default function Roadmap() {
   const [roadmap, setRoadmap] = useState(null)
   const [region, setRegion] = useState('')
   const [loading, setLoading] = useState(true)
+  const [streaming, setStreaming] = useState(false)
+  const [source, setSource] = useState(null)
   const [error, setError] = useState(null)
 
   useEffect(() => {
-    axios.post(`/api/sessions/${sessionId}/roadmap`)
+    let cancelled = false
+    let events = null
+    let timer = null
+    // The rule-based draft is complete, so Gemini's partial tasks are not shown over it.
+    let hasDraft = false
+
+    const finish = (job) => {
+      if (cancelled) return
+      if (job.status === 'done') {
+        setRoadmap(job.roadmap)
+        setSource(job.source)
+      } else if (!hasDraft) setError('Failed to generate roadmap')
+      setLoading(false)
+      setStreaming(false)
+    }
+
+    const showPartial = (partial) => {
+      if (cancelled || hasDraft) return
+      setRoadmap(partial)
+      setStreaming(true)
+      setLoading(false)
+    }
+
+    // Fallback when SSE is unavailable (old browsers, proxies that buffer streams)
+    const poll = (jobId) => {
+      axios.get(`/api/jobs/${jobId}`)
+        .then(res => {
+          if (res.data.status === 'done' || res.data.status === 'failed') finish(res.data)
+          else if (!cancelled) {
+            if (res.data.partial) showPartial(res.data.partial)
+            timer = setTimeout(() => poll(jobId), 1000)
+          }
+        })
+        .catch(() => finish({ status: 'failed' }))
+    }
+
+    const start = (retries) => axios.post(`/api/sessions/${sessionId}/roadmap`)
       .then(res => {
-        setRoadmap(res.data.roadmap)
         setRegion(res.data.region)
-        setLoading(false)
+        if (res.data.status === 'done' || res.data.status === 'failed') return finish(res.data)
+        if (res.data.roadmap) {
+          hasDraft = true
+          setRoadmap(res.data.roadmap)
+          setSource(res.data.source)
+          setStreaming(true)
+          setLoading(false)
+        }
+        if (typeof EventSource === 'undefined') return poll(res.data.job_id)
+        const stream = events = new EventSource(`/api/jobs/${res.data.job_id}/events`)
+        // Tasks arrive one by one while Gemini is still writing the rest of the plan
+        stream.addEventListener('task', e => {
+          if (hasDraft) return
+          const { horizon, index, task } = JSON.parse(e.data)
+          setRoadmap(prev => {
+            const next = { '30_day': [], '60_day': [], '90_day': [], ...prev }
+            next[horizon] = [...next[horizon]]
+            next[horizon][index] = task
+            return next
+          })
+          setStreaming(true)
+          setLoading(false)
+        })
+        stream.addEventListener('result', e => {
+          stream.close()
+          finish(JSON.parse(e.data))
+        })
+        stream.onerror = () => {
+          stream.close()
+          poll(res.data.job_id)
+        }
       })
-      .catch(e => {
-        setError('Failed to generate roadmap')
-        setLoading(false)
+      .catch(err => {
+        // Rate limited or the roadmap queue is full: ask again when the server says to
+        const wait = Number(err.response?.headers?.['retry-after'])
+        if (err.response?.status === 429 && wait && retries > 0 && !cancelled) {
+          timer = setTimeout(() => start(retries - 1), wait * 1000)
+        } else finish({ status: 'failed' })
       })
+    start(3)
+
+    return () => {
+      cancelled = true
+      if (events) events.close()
+      clearTimeout(timer)
+    }
   }, [sessionId])
 
   if (loading) return (
@@ -94,10 +171,16 @@ export default function Roadmap() {
         {/* Header */}
         <div className="mb-8 text-center">
           <div className="inline-flex items-center gap-2 px-4 py-2 rounded-full glass text-blue-400 text-sm font-medium mb-4">
-            <span>✨</span> Generated by Gemini AI
+            <span>✨</span> {source === 'template' ? 'Built from your answers' : 'Generated by Gemini AI'}
           </div>
           <h1 className="text-3xl font-extrabold mb-2">Your Zero Trust Roadmap</h1>
           <p className="text-slate-400">Personalised 90-day plan tailored to your gaps and {region} regulatory context</p>
+          {streaming && (
+            <p className="text-blue-400 text-sm mt-3 flex items-center justify-center gap-2">
+              <span className="w-3 h-3 border-2 border-blue-400 border-t-transparent rounded-full animate-spin" />
+              {source === 'template' ? 'Gemini is refining this plan — it will update in place' : 'Still generating — tasks appear as Gemini writes them'}
+            </p>
+          )}
         </div>
 
         {/* Timeline visual */}
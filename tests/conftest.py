@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# Offline backend tests run against a throwaway SQLite file instead of /tmp/ztcompass.db.
+_TMP = tempfile.mkdtemp(prefix="ztcompass-test-")
+os.environ.setdefault("ZTC_DB_PATH", os.path.join(_TMP, "ztcompass.db"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "bench"))
+# The suite drives every request from one client address; rate limits get their own test.
+os.environ.setdefault("RATE_LIMIT_IP_RATE", "0")
+os.environ.setdefault("RATE_LIMIT_ROADMAP_RATE", "0")
+# Warm-up would import the Gemini SDK in the background; nothing here calls it.
+os.environ.setdefault("LLM_WARMUP", "0")
+# Operator endpoints are gated by a bearer token (see ADMIN in test_api.py).
+os.environ.setdefault("ZTC_ADMIN_TOKEN", "test-admin")
@@ -0,0 +1,1192 @@
+"""
+ZT Compass Beta — offline API tests
+Runs the FastAPI app in-process against a temporary SQLite DB. Gemini is never called.
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from llm_client import GeminiClient, LLMDeadlineExceeded
+from singleflight import SingleFlight
+from db import ConnectionPool, PoolTimeout, open_pool
+from jobs import RoadmapJobQueue
+from roadmap_cache import RoadmapCache
+from db_postgres import translate
+from roadmap_stream import parse_roadmap
+from batch_scoring import score_sessions
+
+client = TestClient(main.app)
+
+ADMIN = {"Authorization": "Bearer test-admin"}
+
+ALL_YES = {q["id"]: {"answer": "yes"} for q in main.catalogue.current.questions}
+
+GEMINI_ROADMAP = {
+    "30_day": [{"title": "t1", "description": "d", "owner": "CISO", "effort": "S", "definition_of_done": "done"}],
+    "60_day": [{"title": "t2", "description": "d", "owner": "CISO", "effort": "M", "definition_of_done": "done"}],
+    "90_day": [{"title": "t3", "description": "d", "owner": "CISO", "effort": "L", "definition_of_done": "done"}],
+}
+
+
+def new_session(region="CH", answers=None):
+    sid = client.post("/api/sessions", json={"region": region}).json()["session_id"]
+    if answers is not None:
+        client.post(f"/api/sessions/{sid}/answers", json={"session_id": sid, "answers": answers})
+    return sid
+
+
+def streamed(generate):
+    """Turn a fake `generate(prompt, deadline)` into a `generate_stream` yielding its reply in small chunks."""
+    async def _stream(prompt, deadline=None, **options):
+        text = await generate(prompt, deadline)
+        for i in range(0, len(text), 16):
+            yield text[i:i + 16]
+    return _stream
+
+
+def collect(llm, prompt: str = "p") -> str:
+    """Everything `llm.generate_stream(prompt)` yields, joined."""
+    async def _run():
+        return "".join([chunk async for chunk in llm.generate_stream(prompt)])
+    return asyncio.run(_run())
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    calls = []
+
+    async def _fake(prompt, deadline=None):
+        calls.append(prompt)
+        return json.dumps(GEMINI_ROADMAP)
+
+    monkeypatch.setattr(main.llm, "generate_stream", streamed(_fake))
+    main.roadmap_cache.invalidate()
+    return calls
+
+
+def test_dashboard_scores():
+    sid = new_session(answers=ALL_YES)
+    body = client.get(f"/api/sessions/{sid}/dashboard").json()
+    assert body["overall_score"] == 100
+    assert body["pillar_scores"]["Identity"] == {"score": 100, "level": "Optimal"}
+
+
+def run_roadmap(c, sid, timeout=5):
+    return wait_job(c, c.post(f"/api/sessions/{sid}/roadmap").json(), timeout)
+
+
+def wait_job(c, job, timeout=5):
+    deadline = time.monotonic() + timeout
+    while job["status"] not in ("done", "failed") and time.monotonic() < deadline:
+        time.sleep(0.02)
+        job = c.get(f"/api/jobs/{job['job_id']}").json()
+    return job
+
+
+def test_roadmap_cache_shared_across_sessions(fake_gemini):
+    with TestClient(main.app) as c:
+        a = new_session(answers=ALL_YES)
+        b = new_session(answers={k: {"answer": "YES ", "note": ""} for k in ALL_YES})
+        first = run_roadmap(c, a)
+        second = run_roadmap(c, b)
+    assert first["roadmap"] == second["roadmap"] == GEMINI_ROADMAP
+    assert (first["source"], second["source"]) == ("gemini", "cache")
+    assert len(fake_gemini) == 1
+    # Sharing is only right because "YES " and "yes" are the same answer everywhere, scores included.
+    dashboards = [client.get(f"/api/sessions/{sid}/dashboard").json() for sid in (a, b)]
+    assert dashboards[0]["pillar_scores"] == dashboards[1]["pillar_scores"] and dashboards[1]["overall_score"] == 100
+    cat = main.catalogue.current
+    assert main.compute_scores({"id_mfa": {"answer": " Partial"}}) == main.compute_scores({"id_mfa": {"answer": "partial"}})
+    assert main.roadmap_key("CH", {"id_mfa": {"answer": " Partial"}}, cat) == main.roadmap_key("CH", {"id_mfa": {"answer": "partial"}}, cat)
+    assert main.roadmap_key("CH", {"id_mfa": {"answer": "partial"}}, cat) != main.roadmap_key("CH", {"id_mfa": {"answer": "no"}}, cat)
+    assert client.get("/api/cache/roadmaps/stats").json()["hits"] >= 1
+
+
+def test_roadmap_cache_invalidation(fake_gemini):
+    with TestClient(main.app) as c:
+        sid = new_session(region="UK", answers=ALL_YES)
+        run_roadmap(c, sid)
+        assert c.delete("/api/cache/roadmaps").status_code == 401
+        assert c.delete("/api/cache/roadmaps", params={"region": "UK"}, headers=ADMIN).json()["removed"] == 1
+        assert run_roadmap(c, new_session(region="UK", answers=ALL_YES))["source"] == "gemini"
+    assert len(fake_gemini) == 2
+
+
+def test_stored_refined_roadmap_is_served_and_not_overwritten(fake_gemini):
+    with TestClient(main.app) as c:
+        sid = new_session(answers=ALL_YES)
+        assert run_roadmap(c, sid)["source"] == "gemini"
+        main.roadmap_cache.invalidate()
+        again = c.post(f"/api/sessions/{sid}/roadmap")
+        assert again.status_code == 200 and again.json()["source"] == "gemini" and again.json()["roadmap"] == GEMINI_ROADMAP
+        assert c.get(f"/api/sessions/{sid}/roadmap").json()["source"] == "gemini"
+        main.roadmap_jobs.store_roadmap(sid, main.session_template("UK", ALL_YES), "template")
+        assert c.get(f"/api/sessions/{sid}/roadmap").json()["source"] == "gemini"
+        assert len(fake_gemini) == 1
+
+        qid = next(iter(ALL_YES))
+        c.patch(f"/api/sessions/{sid}/answers/{qid}", json={"answer": "no"})  # the refined roadmap is now stale
+        r = c.post(f"/api/sessions/{sid}/roadmap")
+        assert r.status_code == 202 and r.json()["source"] == "template"
+        assert wait_job(c, r.json())["source"] == "gemini"
+    assert len(fake_gemini) == 2
+
+
+def test_roadmap_parser_emits_tasks_as_they_close_and_repairs_output():
+    task = {"title": "MFA", "description": "Enforce MFA", "owner": "CISO", "effort": "S", "definition_of_done": "done"}
+    body = json.dumps({"roadmap": {
+        "30-day": [task, {"name": "SSO", "desc": "Federate apps", "Effort": "Large"}, {"title": "no description"}],
+        "60 days": [task],
+        "day_90": [task],
+    }})
+    text = "Here is your roadmap:\n```json\n" + body.replace("}]", "},]", 1) + "\n```\nLet me know!"
+    parser = main.RoadmapParser()
+    seen = []
+    for i, ch in enumerate(text):
+        for horizon, t in parser.feed(ch):
+            seen.append((horizon, t["title"], i))
+    assert [(h, title) for h, title, _ in seen] == [("30_day", "MFA"), ("30_day", "SSO"), ("60_day", "MFA"), ("90_day", "MFA")]
+    assert seen[0][2] < len(text) // 3  # the first task is out long before the reply is complete
+    roadmap = parser.result()
+    assert roadmap["30_day"][1] == {"title": "SSO", "description": "Federate apps", "owner": "Security Team", "effort": "L", "definition_of_done": ""}
+    assert parser.dropped == 1
+    with pytest.raises(ValueError):
+        parse_roadmap('{"30_day": [' + json.dumps(task) + '], "60_day": [')
+
+
+def test_roadmap_job_surfaces_partial_tasks(monkeypatch):
+    release = asyncio.Event()
+    text = json.dumps(GEMINI_ROADMAP)
+    first_task_end = text.index("}") + 1
+
+    async def _stream(prompt, deadline=None, **options):
+        yield text[:first_task_end]
+        await release.wait()
+        yield text[first_task_end:]
+
+    monkeypatch.setattr(main.llm, "generate_stream", _stream)
+    main.roadmap_cache.invalidate()
+    with TestClient(main.app) as c:
+        job = c.post(f"/api/sessions/{new_session(answers=ALL_YES)}/roadmap").json()
+        deadline = time.monotonic() + 5
+        while "partial" not in job and time.monotonic() < deadline:
+            time.sleep(0.01)
+            job = c.get(f"/api/jobs/{job['job_id']}").json()
+        assert job["status"] == "running"
+        assert job["partial"] == {"30_day": GEMINI_ROADMAP["30_day"], "60_day": [], "90_day": []}
+
+        async def _first_events(n):
+            events = main.roadmap_jobs.events(job["job_id"], poll_interval=0.01)
+            return [await events.__anext__() for _ in range(n)]
+        status, task = asyncio.run(_first_events(2))
+        assert status.startswith("event: status") and task.startswith("event: task")
+        assert json.loads(task.split("data: ", 1)[1])["task"] == GEMINI_ROADMAP["30_day"][0]
+
+        c.portal.call(release.set)
+        done = wait_job(c, job)
+    assert done["roadmap"] == GEMINI_ROADMAP and "partial" not in done
+
+
+def test_template_roadmap_when_gemini_fails_is_not_cached(monkeypatch):
+    async def _fail(prompt, deadline=None):
+        raise TimeoutError("boom")
+
+    monkeypatch.setattr(main.llm, "generate_stream", streamed(_fail))
+    main.roadmap_cache.invalidate()
+    with TestClient(main.app) as c:
+        sid = new_session(region="EU", answers=ALL_YES)
+        job = run_roadmap(c, sid)
+        assert job["source"] == "template"
+        assert job["roadmap"]["90_day"][0]["title"] == "NIS2 Article 21 gap analysis"
+        assert run_roadmap(c, sid)["source"] == "template"
+
+
+def test_template_roadmap_is_instant_and_follows_the_answers(monkeypatch):
+    release = asyncio.Event()
+
+    async def _slow(prompt, deadline=None):
+        await release.wait()
+        return json.dumps(GEMINI_ROADMAP)
+
+    monkeypatch.setattr(main.llm, "generate_stream", streamed(_slow))
+    main.roadmap_cache.invalidate()
+    answers = {**ALL_YES, "id_mfa": {"answer": "no"}, "net_seg": {"answer": "partial"}}
+    with TestClient(main.app) as c:
+        sid = new_session(region="CH", answers=answers)
+        started = time.perf_counter()
+        first = c.post(f"/api/sessions/{sid}/roadmap")
+        assert time.perf_counter() - started < 0.5
+        body = first.json()
+        assert first.status_code == 202 and body["source"] == "template" and body["status"] in ("queued", "running")
+        assert body["roadmap"]["30_day"][0]["title"] == "Enforce MFA for every account"
+        assert body["roadmap"]["60_day"][0]["title"] == "Segment crown-jewel systems"
+        assert body["roadmap"]["90_day"][0]["title"] == "ISG/KISG compliance review"
+        assert all(len(body["roadmap"][h]) == n for h, n in (("30_day", 5), ("60_day", 4), ("90_day", 3)))
+        assert c.get(f"/api/sessions/{sid}/roadmap").json()["source"] == "template"
+        c.portal.call(release.set)
+        assert wait_job(c, body)["source"] == "gemini"
+        assert c.get(f"/api/sessions/{sid}/roadmap").json()["roadmap"] == GEMINI_ROADMAP
+        again = c.post(f"/api/sessions/{sid}/roadmap")
+        assert again.status_code == 200 and again.json()["source"] == "cache"
+    assert main.session_template("UK", {}) == main.session_template("UK", {})
+
+
+def test_roadmap_job_dedup_and_storage(monkeypatch):
+    release = asyncio.Event()
+    calls = []
+
+    async def _slow(prompt, deadline=None):
+        calls.append(prompt)
+        await release.wait()
+        return json.dumps(GEMINI_ROADMAP)
+
+    monkeypatch.setattr(main.llm, "generate_stream", streamed(_slow))
+    main.roadmap_cache.invalidate()
+    with TestClient(main.app) as c:
+        sid = new_session(answers=ALL_YES)
+        first = c.post(f"/api/sessions/{sid}/roadmap")
+        second = c.post(f"/api/sessions/{sid}/roadmap")
+        assert first.status_code == 202
+        assert first.json()["job_id"] == second.json()["job_id"]
+        c.portal.call(release.set)
+        job = wait_job(c, first.json())
+        assert job["status"] == "done"
+        assert c.get(f"/api/sessions/{sid}/roadmap").json()["roadmap"] == GEMINI_ROADMAP
+        events = c.get(f"/api/jobs/{job['job_id']}/events").text
+    assert "event: result" in events
+    assert len(calls) == 1
+
+
+def test_queued_jobs_survive_restart(fake_gemini):
+    sid = new_session(answers=ALL_YES)
+    job = main.roadmap_jobs.enqueue(sid)  # queued while no workers are running
+    assert job["status"] == "queued"
+    with TestClient(main.app) as c:
+        assert wait_job(c, job)["roadmap"] == GEMINI_ROADMAP
+
+
+def test_llm_client_cancels_slow_attempts_and_retries():
+    client_ = GeminiClient(max_retries=3, attempt_timeout=0.05, deadline=5, backoff_base=0.001)
+    attempts = []
+
+    async def _stream(prompt, system, config, usage):
+        attempts.append(prompt)
+        if len(attempts) < 3:
+            await asyncio.sleep(10)
+        yield "ok"
+
+    client_._stream = _stream
+    assert collect(client_) == "ok"
+    assert len(attempts) == 3
+
+
+def test_llm_client_respects_deadline_budget():
+    client_ = GeminiClient(max_retries=5, attempt_timeout=1, deadline=0.1, backoff_base=0.001)
+
+    async def _stream(prompt, system, config, usage):
+        await asyncio.sleep(10)
+        yield "late"
+
+    client_._stream = _stream
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        collect(client_)
+    assert time.monotonic() - started < 1
+
+
+def test_singleflight_coalesces_identical_answers(monkeypatch):
+    release = asyncio.Event()
+    calls = []
+
+    async def _slow(prompt, deadline=None):
+        calls.append(prompt)
+        await release.wait()
+        return json.dumps(GEMINI_ROADMAP)
+
+    monkeypatch.setattr(main.llm, "generate_stream", streamed(_slow))
+    main.roadmap_cache.invalidate()
+    before = main.roadmap_flight.stats()["coalesced"]
+    with TestClient(main.app) as c:
+        jobs = [c.post(f"/api/sessions/{new_session(answers=ALL_YES)}/roadmap").json() for _ in range(3)]
+        deadline = time.monotonic() + 5
+        while main.roadmap_flight.stats()["coalesced"] - before < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        c.portal.call(release.set)
+        results = [wait_job(c, j) for j in jobs]
+    assert all(r["roadmap"] == GEMINI_ROADMAP for r in results)
+    assert len(calls) == 1
+    assert main.roadmap_flight.stats()["coalesced"] - before == 2
+
+
+def test_singleflight_waits_for_remote_lease():
+    flight = SingleFlight(main.db_pool, poll_interval=0.01)
+    assert flight._acquire("remote-key", "other-process")
+    published = {}
+
+    def _remote_finishes():
+        time.sleep(0.05)
+        published["v"] = "from-other-process"
+        flight._release("remote-key", "other-process")
+
+    async def _recompute():
+        return "recomputed"
+
+    threading.Thread(target=_remote_finishes).start()
+    result = asyncio.run(flight.do("remote-key", _recompute, lookup=lambda: published.get("v")))
+    assert result == "from-other-process"
+    assert flight.stats()["remote_waits"] == 1
+
+
+def test_pool_uses_wal_and_survives_concurrent_writers(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=4)
+    pool.executescript("CREATE TABLE t (n INTEGER)")
+    with pool.connection() as con:
+        assert con.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    def _writer():
+        for i in range(50):
+            with pool.connection(write=True) as con:
+                con.execute("INSERT INTO t VALUES (?)", (i,))
+
+    threads = [threading.Thread(target=_writer) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with pool.connection() as con:
+        assert con.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 400
+    assert pool.stats()["opened"] <= 4
+    pool.close()
+
+
+def test_pool_rolls_back_failed_writes(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.db"), size=1)
+    pool.executescript("CREATE TABLE t (n INTEGER)")
+    with pytest.raises(RuntimeError):
+        with pool.connection(write=True) as con:
+            con.execute("INSERT INTO t VALUES (1)")
+            raise RuntimeError("abort")
+    with pool.connection() as con:
+        assert con.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+
+
+def test_sqlite_statements_translate_to_postgres():
+    keys = {"roadmaps": ["session_id"], "answers": ["session_id", "question_id"]}.get
+    assert translate("SELECT * FROM t WHERE a=? AND b LIKE 'x%?'", keys) == "SELECT * FROM t WHERE a=%s AND b LIKE 'x%%?'"
+    assert translate("INSERT OR REPLACE INTO roadmaps (session_id, job_id, roadmap) VALUES (?,?,?)", keys) == (
+        "INSERT INTO roadmaps (session_id, job_id, roadmap) VALUES (%s,%s,%s) "
+        "ON CONFLICT (session_id) DO UPDATE SET job_id = EXCLUDED.job_id, roadmap = EXCLUDED.roadmap")
+    assert translate("INSERT OR IGNORE INTO answers (session_id, question_id) VALUES (?,?)", keys).endswith("ON CONFLICT  DO NOTHING")
+    assert "BIGSERIAL PRIMARY KEY" in translate("CREATE TABLE e (id INTEGER PRIMARY KEY AUTOINCREMENT, at REAL, b BLOB)", keys)
+    assert translate("PRAGMA optimize", keys) == "SELECT NULL WHERE FALSE"
+
+
+def test_roadmap_cache_invalidation_reaches_other_processes():
+    a = RoadmapCache(main.db_pool, sync_interval=0)
+    b = RoadmapCache(main.db_pool, sync_interval=0)
+    a.put("shared-key", "CH", GEMINI_ROADMAP)
+    assert b.get("shared-key") == GEMINI_ROADMAP  # now also in b's in-process LRU
+    a.invalidate(key="shared-key")
+    assert b.get("shared-key") is None
+
+
+def test_expired_job_leases_are_taken_over(tmp_path):
+    from migrations import migrate
+    pool = ConnectionPool(str(tmp_path / "jobs.db"), size=2)
+    migrate(pool)
+    queue = RoadmapJobQueue(pool, handler=None, lease_ttl=30)
+    now = time.time()
+    with pool.connection(write=True) as con:
+        con.executemany(
+            "INSERT INTO roadmap_jobs (id, session_id, status, created_at, updated_at, lease_owner, lease_expires_at) VALUES (?,?,?,?,?,?,?)",
+            [("alive", "s1", "running", now - 2, now, "node-b:1", now + 30),
+             ("orphan", "s2", "running", now - 1, now, "node-c:1", now - 1)],
+        )
+    assert queue._claim_next() == ("orphan", "s2")
+    assert queue._claim_next() is None
+    with pool.connection() as con:
+        rows = {r["id"]: r for r in con.execute("SELECT id, lease_owner, attempts FROM roadmap_jobs")}
+    assert rows["orphan"]["lease_owner"] == queue.owner and rows["orphan"]["attempts"] == 1
+    assert rows["alive"]["lease_owner"] == "node-b:1"
+
+    # Progress renews the lease; a worker whose lease was taken over can neither report nor finish.
+    stale = RoadmapJobQueue(pool, handler=None)
+    stale.owner = "node-c:1"
+    assert not stale._progress("orphan", {"30_day": []}) and not stale._finish("orphan", "s2", roadmap={}, source="gemini")
+    with pool.connection(write=True) as con:
+        con.execute("UPDATE roadmap_jobs SET lease_expires_at=? WHERE id='orphan'", (now + 1,))
+    assert queue._progress("orphan", {"30_day": []})
+    with pool.connection() as con:
+        assert con.execute("SELECT lease_expires_at FROM roadmap_jobs WHERE id='orphan'").fetchone()[0] > now + 25
+        assert con.execute("SELECT COUNT(*) FROM roadmaps").fetchone()[0] == 0
+    assert queue._finish("orphan", "s2", roadmap={"30_day": []}, source="gemini")
+    assert queue.get("orphan")["status"] == "done"
+    pool.close()
+
+
+def test_roadmap_worker_survives_database_errors(fake_gemini, monkeypatch):
+    real_claim, failures = main.roadmap_jobs._claim_next, []
+
+    def _flaky_claim():
+        if not failures:
+            failures.append(1)
+            raise PoolTimeout("pool exhausted")
+        return real_claim()
+
+    monkeypatch.setattr(main.roadmap_jobs, "_claim_next", _flaky_claim)
+    monkeypatch.setattr(main.roadmap_jobs, "concurrency", 1)
+    monkeypatch.setattr(main.roadmap_jobs, "poll_interval", 0.05)
+    with TestClient(main.app) as c:
+        job = run_roadmap(c, new_session(region="EU", answers={"id_mfa": {"answer": "no", "note": "worker test"}}))
+    assert failures and job["status"] == "done" and job["source"] == "gemini"
+
+
+@pytest.mark.skipif(not os.environ.get("ZTC_TEST_DATABASE_URL"), reason="set ZTC_TEST_DATABASE_URL=postgresql://... to run")
+def test_postgres_pool_key_locks_serialize_read_modify_write():
+    pool = open_pool(os.environ["ZTC_TEST_DATABASE_URL"], size=4)
+    pool.executescript("DROP TABLE IF EXISTS pool_test; CREATE TABLE pool_test (k TEXT PRIMARY KEY, n INTEGER)")
+    with pool.connection(write=True) as con:
+        con.execute("INSERT OR REPLACE INTO pool_test (k, n) VALUES (?,?)", ("c", 0))
+
+    def _writer():
+        for _ in range(25):
+            with pool.connection(write=True) as con:
+                pool.lock(con, "pool_test:c")
+                n = con.execute("SELECT n FROM pool_test WHERE k=?", ("c",)).fetchone()["n"]
+                con.execute("INSERT OR REPLACE INTO pool_test (k, n) VALUES (?,?)", ("c", n + 1))
+
+    threads = [threading.Thread(target=_writer) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    with pool.connection() as con:
+        assert con.execute("SELECT n FROM pool_test WHERE k=?", ("c",)).fetchone()[0] == 100
+
+    # A writer on another key is not held up by an open transaction holding "c".
+    done = threading.Event()
+
+    def _other():
+        with pool.connection(write=True) as con:
+            pool.lock(con, "pool_test:d")
+            con.execute("INSERT OR REPLACE INTO pool_test (k, n) VALUES (?,?)", ("d", 1))
+        done.set()
+
+    with pool.connection(write=True) as con:
+        pool.lock(con, "pool_test:c")
+        other = threading.Thread(target=_other)
+        other.start()
+        assert done.wait(5)
+    other.join()
+    assert pool.stats()["backend"] == "postgres"
+    pool.executescript("DROP TABLE pool_test")
+    pool.close()
+
+
+def test_answers_normalized_with_precomputed_scores():
+    answers = {"id_mfa": {"answer": "yes", "note": "Entra ID"}, "dev_mdm": {"answer": "partial"}}
+    sid = new_session(answers=answers)
+    assert client.get(f"/api/sessions/{sid}").json()["answers"] == answers
+    with main.get_db() as db:
+        row = db.execute("SELECT * FROM sessions WHERE id=?", (sid,)).fetchone()
+        stored = db.execute("SELECT question_id, answer, note FROM answers WHERE session_id=? ORDER BY question_id", (sid,)).fetchall()
+    assert row["answers_normalized"] == 1 and row["answers"] is None
+    assert [tuple(r) for r in stored] == [("dev_mdm", "partial", None), ("id_mfa", "yes", "Entra ID")]
+    assert main.stored_scores(row) == main.compute_scores(answers)
+    assert row["overall_score"] == client.get(f"/api/sessions/{sid}/dashboard").json()["overall_score"]
+
+
+def test_legacy_blob_rows_are_backfilled():
+    answers = {q["id"]: {"answer": "partial"} for q in main.catalogue.current.questions}
+    with main.get_db(write=True) as db:
+        db.execute("INSERT INTO sessions (id, region, answers) VALUES (?,?,?)", ("legacy-1", "CH", json.dumps(answers)))
+    before = client.get("/api/sessions/legacy-1/dashboard").json()
+    assert before["pillar_scores"]["Data"] == {"score": 50, "level": "Initial"}
+    assert main.backfill_answers() >= 1
+    assert client.get("/api/sessions/legacy-1/dashboard").json() == before
+    assert client.get("/api/sessions/legacy-1").json()["answers"] == answers
+
+
+def test_migrations_are_versioned_and_idempotent():
+    from migrations import MIGRATIONS, migrate
+    assert migrate(main.db_pool) == []
+    with main.get_db() as db:
+        versions = [r[0] for r in db.execute("SELECT version FROM schema_migrations ORDER BY version")]
+    assert versions == [m[0] for m in MIGRATIONS]
+
+
+def test_dashboard_snapshot_etag_and_304():
+    sid = new_session(answers=ALL_YES)
+    first = client.get(f"/api/sessions/{sid}/dashboard")
+    etag = first.headers["etag"]
+    assert first.json()["overall_score"] == 100
+    assert client.get(f"/api/sessions/{sid}/dashboard", headers={"If-None-Match": etag}).status_code == 304
+    client.post(f"/api/sessions/{sid}/answers", json={"session_id": sid, "answers": {}})
+    changed = client.get(f"/api/sessions/{sid}/dashboard", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()["overall_score"] == 10
+
+
+def test_dashboard_snapshot_matches_live_render():
+    answers = {"id_mfa": {"answer": "partial"}, "net_seg": {"answer": "no"}, "dat_bkp": {"answer": "yes"}}
+    sid = new_session(region="UK", answers=answers)
+    expected = main.build_dashboard(sid, "UK", main.compute_scores(answers))
+    assert client.get(f"/api/sessions/{sid}/dashboard").content == main.encode_json(expected)
+
+
+def test_portfolio_dashboards_batch_matrix_pages_and_deltas():
+    answers = [ALL_YES, {"id_mfa": {"answer": "partial"}, "net_seg": {"answer": "no"}}, {}]
+    sids = [new_session(region=r, answers=a) for r, a in zip(("CH", "UK", "EU"), answers)]
+    r = client.post("/api/portfolios", json={"name": "Acme MSSP", "session_ids": sids + ["nope"]}).json()
+    pid = r["portfolio_id"]
+    assert (r["sessions"], r["unknown"]) == (3, ["nope"])
+
+    batch = client.post("/api/dashboards:batch", json={"portfolio_id": pid}).json()
+    assert batch["session_ids"] == sorted(sids) and batch["next_cursor"] is None and batch["pillars"] == main.PILLARS
+    for j, sid in enumerate(batch["session_ids"]):
+        dash = client.get(f"/api/sessions/{sid}/dashboard").json()
+        assert batch["overall"][j] == dash["overall_score"] and batch["regions"][j] == dash["region"]
+        for i, pillar in enumerate(batch["pillars"]):
+            assert batch["scores"][i][j] == dash["pillar_scores"][pillar]["score"]
+            assert batch["levels_legend"][batch["levels"][i][j]] == dash["pillar_scores"][pillar]["level"]
+
+    first = client.post("/api/dashboards:batch", json={"session_ids": sids + ["nope"], "limit": 2}).json()
+    rest = client.post("/api/dashboards:batch", json={"session_ids": sids + ["nope"], "limit": 2, "cursor": first["next_cursor"]}).json()
+    assert first["session_ids"] + rest["session_ids"] == sorted(sids)
+    assert rest["missing"] == ["nope"] and rest["next_cursor"] is None
+
+    # Delta sync: only sessions whose revision moved past what the client holds come back.
+    known = dict(zip(batch["session_ids"], batch["revisions"]))
+    client.patch(f"/api/sessions/{sids[2]}/answers/id_mfa", json={"answer": "yes"})
+    delta = client.post("/api/dashboards:batch", json={"portfolio_id": pid, "since": known}).json()
+    assert delta["session_ids"] == [sids[2]] and delta["unchanged"] == 2 and len(delta["scores"][0]) == 1
+
+    assert client.delete(f"/api/portfolios/{pid}/sessions/{sids[0]}").json()["ok"]
+    assert client.get(f"/api/portfolios/{pid}").json()["sessions"] == 2
+    assert client.post("/api/dashboards:batch", json={"portfolio_id": "nope"}).status_code == 404
+    assert client.post("/api/dashboards:batch", json={"session_ids": [], "portfolio_id": pid}).status_code == 400
+
+
+def test_batch_scoring_is_identical_to_compute_scores():
+    import random
+    rng = random.Random(7)
+    choices = ["yes", "partial", "no", "unknown", "YES", "Partial", "n/a", None]
+    sessions = []
+    for i in range(500):
+        answers = {}
+        for q in main.catalogue.current.questions:
+            pick = rng.choice(choices)
+            if pick is not None:
+                answers[q["id"]] = {"answer": pick}
+        sessions.append({"session_id": str(i), "answers": answers})
+    for s, r in zip(sessions, score_sessions(main.scoring_model(), sessions, chunk_size=64)):
+        expected = main.compute_scores(s["answers"])
+        assert r["pillar_scores"] == expected
+        assert r["overall_score"] == main.overall_score(expected)
+
+
+def test_batch_score_endpoint_csv_and_json(monkeypatch):
+    monkeypatch.setattr(main, "BATCH_CHUNK", 2)  # several chunks per request
+    header = "session_id," + ",".join(q["id"] for q in main.catalogue.current.questions)
+    csv_body = "\n".join([header, "a," + ",".join(["yes"] * 10), ",yes", "b," + ",".join(["no"] * 10), "d," + ",".join(["yes"] * 11)])
+    res = client.post("/api/batch/score", content=csv_body, headers={"Content-Type": "text/csv"})
+    rows = [json.loads(line) for line in res.text.splitlines()]
+    assert [(r["session_id"], r.get("overall_score")) for r in rows] == [("a", 100), (None, None), ("b", 0), ("d", None)]
+    assert rows[1] == {"row": 2, "session_id": None, "error": "session_id is empty"} and rows[3]["row"] == 4
+
+    # A quoted field may hold newlines, even across body chunks.
+    from batch_scoring import CsvReader
+    quoted = f'{header}\r\n"q\nr",yes,"multi\r\nline ""note"""\nz,no\n'
+    reader = CsvReader()
+    records = [r for i in range(0, len(quoted), 7) for r in reader.feed(quoted[i:i + 7])] + reader.close()
+    assert records == ['"q\nr",yes,"multi\r\nline ""note"""', "z,no"]
+    res = client.post("/api/batch/score", content=(quoted[i:i + 5].encode() for i in range(0, len(quoted), 5)),
+                      headers={"Content-Type": "text/csv"})
+    rows = [json.loads(line) for line in res.text.splitlines()]
+    assert [r["session_id"] for r in rows] == ["q\nr", "z"] and all("overall_score" in r for r in rows)
+
+    # One bad row gets an error record in its place; the rest are still scored.
+    sessions = [{"session_id": "c", "answers": ALL_YES}, {"session_id": "e", "answers": {"id_mfa": "yes"}}, {"session_id": "f"}]
+    rows = [json.loads(line) for line in client.post("/api/batch/score", json={"sessions": sessions}).text.splitlines()]
+    assert rows[0]["pillar_scores"]["Data"] == {"score": 100, "level": "Optimal"}
+    assert rows[1]["row"] == 2 and rows[1]["session_id"] == "e" and "answers" in rows[1]["error"]
+    assert rows[2]["session_id"] == "f" and rows[2]["overall_score"] == main.overall_score(main.compute_scores({}))
+
+    # A body that breaks off after scored rows ends with a trailing error record instead of a 500.
+    cut = json.dumps({"sessions": sessions})[:-20]
+    rows = [json.loads(line) for line in client.post("/api/batch/score", content=cut).text.splitlines()]
+    assert [r.get("session_id") for r in rows[:2]] == ["c", "e"] and set(rows[-1]) == {"error"}
+    assert client.post("/api/batch/score", content="x,y", headers={"Content-Type": "text/csv"}).status_code == 400
+    assert client.post("/api/batch/score", json={"rows": []}).status_code == 400
+    assert client.post("/api/batch/score", content='{"sessions": [{"session_id": ').status_code == 400
+
+
+def test_export_streams_all_pages_with_filters(monkeypatch):
+    ids = {new_session(region="EXP", answers=ALL_YES) for _ in range(5)}
+    legacy = {q["id"]: {"answer": "no"} for q in main.catalogue.current.questions}
+    with main.get_db(write=True) as db:
+        db.execute("INSERT INTO sessions (id, region, answers) VALUES (?,?,?)", ("legacy-exp", "EXP", json.dumps(legacy)))
+    records = list(main.exporter.iter_sessions(region="exp", page_size=2))
+    assert {r["session_id"] for r in records} == ids | {"legacy-exp"}
+    by_id = {r["session_id"]: r for r in records}
+    assert by_id["legacy-exp"]["overall_score"] == 0
+    assert by_id[next(iter(ids))]["answers"] == ALL_YES
+
+    assert client.get("/api/export/sessions").status_code == 401
+    assert client.get("/api/export/sessions", headers={"Authorization": "Bearer wrong"}).status_code == 403
+    res = client.get("/api/export/sessions", params={"region": "EXP", "format": "csv"}, headers=ADMIN)
+    lines = res.text.strip().splitlines()
+    assert lines[0].startswith("session_id,region,created_at,overall_score,identity_score")
+    assert len(lines) == 7
+    assert client.get("/api/export/sessions", params={"region": "EXP", "created_from": "2999-01-01"}, headers=ADMIN).text == ""
+
+
+def test_benchmark_rollups_track_resubmissions():
+    region = "BMK"
+    yes = new_session(region=region, answers=ALL_YES)
+    no = new_session(region=region, answers={q["id"]: {"answer": "no"} for q in main.catalogue.current.questions})
+    new_session(region=region)  # never answered: not a completed assessment
+    partial = new_session(region=region, answers={"id_mfa": {"answer": "no"}})  # abandoned part-way: not either
+    body = client.get(f"/api/benchmarks/{region}", params={"session_id": yes}).json()
+    identity = body["pillars"]["Identity"]
+    assert identity["count"] == 2
+    assert identity["mean"] == 50.0
+    assert identity["percentiles"]["p50"] == 0 and identity["percentiles"]["p90"] == 100
+    assert identity["your_percentile"] == 75.0
+    assert body["pillars"]["Overall"]["count"] == 2
+
+    client.post(f"/api/sessions/{no}/answers", json={"session_id": no, "answers": ALL_YES})
+    identity = client.get(f"/api/benchmarks/{region}").json()["pillars"]["Identity"]
+    assert identity["count"] == 2 and identity["mean"] == 100.0
+
+    # Answering the last question completes the scan and it starts counting.
+    rest = [q["id"] for q in main.catalogue.current.questions if q["id"] != "id_mfa"]
+    client.patch(f"/api/sessions/{partial}/answers", json={"answers": {qid: {"answer": "no"} for qid in rest[:-1]}})
+    assert client.get(f"/api/benchmarks/{region}").json()["pillars"]["Identity"]["count"] == 2
+    client.patch(f"/api/sessions/{partial}/answers", json={"answers": {rest[-1]: {"answer": "no"}}})
+    assert client.get(f"/api/benchmarks/{region}").json()["pillars"]["Identity"]["count"] == 3
+
+    before = client.get(f"/api/benchmarks/{region}").json()
+    main.benchmarks.rebuild(main.PILLAR_COLUMNS, [q["id"] for q in main.catalogue.current.questions])
+    assert client.get(f"/api/benchmarks/{region}").json() == before
+
+
+def test_patch_answers_rescores_incrementally_like_a_full_submit():
+    region = "PAT"
+    sid = new_session(region=region)
+    full = new_session(region=region)
+    qs = main.catalogue.current.questions
+    revision = client.get(f"/api/sessions/{sid}").json()["revision"]
+    r = client.patch(f"/api/sessions/{sid}/answers/{qs[0]['id']}", json={"answer": "yes", "note": "Entra ID", "revision": revision})
+    assert r.status_code == 200 and r.json()["revision"] == revision + 1
+    delta = {q["id"]: {"answer": "partial"} for q in qs[1:] if q["pillar"] in ("Identity", "Data")}
+    r = client.patch(f"/api/sessions/{sid}/answers", json={"answers": delta, "revision": revision + 1})
+    assert r.json()["revision"] == revision + 2
+
+    expected = {qs[0]["id"]: {"answer": "yes", "note": "Entra ID"}, **delta}
+    client.post(f"/api/sessions/{full}/answers", json={"session_id": full, "answers": expected})
+    assert client.get(f"/api/sessions/{sid}").json()["answers"] == expected
+    patched = client.get(f"/api/sessions/{sid}/dashboard").json()
+    posted = client.get(f"/api/sessions/{full}/dashboard").json()
+    assert {k: v for k, v in patched.items() if k != "session_id"} == {k: v for k, v in posted.items() if k != "session_id"}
+    assert client.get(f"/api/benchmarks/{region}").json()["pillars"]["Identity"]["count"] == 0  # neither is finished
+    rest = {q["id"]: {"answer": "no"} for q in qs[1:] if q["id"] not in delta}
+    for session_id in (sid, full):
+        client.patch(f"/api/sessions/{session_id}/answers", json={"answers": rest})
+    identity = client.get(f"/api/benchmarks/{region}").json()["pillars"]["Identity"]
+    assert identity["count"] == 2 and identity["percentiles"]["p25"] == identity["percentiles"]["p90"]
+
+    client.patch(f"/api/sessions/{sid}/answers/{qs[0]['id']}", json={"note": "Okta"})  # note only
+    assert client.get(f"/api/sessions/{sid}").json()["answers"][qs[0]["id"]] == {"answer": "yes", "note": "Okta"}
+    client.patch(f"/api/sessions/{sid}/answers", json={"answers": {qs[0]["id"]: {"answer": "no"}}})
+    assert client.get(f"/api/sessions/{sid}").json()["answers"][qs[0]["id"]] == {"answer": "no", "note": "Okta"}
+    client.patch(f"/api/sessions/{sid}/answers/{qs[0]['id']}", json={"answer": None, "note": None})  # clear
+    assert qs[0]["id"] not in client.get(f"/api/sessions/{sid}").json()["answers"]
+
+
+def test_submit_answers_accepts_bare_strings_and_rejects_non_strings():
+    sid = new_session()
+    qs = main.catalogue.current.questions
+    answers = {qs[0]["id"]: "yes", qs[1]["id"]: {"answer": None}, qs[2]["id"]: {"answer": None, "note": "later"}}
+    r = client.post(f"/api/sessions/{sid}/answers", json={"session_id": sid, "answers": answers})
+    assert r.status_code == 200
+    assert client.get(f"/api/sessions/{sid}").json()["answers"] == {qs[0]["id"]: {"answer": "yes"}, qs[2]["id"]: {"note": "later"}}
+    expected = main.compute_scores({qs[0]["id"]: {"answer": "yes"}})
+    assert client.get(f"/api/sessions/{sid}/dashboard").json()["pillar_scores"] == expected
+    for bad in (3, None, {"answer": 3}, ["yes"]):
+        r = client.post(f"/api/sessions/{sid}/answers", json={"session_id": sid, "answers": {qs[0]["id"]: bad}})
+        assert r.status_code == 422
+
+
+def test_patch_answers_rejects_stale_revisions_and_unknown_questions():
+    sid = new_session()
+    qid = main.catalogue.current.questions[0]["id"]
+    revision = client.get(f"/api/sessions/{sid}").json()["revision"]
+    assert client.patch(f"/api/sessions/{sid}/answers/{qid}", json={"answer": "yes", "revision": revision}).status_code == 200
+    stale = client.patch(f"/api/sessions/{sid}/answers/{qid}", json={"answer": "no", "revision": revision})
+    assert stale.status_code == 409 and stale.json()["detail"]["revision"] == revision + 1
+    assert client.get(f"/api/sessions/{sid}").json()["answers"][qid] == {"answer": "yes"}
+    assert client.post(f"/api/sessions/{sid}/answers", json={"session_id": sid, "answers": {}, "revision": revision}).status_code == 409
+    assert client.patch(f"/api/sessions/{sid}/answers/nope", json={"answer": "yes"}).status_code == 404
+    assert client.patch(f"/api/sessions/{sid}/answers", json={"answers": {"nope": {"answer": "yes"}}}).status_code == 422
+    assert client.patch("/api/sessions/missing/answers", json={"answers": {qid: "yes"}}).status_code == 404
+
+
+def test_static_content_is_preencoded_with_etags():
+    import gzip
+    plain = client.get("/api/playbooks/pb_mfa", headers={"Accept-Encoding": "identity"})
+    assert plain.json() == next(p for p in main.catalogue.current.playbooks if p["id"] == "pb_mfa")
+    assert plain.headers["cache-control"].startswith("public, max-age=")
+    assert client.get("/api/playbooks/pb_mfa", headers={"Accept-Encoding": "identity", "If-None-Match": plain.headers["etag"]}).status_code == 304
+
+    zipped = client.get("/api/regions/ch", headers={"Accept-Encoding": "gzip"})
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert zipped.json() == main.catalogue.current.region_overlays["CH"]
+    plain_etag = client.get("/api/regions/ch", headers={"Accept-Encoding": "identity"}).headers["etag"]
+    assert zipped.headers["etag"] != plain_etag
+    weak = {"Accept-Encoding": "gzip", "If-None-Match": f'W/{zipped.headers["etag"]}'}
+    assert client.get("/api/regions/ch", headers=weak).status_code == 304
+    refused = client.get("/api/regions/ch", headers={"Accept-Encoding": "gzip;q=0, identity"})
+    assert "content-encoding" not in refused.headers and refused.headers["etag"] == plain_etag
+    assert client.get("/api/regions/ch", headers={"Accept-Encoding": "*;q=0.5, br;q=0"}).headers["content-encoding"] == "gzip"
+
+    assert [p["id"] for p in client.get("/api/playbooks").json()] == [p["id"] for p in main.catalogue.current.playbooks]
+    assert client.get("/api/playbooks/nope").status_code == 404
+    assert client.get("/api/regions/XX").status_code == 404
+
+
+def test_catalogue_hot_reload_and_session_version(tmp_path, monkeypatch):
+    original = main.catalogue.current
+    data = json.loads(original.source)
+    data["version"] = "test.2"
+    data["questions"][0]["text"] = "Is phishing-resistant MFA enforced for all users?"
+    path = tmp_path / "catalogue.json"
+    path.write_text(json.dumps(data))
+    monkeypatch.setattr(main.catalogue, "path", str(path))
+    try:
+        assert client.post("/api/catalogue/reload", headers=ADMIN).json() == {"ok": True, "reloaded": True, "version": "test.2"}
+        created = client.post("/api/sessions", json={"region": "CH"}).json()
+        assert created["catalogue_version"] == "test.2"
+        assert created["questions"][0]["text"].startswith("Is phishing-resistant")
+        assert client.get(f"/api/sessions/{created['session_id']}").json()["catalogue_version"] == "test.2"
+
+        # An invalid file is rejected and the live catalogue keeps serving.
+        data["version"] = "test.3"
+        data["questions"][1]["pillar"] = "Cloud"
+        path.write_text(json.dumps(data))
+        assert client.post("/api/catalogue/reload", headers=ADMIN).status_code == 422
+        assert not main.catalogue.reload_if_changed()
+        assert client.get("/api/catalogue").json()["version"] == "test.2"
+        assert client.post("/api/catalogue/reload").status_code == 401
+
+        # Structurally malformed files are rejected the same way, not with a crash.
+        for key, value in (("score_map", ["yes", 100]), ("questions", ["not a question"])):
+            path.write_text(json.dumps({**data, "questions": data["questions"], key: value}))
+            r = client.post("/api/catalogue/reload", headers=ADMIN)
+            assert r.status_code == 422 and key in r.json()["detail"]
+            assert not main.catalogue.reload_if_changed()
+
+        # A listener that fails leaves the live catalogue and everything derived from it in place.
+        data["questions"][1]["pillar"] = original.questions[1]["pillar"]
+        path.write_text(json.dumps(data))
+        seen = []
+
+        def _failing(cat):
+            seen.append(cat.version)
+            if cat.version == "test.3":
+                raise RuntimeError("listener down")
+        main.catalogue._listeners.append(_failing)
+        try:
+            assert client.post("/api/catalogue/reload", headers=ADMIN).status_code == 422
+        finally:
+            main.catalogue._listeners.remove(_failing)
+        assert seen == ["test.3", "test.2"] and main.catalogue.current.version == "test.2"
+        assert main.content.version == "test.2"
+
+        archived = client.get(f"/api/catalogue/versions/{original.version}").json()
+        assert archived["digest"] == original.digest
+        assert archived["catalogue"]["questions"][0]["text"] == original.questions[0]["text"]
+    finally:
+        monkeypatch.undo()
+        main.catalogue.load()
+    assert main.catalogue.current.version == original.version
+
+
+def test_metrics_endpoint_exposes_route_db_and_llm_metrics(monkeypatch):
+    import llm_client
+    from metrics import Registry
+
+    timeouts = llm_client.LLM_ATTEMPTS.value("timeout")
+    client_ = GeminiClient(max_retries=2, attempt_timeout=0.01, deadline=5, backoff_base=0.001)
+
+    async def _stream(prompt, system, config, usage):
+        await asyncio.sleep(10)
+        yield "late"
+
+    client_._stream = _stream
+    with pytest.raises(LLMDeadlineExceeded):
+        collect(client_)
+    assert llm_client.LLM_ATTEMPTS.value("timeout") == timeouts + 2
+
+    async def _fail(prompt, deadline=None):
+        raise TimeoutError("boom")
+
+    monkeypatch.setattr(main.llm, "generate_stream", streamed(_fail))
+    main.roadmap_cache.invalidate()
+    templates = main.ROADMAP_RESULTS.value("template")
+    with TestClient(main.app) as c:
+        assert run_roadmap(c, new_session(answers=ALL_YES))["source"] == "template"
+    assert main.ROADMAP_RESULTS.value("template") == templates + 2  # served instantly, then again when Gemini failed
+
+    sid = new_session(answers=ALL_YES)
+    client.get(f"/api/sessions/{sid}/dashboard")
+    body = client.get("/api/metrics")
+    assert body.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = body.text
+    assert 'ztc_http_request_duration_seconds_count{method="GET",route="/api/sessions/{session_id}/dashboard",status="200"}' in text
+    assert 'ztc_http_requests_in_flight{method="GET",route="/api/metrics"} 1' in text
+    assert 'ztc_db_query_seconds_bucket{statement="SELECT",le="+Inf"}' in text
+    assert 'ztc_llm_attempts_total{outcome="timeout"}' in text
+    assert "ztc_roadmap_results_total{source=\"template\"}" in text
+
+    # Shards written from many threads add up exactly.
+    reg = Registry()
+    hist = reg.histogram("h", "test", ("k",), buckets=(1, 2))
+    workers = [threading.Thread(target=lambda: [hist.observe(1.5, "a") for _ in range(1000)]) for _ in range(8)]
+    [w.start() for w in workers]
+    [w.join() for w in workers]
+    assert hist.count("a") == 8000
+    assert 'h_bucket{k="a",le="1"} 0\nh_bucket{k="a",le="2"} 8000' in reg.render()
+
+
+def test_profiler_is_opt_in(monkeypatch):
+    assert client.get("/api/debug/profile", params={"seconds": 0.1}, headers=ADMIN).status_code == 404
+    monkeypatch.setattr(main, "PROFILER_ENABLED", True)
+    assert client.get("/api/debug/profile", params={"seconds": 0.1}).status_code == 401
+    folded = client.get("/api/debug/profile", params={"seconds": 0.2}, headers=ADMIN).text
+    assert folded and all(line.rsplit(" ", 1)[1].isdigit() for line in folded.splitlines())
+
+
+def test_prompt_is_static_system_plus_compact_delta():
+    from prompts import PromptBuilder, estimate_tokens
+    cat = main.catalogue.current
+    builder = PromptBuilder(budget=400, note_chars=160)
+    answers = {q["id"]: {"answer": "no", "note": "Legacy VPN appliance, " * 20} for q in cat.questions}
+    scores = main.compute_scores(answers, cat)
+    draft = main.template_roadmap("EU", answers, {p: 0 for p in scores}, cat)
+
+    # The system prompt is built once per catalogue version and carries the legend, not the session.
+    assert builder.system(cat) is builder.system(cat)
+    assert cat.questions[0]["text"] in builder.system(cat) and "Legacy VPN" not in builder.system(cat)
+
+    roomy, roomy_tokens = PromptBuilder(budget=10_000).user("EU", answers, scores, cat, draft)
+    assert f"{cat.questions[0]['id']}=N" in roomy and "draft:" in roomy and cat.questions[0]["text"] not in roomy
+    assert roomy_tokens == estimate_tokens(roomy)
+
+    # Over budget: notes shrink, then go, then the draft goes.
+    prompt, tokens = builder.user("EU", answers, scores, cat, draft)
+    assert tokens <= 400 < roomy_tokens and "Legacy VPN appliance, " * 7 not in prompt and "…" in prompt
+    bare, _ = PromptBuilder(budget=1).user("EU", answers, scores, cat, draft)
+    assert "notes:" not in bare and "draft:" not in bare and "answers:" in bare
+
+
+def test_roadmap_records_provider_token_usage(monkeypatch):
+    import httpx
+    from fake_gemini import create_app
+
+    fake = create_app(latency=0, seed=3)
+    monkeypatch.setattr(main, "llm", GeminiClient(endpoint="http://fake-gemini", api_key="k", http_transport=httpx.ASGITransport(app=fake)))
+    main.roadmap_cache.invalidate()
+    since = time.time()
+    for i in range(2):
+        answers = {**ALL_YES, next(iter(ALL_YES)): {"answer": "yes", "note": f"usage run {i} {since}"}}
+        roadmap, source = asyncio.run(main.build_roadmap(new_session(answers=answers)))
+        assert source == "gemini" and len(roadmap["30_day"]) == 5
+
+    usage = client.get("/api/llm/usage", params={"since": since}).json()
+    stats = usage["versions"][main.PROMPT_VERSION]
+    assert stats["calls"] == 2 and stats["input_tokens"] > usage["system_prompt_tokens"] and stats["output_tokens"] > 0
+    # The stand-in caches a repeated system instruction, like the provider's implicit context cache.
+    assert abs(stats["cached_tokens"] - usage["system_prompt_tokens"] / 2) <= 1
+    assert 'ztc_llm_tokens_total{kind="cached"}' in client.get("/api/metrics").text
+
+
+def test_admission_control(monkeypatch):
+    from admission import RateLimiter, CircuitBreaker, CircuitOpenError
+
+    bucket = RateLimiter(rate=1, burst=2)
+    assert [bucket.hit("a", now=0), bucket.hit("a", now=0), bucket.hit("a", now=0)] == [0, 0, 1.0]
+    assert bucket.hit("b", now=0) == 0 and bucket.hit("a", now=1.5) == 0
+
+    monkeypatch.setattr(main, "ip_limiter", RateLimiter(rate=0.01, burst=1))
+    assert client.post("/api/sessions", json={"region": "CH"}).status_code == 200
+    r = client.post("/api/sessions", json={"region": "CH"})
+    assert r.status_code == 429 and int(r.headers["Retry-After"]) >= 99
+    assert client.post("/api/batch/score", json={"sessions": []}).status_code == 429
+    monkeypatch.setattr(main, "ip_limiter", RateLimiter(rate=0, burst=1))
+
+    sid = new_session(answers=ALL_YES)
+    monkeypatch.setattr(main, "roadmap_limiter", RateLimiter(rate=0.01, burst=1))
+    monkeypatch.setattr(main.roadmap_jobs, "enqueue", lambda session_id: {"job_id": "j", "status": "queued"})
+    main.roadmap_cache.invalidate()
+    assert client.post(f"/api/sessions/{sid}/roadmap").status_code == 202
+    assert client.post(f"/api/sessions/{sid}/roadmap").status_code == 429
+    monkeypatch.setattr(main, "roadmap_limiter", RateLimiter(rate=0, burst=1))
+
+    # A full queue sheds only the refinement: the template still comes back. So does an open circuit.
+    monkeypatch.setattr(main.roadmap_jobs, "depth", lambda: main.ROADMAP_MAX_QUEUE)
+    r = client.post(f"/api/sessions/{sid}/roadmap")
+    assert r.status_code == 200 and r.headers["Retry-After"] == str(main.ROADMAP_SHED_RETRY_AFTER)
+    assert r.json()["source"] == "template" and r.json()["status"] == "done" and r.json()["roadmap"]["30_day"]
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    monkeypatch.setattr(main, "llm_breaker", breaker)
+    breaker.record(False)
+    breaker.record(False)
+    r = client.post(f"/api/sessions/{sid}/roadmap")
+    assert r.status_code == 200 and r.json()["source"] == "template"
+    assert 'ztc_admission_rejected_total{reason="queue"} ' in client.get("/api/metrics").text
+
+    # The client fails fast while open, lets one probe through once the timeout has passed, and closes on success.
+    calls = []
+
+    async def _stream(prompt, system, config, usage):
+        calls.append(prompt)
+        yield "ok"
+    llm = GeminiClient(max_retries=1, breaker=breaker)
+    monkeypatch.setattr(llm, "_stream", _stream)
+    with pytest.raises(CircuitOpenError):
+        collect(llm)
+    assert calls == [] and breaker.state == "open"
+    breaker.opened_at -= 60
+    assert breaker.state == "half_open" and breaker.allow() and not breaker.allow()
+    breaker.release()
+    assert collect(llm) == "ok" and breaker.state == "closed"
+
+
+def test_retention_deletes_abandoned_and_archives_completed_sessions(monkeypatch, tmp_path):
+    from retention import Retention, SessionArchive
+
+    # Abandoned part-way through: unfinished, so deleted rather than archived.
+    abandoned, done, fresh = new_session(answers={"id_mfa": {"answer": "yes"}}), new_session(answers=ALL_YES), new_session()
+    client.post(f"/api/sessions/{done}/email", json={"email": "ciso@example.com"})
+    main.roadmap_jobs.store_roadmap(done, GEMINI_ROADMAP, "template")
+    before = client.get(f"/api/sessions/{done}/dashboard")
+    portfolio = client.post("/api/portfolios", json={"name": "retention", "session_ids": [abandoned, done, fresh]}).json()["portfolio_id"]
+    with main.get_db(write=True) as db:
+        db.execute("UPDATE sessions SET answered_at=1000 WHERE id IN (?,?)", (abandoned, done))
+
+    archive = SessionArchive(main.db_pool, str(tmp_path))
+    monkeypatch.setattr(main, "session_archive", archive)
+    retention = Retention(main.db_pool, archive, main.benchmarks, main.PILLAR_COLUMNS, incomplete_ttl=1000 * 86400, archive_after=1000 * 86400,
+                          job_ttl=0, usage_ttl=0, chunk_size=1, pause=0)
+    done_ = retention.run()
+    assert (done_["deleted"], done_["archived"]) == (1, 1)
+    assert [f.name.endswith(".jsonl.gz") for f in tmp_path.iterdir()] == [True]
+    with main.get_db() as db:
+        for table, column in (("sessions", "id"), ("answers", "session_id"), ("dashboards", "session_id"), ("emails", "session_id")):
+            assert db.execute(f"SELECT COUNT(*) FROM {table} WHERE {column} IN (?,?)", (abandoned, done)).fetchone()[0] == 0
+
+    assert client.get(f"/api/sessions/{abandoned}").status_code == 404
+    # The deleted session leaves the portfolio; the archived one stays a member.
+    assert main.portfolios.page(portfolio) == sorted([done, fresh])
+    assert client.get(f"/api/sessions/{fresh}").json()["archived"] is False
+    session = client.get(f"/api/sessions/{done}").json()
+    assert session["archived"] and {k: a["answer"] for k, a in session["answers"].items()} == {k: "yes" for k in ALL_YES}
+    after = client.get(f"/api/sessions/{done}/dashboard")
+    assert after.json() == before.json() and after.headers["ETag"] == before.headers["ETag"]
+    assert client.get(f"/api/sessions/{done}/roadmap").json()["roadmap"] == GEMINI_ROADMAP
+    assert archive.load(done)["emails"][0]["email"] == "ciso@example.com"
+    # A rollup rebuild still counts the archived session.
+    counted = main.benchmarks.histograms("ALL")
+    main.benchmarks.rebuild(main.PILLAR_COLUMNS, [q["id"] for q in main.catalogue.current.questions])
+    assert main.benchmarks.histograms("ALL") == counted
+    assert client.post("/api/maintenance/retention", params={"full_vacuum": True}).status_code == 401
+    assert set(client.post("/api/maintenance/retention", headers=ADMIN).json()) >= {"deleted", "archived", "jobs_pruned", "usage_pruned"}
+
+
+def test_email_outbox_sends_each_report_once_with_retries():
+    from outbox import EmailOutbox
+
+    class FlakyTransport:
+        def __init__(self, failures):
+            self.failures, self.sent = failures, []
+
+        def send_batch(self, messages):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionRefusedError("smtp down")
+            self.sent += messages
+            return [None] * len(messages)
+
+    sid = new_session(answers=ALL_YES)
+    for email in ("CISO@example.com", " ciso@example.com ", "cto@example.com"):
+        assert client.post(f"/api/sessions/{sid}/email", json={"email": email}).json()["ok"]
+    transport = FlakyTransport(failures=1)
+    outbox = EmailOutbox(main.db_pool, main.report_context, transport, "ZT Compass <noreply@example.com>", backoff=0)
+
+    async def _deliver():
+        try:
+            return [await outbox.run_once() for _ in range(3)]
+        finally:
+            await outbox.stop()
+    assert asyncio.run(_deliver()) == [2, 2, 0]
+    assert sorted(m["To"] for m in transport.sent) == ["ciso@example.com", "cto@example.com"]
+    message = transport.sent[0]
+    assert message["Subject"] == "Your Zero Trust assessment: 100/100" and message["Message-ID"].endswith(f".{sid}@example.com>")
+    assert "Top risks" in message.get_body(("plain",)).get_content() and "<h2>30/60/90-day roadmap</h2>" in message.get_body(("html",)).get_content()
+    with main.get_db() as db:
+        rows = db.execute("SELECT status, attempts, error FROM email_outbox WHERE session_id=?", (sid,)).fetchall()
+    assert [(r["status"], r["attempts"], r["error"]) for r in rows] == [("sent", 2, None)] * 2
+
+    # Captured again after delivery: nothing new to send. A session that is gone fails without retries.
+    client.post(f"/api/sessions/{sid}/email", json={"email": "cto@example.com"})
+    gone = new_session()
+    client.post(f"/api/sessions/{gone}/email", json={"email": "cto@example.com"})
+    with main.get_db(write=True) as db:
+        db.execute("DELETE FROM sessions WHERE id=?", (gone,))
+    outbox = EmailOutbox(main.db_pool, main.report_context, transport, "noreply@example.com", render_processes=0)
+    assert asyncio.run(outbox.run_once()) == 1 and len(transport.sent) == 2
+    assert outbox.stats()["failed"] >= 1 and main.email_outbox.stats()["sent"] >= 2
+    text = client.get("/api/metrics").text
+    assert 'ztc_emails_total{result="retry"}' in text and 'ztc_email_outbox{status="sent"}' in text
+
+    # Header-breaking addresses are refused at capture; one that got into the outbox anyway fails alone.
+    for bad in ("cto@example.com\r\nBcc: all@example.com", "CTO <cto@example.com>", "cto"):
+        assert client.post(f"/api/sessions/{sid}/email", json={"email": bad}).status_code == 422
+    other = new_session(answers=ALL_YES)
+    client.post(f"/api/sessions/{other}/email", json={"email": "ok@example.com"})
+    with main.get_db(write=True) as db:
+        main.email_outbox.enqueue(db, other, "ok2@example.com")
+        db.execute("UPDATE email_outbox SET email=? WHERE session_id=? AND email=?", ("x@example.com\r\nBcc: y@example.com", other, "ok2@example.com"))
+    assert asyncio.run(outbox.run_once()) == 2 and sorted(m["To"] for m in transport.sent[2:]) == ["ok@example.com"]
+    with main.get_db() as db:
+        rows = db.execute("SELECT email, status FROM email_outbox WHERE session_id=? ORDER BY email", (other,)).fetchall()
+    assert [r["status"] for r in rows] == ["sent", "failed"]
+
+
+def test_smtp_transport_against_local_debug_server():
+    import warnings
+    import threading
+    from outbox import SMTPTransport
+    from email.message import EmailMessage
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        smtpd = pytest.importorskip("smtpd")  # stdlib up to Python 3.11
+        import asyncore
+
+    received = []
+
+    class Sink(smtpd.SMTPServer):
+        def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+            received.append((rcpttos, data))
+
+    server = Sink(("127.0.0.1", 0), None, decode_data=False)
+    loop = threading.Thread(target=asyncore.loop, kwargs={"timeout": 0.05}, daemon=True)
+    loop.start()
+    try:
+        messages = []
+        for to in ("a@example.com", "b@example.com"):
+            m = EmailMessage()
+            m["From"], m["To"], m["Subject"] = "noreply@example.com", to, "report"
+            m.set_content("hello")
+            messages.append(m)
+        transport = SMTPTransport("127.0.0.1", server.socket.getsockname()[1], starttls=False, timeout=5)
+        assert transport.send_batch(messages) == [None, None]
+    finally:
+        server.close()
+        loop.join(2)
+    assert [r[0] for r in received] == [["a@example.com"], ["b@example.com"]]
+
+
+def test_cold_start_defers_work_until_ready(monkeypatch):
+    import sys
+    import gzip
+    import subprocess
+    from content import Encoded
+
+    # Importing the app loads neither the Gemini SDK nor numpy, and an up-to-date schema needs no migration.
+    code = "import sys, main; print('google.generativeai' in sys.modules, 'numpy' in sys.modules, main.init_db())"
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(main.__file__), capture_output=True, text=True, timeout=60)
+    assert out.stdout.split() == ["False", "False", "[]"], out.stderr
+
+    doc = Encoded({"title": "Identity"})
+    assert doc._gzip is None and gzip.decompress(doc.gzip) == doc.identity
+
+    main.warmed.clear()
+    assert client.get("/api/health").status_code == 200
+    r = client.get("/api/ready")
+    assert r.status_code == 503 and r.json()["checks"] == {"warmed": False, "database": True}
+    with TestClient(main.app) as c:
+        deadline = time.monotonic() + 10
+        while c.get("/api/ready").status_code != 200 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        r = c.get("/api/ready").json()
+    assert r["status"] == "ready" and {"import", "warmup"} <= set(r["startup_seconds"])
+    assert 'ztc_startup_seconds{phase="warmup"}' in client.get("/api/metrics").text
+
+    # A failing optional step (SDK import, content) is logged and does not hold readiness back.
+    def _boom():
+        raise ImportError("no SDK")
+    monkeypatch.setattr(main, "ROADMAP_REFINE", True)
+    monkeypatch.setattr(main, "LLM_WARMUP", True)
+    monkeypatch.setattr(main.llm, "warm", _boom)
+    monkeypatch.setattr(main.content, "warm", _boom)
+    main.warmed.clear()
+    main.warm_up()
+    assert main.warmed.is_set() and client.get("/api/ready").status_code == 200
+
+    # A failing required step (database, migrations) is logged and retried until it passes.
+    failures = []
+    real_init_db = main.init_db
+
+    def _flaky_init_db():
+        if len(failures) < 2:
+            failures.append(1)
+            raise RuntimeError("database unavailable")
+        return real_init_db()
+    monkeypatch.setattr(main, "init_db", _flaky_init_db)
+    monkeypatch.setattr(main, "WARMUP_RETRY_MAX", 0.01)
+    main.warmed.clear()
+    main.warm_up()
+    assert len(failures) == 2 and main.warmed.is_set()
+    stop = threading.Event()
+    stop.set()
+    monkeypatch.setattr(main, "init_db", lambda: 1 / 0)
+    main.warmed.clear()
+    main.warm_up(stop)  # shutting down: gives up without marking the instance ready
+    assert not main.warmed.is_set()
+    main.warmed.set()
+
+
+def test_gemini_rest_endpoint_against_offline_stand_in():
+    import httpx
+    from fake_gemini import create_app
+    from stats import summarize, compare
+
+    fake = create_app(latency=0, seed=1)
+    llm = GeminiClient(endpoint="http://fake-gemini", api_key="k", max_retries=3, backoff_base=0.001,
+                       http_transport=httpx.ASGITransport(app=fake))
+    async def _stream():
+        return [chunk async for chunk in llm.generate_stream("p")]
+    chunks = asyncio.run(_stream())
+    assert len(chunks) == 8 and len(parse_roadmap("".join(chunks))["30_day"]) == 5
+    assert set(parse_roadmap(collect(llm))) == {"30_day", "60_day", "90_day"}
+
+    fake.state.config.update(malformed_rate=1.0)
+    with pytest.raises(ValueError):
+        parse_roadmap(collect(llm))
+
+    fake.state.config.update(malformed_rate=0.0, error_rate=1.0)
+    with pytest.raises(httpx.HTTPStatusError):
+        collect(llm)
+    assert fake.state.stats["errors"] == 3
+
+    summary = summarize([i / 1000 for i in range(1, 101)], elapsed=2.0)
+    assert (summary["p50"], summary["p95"], summary["p99"], summary["throughput"]) == (50.0, 95.0, 99.0, 50.0)
+    assert compare({"flow": {**summary, "p95": 120.0}}, {"results": {"flow": summary}}, tolerance=0.2) == ["flow.p95: 120.0 vs baseline 95.0 (+26%)"]